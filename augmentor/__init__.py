@@ -1,6 +1,8 @@
 from .augment import Augment, Compose, Blend
 from .blur import *
 from .box import *
+from .cast import *
+from .distortion import *
 from .flip import *
 from .grayscale import *
 from .label import Label
@@ -9,4 +11,5 @@ from .misalign import *
 from .missing import *
 from .noise import *
 from .track import *
-from .warp import Warp
+from .tta import *
+from .warp import Warp, ElasticWarp
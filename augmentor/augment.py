@@ -9,6 +9,10 @@ class Augment(object):
     """
     Abstract interface.
     """
+    # Whether the augment accepts strided views (e.g. flipped or transposed)
+    # of its inputs, so that Compose can defer copying them.
+    view_compatible = False
+
     def __init__(self):
         raise NotImplementedError
 
@@ -57,8 +61,19 @@ class Compose(Augment):
         return dict(spec)
 
     def __call__(self, sample, **kwargs):
-        for aug in self.augments:
-            sample = aug(sample, **kwargs)
+        # Runs of consecutive view-compatible augments are applied lazily.
+        stages = self._stages()
+        i = 0
+        while i < len(stages):
+            j = i
+            while j < len(stages) and stages[j].view_compatible:
+                j += 1
+            if j - i > 1:
+                sample = Compose._transform(stages[i:j], sample, **kwargs)
+                i = j
+            else:
+                sample = stages[i](sample, **kwargs)
+                i += 1
         return Augment.sort(sample)
 
     def __repr__(self):
@@ -69,6 +84,93 @@ class Compose(Augment):
         format_string += '\n)'
         return format_string
 
+    def _stages(self):
+        """Augments in the order they are applied, with nested ``Compose``
+        flattened."""
+        stages = []
+        for aug in self.augments:
+            if isinstance(aug, Compose) and type(aug).__call__ is Compose.__call__:
+                stages.extend(aug._stages())
+            else:
+                stages.append(aug)
+        return stages
+
+    @staticmethod
+    def _transform(stages, sample, **kwargs):
+        """Apply a run of view-compatible augments with as few copies as
+        possible.
+
+        Flips and transposes become strided views, which the following
+        augments read directly. Views of the input arrays are copied once
+        before an augment perturbs them in place, so that the caller's arrays
+        are never written through a view. Augments that leave this sample as
+        it is (e.g. a skipped warp) copy nothing. The last warp writes
+        into a new array in the final orientation through the inverse views
+        of the flips and transposes following it, so that every key is
+        written once. If that would scatter the rows of the warp (a transpose
+        of the last axis), or if other augments follow it, the remaining views
+        are copied once at the end instead.
+        """
+        sample = Augment.to_tensor(sample)
+        inputs = dict(sample)
+        warps = [n for n, aug in enumerate(stages)
+                 if hasattr(aug, 'warp') and aug.do_warp]
+        for n, aug in enumerate(stages):
+            if hasattr(aug, 'view'):
+                for k, v in sample.items():
+                    sample[k] = aug.view(v)
+                continue
+
+            post = stages[n+1:]
+            if (not warps or n != warps[-1] or
+                    not all(hasattr(a, 'view') for a in post)):
+                if n not in warps and not Compose._skipped(aug):
+                    Compose._detach(sample, inputs)
+                sample = aug(sample, **kwargs)
+                continue
+
+            # Last warp, followed by flips and transposes only.
+            out, dest = dict(), dict()
+            for k, v in sample.items():
+                shape = (v.shape[0],) + tuple(aug.spec[k][-3:])
+                out[k], dest[k] = utils.empty_oriented(shape, v.dtype, post)
+                if abs(dest[k].strides[-1]) != dest[k].itemsize:
+                    del out[k], dest[k]
+            warped = aug.warp(sample, out=dest)
+            for k, v in warped.items():
+                if k not in out:
+                    for a in post:
+                        v = a.view(v)
+                    out[k] = np.ascontiguousarray(v)
+            sample.update(out)
+            return Augment.sort(sample)
+
+        # Materialize the remaining views.
+        for k, v in sample.items():
+            if v is not inputs.get(k) and not v.flags.c_contiguous:
+                sample[k] = np.ascontiguousarray(v)
+        return Augment.sort(sample)
+
+    @staticmethod
+    def _skipped(aug):
+        """Whether a prepared view-compatible augment leaves the sample as it
+        is."""
+        if hasattr(aug, 'warp'):
+            return not aug.do_warp
+        if hasattr(aug, 'entries'):
+            return aug.entries is None or len(aug.entries['z']) == 0
+        return not getattr(aug, 'do_aug', True)
+
+    @staticmethod
+    def _detach(sample, inputs):
+        """Copy the views of the input arrays in sample, before an augment
+        perturbs them in place. The input arrays themselves are left as
+        they are, as they would be outside ``Compose``."""
+        for k, v in sample.items():
+            u = inputs.get(k)
+            if u is not None and v is not u and np.may_share_memory(v, u):
+                sample[k] = v.copy()
+
 
 class Blend(Augment):
     """Blends several augments together.
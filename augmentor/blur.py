@@ -12,10 +12,13 @@ __all__ = ['BlurrySection', 'PartialBlurrySection', 'MixedBlurrySection']
 class BlurrySection(Section):
     """
     Simulate full out-of-focus sections in a training sample.
+
+    Sections are blurred in-plane only, all in a single call with a sigma
+    per section.
     """
-    def __init__(self, sigma=5.0, random=True, **kwargs):
+    def __init__(self, sigma=5.0, random=True, backend='auto', **kwargs):
         super(BlurrySection, self).__init__(perturb.Blur, **kwargs)
-        self.params = dict(sigma=sigma, random=random)
+        self.params = dict(sigma=sigma, random=random, backend=backend)
 
 
 class PartialBlurrySection(PartialSection):
@@ -121,13 +121,15 @@ class BoxOcclusion(Augment):
             if count > goal:
                 break
 
+        # Integer images saturate on their own.
         for k in self.imgs:
-            sample[k] = np.clip(sample[k], 0, 1)
+            if not np.issubdtype(sample[k].dtype, np.integer):
+                sample[k] = np.clip(sample[k], 0, 1)
 
         return sample
 
 
-from .perturb import Fill, Blur, Noise
+from .perturb import Fill, Blur, Noise, Texture
 
 
 class FillBox(BoxOcclusion):
@@ -143,6 +145,42 @@ class BlurBox(BoxOcclusion):
 
 
 class NoiseBox(BoxOcclusion):
-    def __init__(self, sigma=(2,5), **kwargs):
-        super(NoiseBox, self).__init__(Noise, **kwargs)
+    """
+    Fill boxes with crops of a bank of pre-filtered ``Noise`` textures,
+    instead of filtering noise for every box.
+
+    Args:
+        sigma (2-tuple, optional): ``Noise`` sigma.
+        bank (int, optional): number of texture sections in the bank.
+        refresh (int, optional): number of samples after which the bank is
+            drawn again.
+    """
+    def __init__(self, sigma=(2,5), bank=32, refresh=100, **kwargs):
+        super(NoiseBox, self).__init__(Texture, **kwargs)
         self.params = dict(sigma=sigma)
+        self.bank_size = max(int(bank), 1)
+        self.refresh = max(int(refresh), 1)
+        self.bank = None
+        self.count = 0
+
+    def prepare(self, spec, imgs=[], **kwargs):
+        self.count += 1
+        if self.count > self.refresh:
+            self.bank = None
+        return super(NoiseBox, self).prepare(spec, imgs=imgs, **kwargs)
+
+    def get_perturb(self):
+        if self.bank is None:
+            self.bank = self.build_bank()
+            self.count = 1
+        return Texture(self.bank)
+
+    def build_bank(self):
+        """Draw a (bank,y,x) stack of noise textures."""
+        # Twice the largest box, trimmed of the blur borders.
+        size = 2 * int(self.dims[1])
+        trim = int(np.ceil(2 * max(self.params['sigma'])))
+        bank = np.empty((self.bank_size,) + (size + 2*trim,) * 2,
+                        dtype=np.float32)
+        Noise(**self.params)(bank)
+        return np.ascontiguousarray(bank[:,trim:-trim or None,trim:-trim or None])
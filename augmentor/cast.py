@@ -0,0 +1,43 @@
+from __future__ import print_function
+import numpy as np
+
+from . import utils
+from .augment import Augment
+
+
+__all__ = ['ToFloat']
+
+
+class ToFloat(Augment):
+    """Cast images to floating point in [0,1].
+
+    Intensity augments work on uint8 images directly, so this is meant to be
+    the last stage of a pipeline, right before the network input.
+
+    Args:
+        dtype (optional): floating point dtype.
+    """
+    def __init__(self, dtype='float32'):
+        self.dtype = np.dtype(dtype)
+        self.imgs = []
+
+    def prepare(self, spec, imgs=[], **kwargs):
+        self.imgs = self._validate(spec, imgs)
+        return dict(spec)
+
+    def __call__(self, sample, **kwargs):
+        sample = Augment.to_tensor(sample)
+        for k in self.imgs:
+            sample[k] = utils.to_float(sample[k], dtype=self.dtype)
+        return Augment.sort(sample)
+
+    def __repr__(self):
+        format_string = self.__class__.__name__ + '('
+        format_string += 'dtype={}'.format(self.dtype)
+        format_string += ')'
+        return format_string
+
+    def _validate(self, spec, imgs):
+        assert len(imgs) > 0
+        assert all(k in spec for k in imgs)
+        return imgs
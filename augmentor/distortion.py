@@ -0,0 +1,25 @@
+from __future__ import print_function
+
+from .section import Section
+from . import perturb
+
+
+__all__ = ['SectionWarp']
+
+
+class SectionWarp(Section):
+    """
+    Simulate per-section distortions (rotation, shear, scale and perspective
+    stretch) in a training sample.
+
+    Every selected section is warped in place with its own 2D transformation,
+    in a single batched kernel call per image. Other sections are neither
+    copied nor touched. Source pixels outside of a section are clamped to its
+    border.
+    """
+    def __init__(self, rot_max=3.0, shear_max=1.0, scale_max=1.05,
+                 stretch_max=0.05, threads=1, **kwargs):
+        super(SectionWarp, self).__init__(perturb.Warp2D, **kwargs)
+        self.params = dict(rot_max=rot_max, shear_max=shear_max,
+                           scale_max=scale_max, stretch_max=stretch_max,
+                           threads=threads)
@@ -13,10 +13,14 @@ class Flip(Augment):
     Args:
         axis (int):
         prob (float, optional):
+        lazy (bool, optional): return strided views instead of copies.
     """
-    def __init__(self, axis, prob=0.5):
+    view_compatible = True
+
+    def __init__(self, axis, prob=0.5, lazy=False):
         self.axis = axis
         self.prob = np.clip(prob, 0, 1)
+        self.lazy = lazy
         self.do_aug = False
 
     def prepare(self, spec, **kwargs):
@@ -28,10 +32,21 @@ class Flip(Augment):
         sample = Augment.to_tensor(sample)
         if self.do_aug:
             for k, v in sample.items():
-                # Prevent potential negative stride issues by copying.
-                sample[k] = np.copy(np.flip(v, self.axis))
+                if self.lazy:
+                    sample[k] = self.view(v)
+                else:
+                    # Prevent potential negative stride issues by copying.
+                    sample[k] = np.copy(np.flip(v, self.axis))
         return Augment.sort(sample)
 
+    def view(self, data):
+        """Apply the flip to a tensor as a view, without copying."""
+        return np.flip(data, self.axis) if self.do_aug else data
+
+    def inverse_view(self, data):
+        """Undo the flip on a tensor as a view, without copying."""
+        return self.view(data)
+
     def __repr__(self):
         format_string = self.__class__.__name__ + '('
         format_string += 'axis={}, '.format(self.axis)
@@ -46,11 +61,15 @@ class Transpose(Augment):
     Args:
         axes (list of int, optional):
         prob (float, optional):
+        lazy (bool, optional): return strided views instead of copies.
     """
-    def __init__(self, axes=None, prob=0.5):
+    view_compatible = True
+
+    def __init__(self, axes=None, prob=0.5, lazy=False):
         assert (axes is None) or (len(axes)==4)
         self.axes = axes
         self.prob = np.clip(prob, 0, 1)
+        self.lazy = lazy
         self.do_aug = False
 
     def prepare(self, spec, **kwargs):
@@ -69,10 +88,24 @@ class Transpose(Augment):
         sample = Augment.to_tensor(sample)
         if self.do_aug:
             for k, v in sample.items():
-                # Prevent potential negative stride issues by copying.
-                sample[k] = np.copy(np.transpose(v, self.axes))
+                if self.lazy:
+                    sample[k] = self.view(v)
+                else:
+                    # Prevent potential negative stride issues by copying.
+                    sample[k] = np.copy(np.transpose(v, self.axes))
         return Augment.sort(sample)
 
+    def view(self, data):
+        """Apply the transpose to a tensor as a view, without copying."""
+        return np.transpose(data, self.axes) if self.do_aug else data
+
+    def inverse_view(self, data):
+        """Undo the transpose on a tensor as a view, without copying."""
+        if not self.do_aug:
+            return data
+        axes = None if self.axes is None else np.argsort(self.axes)
+        return np.transpose(data, axes)
+
     def __repr__(self):
         format_string = self.__class__.__name__ + '('
         format_string += 'axes={}, '.format(self.axes)
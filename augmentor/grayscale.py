@@ -15,6 +15,8 @@ class Grayscale3D(Augment):
 
     Randomly adjust contrast/brightness, and apply random gamma correction.
     """
+    view_compatible = True
+
     def __init__(self, contrast_factor=0.3, brightness_factor=0.3, skip=0.3):
         self.contrast_factor = contrast_factor
         self.brightness_factor = brightness_factor
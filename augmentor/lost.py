@@ -2,6 +2,7 @@ from __future__ import print_function
 import numpy as np
 
 from .augment import Augment
+from . import utils
 
 
 __all__ = ['LostSection', 'LostPlusMissing']
@@ -10,6 +11,9 @@ __all__ = ['LostSection', 'LostPlusMissing']
 class LostSection(Augment):
     """Lost section augmentation.
 
+    The sections are reassembled straight into the final orientation of
+    ``flip_rotate``, if set (``None`` by default, as for ``Track``).
+
     Args:
         nsec: number of consecutive lost sections.
         skip (float, optional): skip probability.
@@ -21,13 +25,20 @@ class LostSection(Augment):
         self.nsec = max(nsec, 1)
         self.skip = np.clip(skip, 0, 1)
         self.zloc = {}
+        self.slabs = {}
+        self.flip_rotate = None
+        self.final = dict()
 
     def prepare(self, spec, **kwargs):
         # Biased coin toss
         if np.random.rand() < self.skip:
             self.zloc = {}
+            self.slabs = {}
             return dict(spec)
 
+        if self.flip_rotate is not None:
+            spec = self.flip_rotate.prepare(spec, **kwargs)
+
         # Random sections
         zmin = self._validate(spec) - 1
         zloc = np.random.choice(zmin, 1, replace=False) + 1
@@ -40,6 +51,12 @@ class LostSection(Augment):
             offset = (zdim - zmin) // 2
             self.zloc[k] = offset + zloc
 
+        # Source sections of the output.
+        self.spec = dict(spec)
+        self.slabs = dict()
+        for k, v in spec.items():
+            self.slabs[k] = self._slabs(k, v[-3])
+
         # Update spec
         spec = dict(spec)
         for k, v in spec.items():
@@ -51,14 +68,7 @@ class LostSection(Augment):
     def __call__(self, sample, **kwargs):
         sample = Augment.to_tensor(sample)
         if len(self.zloc) > 0:
-            nsec = self.nsec
-            for k, v in sample.items():
-                zloc = self.zloc[k]
-                c, z, y, x = v.shape[-4:]
-                w = np.zeros((c, z - nsec, y, x), dtype=v.dtype)
-                w[:,:zloc,:,:] = v[:,:zloc,:,:]
-                w[:,zloc:,:,:] = v[:,zloc+nsec:,:,:]
-                sample[k] = w
+            sample = self.finalize(self.reassemble(sample))
         return Augment.sort(sample)
 
     def __repr__(self):
@@ -68,12 +78,44 @@ class LostSection(Augment):
         format_string += ')'
         return format_string
 
+    def reassemble(self, sample):
+        """Reassemble the sections of every key, writing straight into the
+        final orientation of flip_rotate. Returns views of the outputs before
+        flip_rotate, to be passed to finalize."""
+        for k, v in sample.items():
+            w = self._empty(k, v)
+            utils.take_slabs(v, self.slabs[k], w.shape[-3:], out=w)
+            sample[k] = w
+        return sample
+
+    def finalize(self, sample):
+        """Replace the outputs of reassemble by their arrays in the final
+        orientation, which applies flip_rotate without copying."""
+        sample.update(self.final)
+        self.final = dict()
+        return Augment.sort(sample)
+
+    def _empty(self, key, data):
+        """Uninitialized output of key, allocated in the final orientation
+        and returned as a view before flip_rotate."""
+        shape = data.shape[:-3] + (self.spec[key][-3],) + data.shape[-2:]
+        augs = [] if self.flip_rotate is None else self.flip_rotate._stages()
+        self.final[key], w = utils.empty_oriented(shape, data.dtype, augs)
+        return w
+
     def _validate(self, spec):
         zdims = [v[-3] for v in spec.values()]
         zmin = min(zdims)
         assert zmin > 1
         return zmin
 
+    def _slabs(self, key, zdim):
+        """Source z-slabs of the output sections of key."""
+        zloc, nsec = self.zloc[key], self.nsec
+        yx = (slice(None), slice(None))
+        return [(0, zloc, (slice(0, zloc),) + yx),
+                (zloc, zdim, (slice(zloc + nsec, zdim + nsec),) + yx)]
+
 
 class LostPlusMissing(LostSection):
     def __init__(self, skip=0, value=0, random=False):
@@ -83,10 +125,10 @@ class LostPlusMissing(LostSection):
         self.imgs = []
 
     def prepare(self, spec, imgs=[], **kwargs):
-        spec = super(LostPlusMissing, self).prepare(spec)
         assert len(imgs) > 0
         assert all(k in spec for k in imgs)
         self.imgs = imgs
+        spec = super(LostPlusMissing, self).prepare(spec)
         return dict(spec)
 
     def __call__(self, sample, **kwargs):
@@ -98,29 +140,28 @@ class LostPlusMissing(LostSection):
         if len(self.zloc) > 0:
             val = np.random.rand() if self.random else self.value
             assert self.nsec == 2
-            nsec = self.nsec
-            for k, v in sample.items():
-                zloc = self.zloc[k]
+            sample = self.reassemble(sample)
 
-                # New tensor
-                c, z, y, x = v.shape[-4:]
-                w = np.zeros((c, z - nsec, y, x), dtype=v.dtype)
+            # Missing part
+            for k in self.imgs:
+                w = sample[k]
+                w[:,self.zloc[k],...] = utils.from_float(val, w.dtype)
 
-                # Non-missing part
-                w[:,:zloc,:,:] = v[:,:zloc,:,:]
-                w[:,zloc+1:,:,:] = v[:,zloc+nsec+1:,:,:]
-
-                # Missing part
-                if k in self.imgs:
-                    w[:,zloc,...] = val
-                else:
-                    w[:,zloc,...] = v[:,zloc+1,:,:]
-
-                # Update sample
-                sample[k] = w
+            sample = self.finalize(sample)
 
         return Augment.sort(sample)
 
+    def _slabs(self, key, zdim):
+        """Source z-slabs of the output sections of key. The missing
+        section of images is filled instead."""
+        zloc, nsec = self.zloc[key], self.nsec
+        yx = (slice(None), slice(None))
+        slabs = [(0, zloc, (slice(0, zloc),) + yx),
+                 (zloc + 1, zdim, (slice(zloc + nsec + 1, zdim + nsec),) + yx)]
+        if key not in self.imgs:
+            slabs.append((zloc, zloc + 1, (slice(zloc + 1, zloc + 2),) + yx))
+        return slabs
+
     def __repr__(self):
         format_string = self.__class__.__name__ + '('
         format_string += 'nsec={:}, '.format(self.nsec)
@@ -8,7 +8,7 @@ from . import utils
 
 
 __all__ = ['Misalign','MisalignPlusMissing',
-           'MisalignTrackMissing','SlipMisalign']
+           'MisalignTrackMissing','SlipMisalign','MultiMisalign']
 
 
 class Misalign(Augment):
@@ -29,6 +29,7 @@ class Misalign(Augment):
         self.ty = 0
         self.zmin = 2
         self.flip_rotate = FlipRotate()
+        self.final = dict()
 
     def prepare(self, spec, **kwargs):
         spec = self.flip_rotate.prepare(spec, **kwargs)
@@ -62,7 +63,7 @@ class Misalign(Augment):
         return spec
 
     def __call__(self, sample, **kwargs):
-        return self.flip_rotate(self.misalign(sample))
+        return self.finalize(self.misalign(sample))
 
     def __repr__(self):
         format_string = self.__class__.__name__ + '('
@@ -72,22 +73,39 @@ class Misalign(Augment):
         return format_string
 
     def misalign(self, sample):
+        """Misalign every key, writing straight into the final orientation
+        of flip_rotate. Returns views of the outputs before flip_rotate, to be
+        passed to finalize."""
         sample = Augment.to_tensor(sample)
-
         for k, v in sample.items():
-            # New tensor
-            w = np.zeros(self.spec[k], dtype=v.dtype)
-            w = utils.to_tensor(w)
-
-            # Misalign.
-            z, y, x = w.shape[-3:]
-            zloc = self.zlocs[k]
-            w[:,:zloc,...] = v[:,:zloc,:y,:x]
-            w[:,zloc:,...] = v[:,zloc:,-y:,-x:]
+            w = self._empty(k, v)
+            utils.take_slabs(v, self._slabs(k), w.shape[-3:], out=w)
             sample[k] = w
+        return sample
 
+    def finalize(self, sample):
+        """Replace the outputs of misalign by their arrays in the final
+        orientation, which applies flip_rotate without copying."""
+        sample.update(self.final)
+        self.final = dict()
         return Augment.sort(sample)
 
+    def _empty(self, key, data):
+        """Uninitialized output of key, allocated in the final orientation
+        and returned as a view before flip_rotate."""
+        shape = data.shape[:-3] + tuple(self.spec[key][-3:])
+        augs = self.flip_rotate._stages()
+        self.final[key], w = utils.empty_oriented(shape, data.dtype, augs)
+        return w
+
+    def _slabs(self, key):
+        """Source z-slabs of the output sections of key."""
+        z, y, x = self.spec[key][-3:]
+        zloc = self.zlocs[key]
+        return [(0, zloc, (slice(0, zloc), slice(0, y), slice(0, x))),
+                (zloc, z, (slice(zloc, z), slice(self.ty, self.ty + y),
+                           slice(self.tx, self.tx + x)))]
+
 
 class MisalignPlusMissing(Misalign):
     """
@@ -111,42 +129,41 @@ class MisalignPlusMissing(Misalign):
         sample = Augment.to_tensor(sample)
         sample = self.misalign(sample)
         sample = self.missing(sample)
-        sample = self.flip_rotate(sample)
-        return Augment.sort(sample)
+        return self.finalize(sample)
 
     def _validate(self, spec, imgs):
         assert len(imgs) > 0
         assert all(k in spec for k in imgs)
         return imgs
 
-    def misalign(self, sample):
-        for k, v in sample.items():
-            # New tensor
-            w = np.zeros(self.spec[k], dtype=v.dtype)
-            w = utils.to_tensor(w)
-
-            # Misalign.
-            z, y, x = w.shape[-3:]
-            zloc = self.zlocs[k]
-            w[:,:zloc,...] = v[:,:zloc,:y,:x]
-            w[:,zloc:,...] = v[:,zloc:,-y:,-x:]
-
-            if k not in self.imgs:
-                # Target interpolation
-                if self.both:
-                    tx = round(self.tx / 3.0)
-                    ty = round(self.ty / 3.0)
-                    w[:,zloc-1,...] = v[:,zloc-1,ty:ty+y,tx:tx+x]
-                    w[:,zloc,...] = v[:,zloc,-ty-y:-ty,-tx-x:-tx]
-                else:
-                    tx = round(self.tx / 2.0)
-                    ty = round(self.ty / 2.0)
-                    w[:,zloc,...] = v[:,zloc,ty:ty+y,tx:tx+x]
-
-            # Update sample.
-            sample[k] = w
-
-        return sample
+    def _slabs(self, key):
+        """Source z-slabs of the output sections of key, with target
+        interpolation for non-images."""
+        slabs = super(MisalignPlusMissing, self)._slabs(key)
+        if key in self.imgs:
+            return slabs
+
+        # Target interpolation
+        z, y, x = self.spec[key][-3:]
+        zloc = self.zlocs[key]
+        (_, _, lower), (_, _, upper) = slabs
+        if self.both:
+            tx = round(self.tx / 3.0)
+            ty = round(self.ty / 3.0)
+            return [(0, zloc-1, (slice(0, zloc-1),) + lower[1:]),
+                    (zloc-1, zloc, (slice(zloc-1, zloc), slice(ty, ty+y),
+                                    slice(tx, tx+x))),
+                    (zloc, zloc+1, (slice(zloc, zloc+1),
+                                    slice(self.ty-ty, self.ty-ty+y),
+                                    slice(self.tx-tx, self.tx-tx+x))),
+                    (zloc+1, z, (slice(zloc+1, z),) + upper[1:])]
+        else:
+            tx = round(self.tx / 2.0)
+            ty = round(self.ty / 2.0)
+            return [(0, zloc, lower),
+                    (zloc, zloc+1, (slice(zloc, zloc+1), slice(ty, ty+y),
+                                    slice(tx, tx+x))),
+                    (zloc+1, z, (slice(zloc+1, z),) + upper[1:])]
 
     def missing(self, sample):
         val = np.random.rand() if self.random else self.value
@@ -154,9 +171,10 @@ class MisalignPlusMissing(Misalign):
         for k in self.imgs:
             zloc = self.zlocs[k]
             img = sample[k]
-            img[:,zloc,...] = val
+            fill = utils.from_float(val, img.dtype)
+            img[:,zloc,...] = fill
             if self.both:
-                img[:,zloc-1,...] = val
+                img[:,zloc-1,...] = fill
             sample[k] = img
 
         return sample
@@ -182,8 +200,7 @@ class MisalignTrackMissing(MisalignPlusMissing):
         sample = self.misalign(sample)
         sample = self.track(sample)
         sample = self.missing(sample)
-        sample = self.flip_rotate(sample)
-        return Augment.sort(sample)
+        return self.finalize(sample)
 
 
 class SlipMisalign(Misalign):
@@ -200,7 +217,7 @@ class SlipMisalign(Misalign):
         return dict(spec)
 
     def __call__(self, sample, **kwargs):
-        return self.flip_rotate(self.misalign(sample))
+        return self.finalize(self.misalign(sample))
 
     def __repr__(self):
         format_string = self.__class__.__name__ + '('
@@ -215,20 +232,103 @@ class SlipMisalign(Misalign):
         assert all(k in spec for k in imgs)
         return imgs
 
-    def misalign(self, sample):
-        sample = Augment.to_tensor(sample)
+    def _slabs(self, key):
+        """Source z-slabs of the output sections of key: only the section
+        at zloc slips."""
+        z, y, x = self.spec[key][-3:]
+        zloc = self.zlocs[key]
+        yx = (slice(0, y), slice(0, x))
+        if (key in self.imgs) or (not self.interp):
+            slip = (slice(self.ty, self.ty + y), slice(self.tx, self.tx + x))
+        else:
+            slip = yx
+        return [(0, zloc, (slice(0, zloc),) + yx),
+                (zloc, zloc+1, (slice(zloc, zloc+1),) + slip),
+                (zloc+1, z, (slice(zloc+1, z),) + yx)]
+
+
+class MultiMisalign(Augment):
+    """Translational misalignment of multiple sections.
+
+    Every misaligned section displaces itself and all the following sections
+    by a random step, so that offsets accumulate along z. The output is
+    allocated once and every voxel copied once, whatever the number of
+    misalignments.
 
-        for k, v in sample.items():
-            # New tensor
-            w = np.zeros(self.spec[k], dtype=v.dtype)
-            w = utils.to_tensor(w)
+    Args:
+        disp (2-tuple of int): Min/max displacement of each step, in either
+            direction.
+        maxsec (int, optional): Max number of misaligned sections.
+        prob (float, optional): Misalignment probability of each section,
+            used instead of maxsec.
+        margin (int):
+    """
+    def __init__(self, disp, maxsec=0, prob=None, margin=0):
+        assert (maxsec > 0) or (prob is not None)
+        self.disp = disp
+        self.maxsec = max(maxsec, 0)
+        self.prob = np.clip(prob, 0, 1) if prob is not None else prob
+        self.margin = max(margin, 0)
+        self.offsets = dict()
 
-            # Misalign.
-            z, y, x = w.shape[-3:]
-            zloc = self.zlocs[k]
-            w[...] = v[...,:y,:x]
-            if (k in self.imgs) or (not self.interp):
-                w[:,zloc,...] = v[:,zloc,-y:,-x:]
-            sample[k] = w
+    def prepare(self, spec, **kwargs):
+        # Original spec
+        self.spec = dict(spec)
+
+        # Pick sections to misalign.
+        zdims = dict((k, v[-3]) for k, v in spec.items())
+        zmin = min(zdims.values())
+        assert zmin >= 2*self.margin + 2
+        zrange = np.arange(self.margin + 1, zmin - self.margin)
+        if self.prob is None:
+            nsecs = np.random.randint(1, min(self.maxsec, len(zrange)) + 1)
+            zlocs = np.random.choice(zrange, nsecs, replace=False)
+        else:
+            zlocs = zrange[np.random.rand(len(zrange)) <= self.prob]
+        self.zlocs = np.sort(zlocs)
+
+        # Random signed (y,x) steps, accumulated along z.
+        steps = np.zeros((zmin, 2), dtype=np.int64)
+        nsecs = len(self.zlocs)
+        sign = np.where(np.random.rand(nsecs, 2) < 0.5, -1, 1)
+        steps[self.zlocs] = sign * np.random.randint(*self.disp, size=(nsecs, 2))
+        offsets = np.cumsum(steps, axis=0)
+        offsets -= offsets.min(axis=0)
+        ty, tx = offsets.max(axis=0)
+
+        # Increase tensor dimension by the extent of the displacements.
+        spec = dict(spec)
+        self.offsets = dict()
+        for k, shape in spec.items():
+            z, y, x = shape[-3:]
+            spec[k] = shape[:-2] + (y + ty, x + tx)
+            # Offset z-location.
+            zs = np.arange(z) - (z - zmin) // 2
+            self.offsets[k] = offsets[np.clip(zs, 0, zmin - 1)]
+        return spec
 
+    def __call__(self, sample, **kwargs):
+        sample = Augment.to_tensor(sample)
+        for k, v in sample.items():
+            z, y, x = self.spec[k][-3:]
+            off = self.offsets[k]
+            w = np.empty(v.shape[:-3] + (z, y, x), dtype=v.dtype)
+            # Copy runs of sections sharing the same offset.
+            bounds = np.where(np.any(off[1:] != off[:-1], axis=1))[0] + 1
+            bounds = [0] + list(bounds) + [z]
+            for z0, z1 in zip(bounds[:-1], bounds[1:]):
+                ty, tx = off[z0]
+                w[:,z0:z1,...] = v[:,z0:z1,ty:ty+y,tx:tx+x]
+            sample[k] = w
         return Augment.sort(sample)
+
+    def __repr__(self):
+        format_string = self.__class__.__name__ + '('
+        format_string += 'disp={0}, '.format(self.disp)
+        if self.prob is None:
+            format_string += 'maxsec={0}, '.format(self.maxsec)
+        else:
+            format_string += 'prob={:.2f}, '.format(self.prob)
+        format_string += 'margin={0}'.format(self.margin)
+        format_string += ')'
+        return format_string
@@ -1,4 +1,4 @@
-import imgaug.augmenters as iaa
+from __future__ import print_function
 import numpy as np
 
 from .augment import Augment
@@ -9,13 +9,25 @@ __all__ = ['AdditiveGaussianNoise']
 
 class AdditiveGaussianNoise(Augment):
     """Additive Gaussian noise.
+
+    Float images are assumed to be in [0,1], and the noise is added and
+    clipped in place. uint8 images get the noise scaled to [0,255], added
+    with saturating math.
+
+    Args:
+        sigma (float or 2-tuple, optional): noise standard deviation, or a
+            range to draw it from uniformly.
+        per_channel (bool, optional): independent noise (and sigma) for
+            every channel, instead of one noise field shared by all.
+        per_section (bool, optional): draw sigma for every z-section.
     """
-    def __init__(self, sigma=(0.01,0.1), per_channel=False):
+    def __init__(self, sigma=(0.01,0.1), per_channel=False,
+                 per_section=False):
         self.sigma = sigma
         self.per_channel = per_channel
-        self.aug = iaa.AdditiveGaussianNoise(scale=sigma, 
-                                             per_channel=per_channel)
+        self.per_section = per_section
         self.imgs = []
+        self._buffer = None
 
     def prepare(self, spec, imgs=[], **kwargs):
         self.imgs = self._validate(spec, imgs)
@@ -23,18 +35,57 @@ class AdditiveGaussianNoise(Augment):
 
     def __call__(self, sample, **kwargs):
         sample = Augment.to_tensor(sample)
+        # Seeded from the global state, to stay reproducible with
+        # np.random.seed like every other augment.
+        rng = np.random.default_rng(np.random.randint(2**32, dtype=np.uint64))
         for k in self.imgs:
-            sample[k] = np.clip(self.aug(images=sample[k]), 0, 1)
+            self.add_noise(sample[k], rng)
         return Augment.sort(sample)
 
     def __repr__(self):
         format_string = self.__class__.__name__ + '('
-        format_string += f'sigma={self.sigma}, '
-        format_string += f'per_channel={self.per_channel}'
+        format_string += 'sigma={}, '.format(self.sigma)
+        format_string += 'per_channel={}, '.format(self.per_channel)
+        format_string += 'per_section={}'.format(self.per_section)
         format_string += ')'
         return format_string
 
     def _validate(self, spec, imgs):
         assert len(imgs) > 0
         assert all(k in spec for k in imgs)
-        return imgs
\ No newline at end of file
+        return imgs
+
+    def add_noise(self, img, rng):
+        """Add noise to a (c,z,y,x) tensor in place."""
+        c, z = img.shape[0], img.shape[-3]
+        c = c if self.per_channel else 1
+        z = z if self.per_section else 1
+        lo, hi = np.broadcast_to(self.sigma, (2,))
+        sigma = rng.uniform(lo, hi, size=(c,z,1,1))
+
+        # Normals drawn straight into a reused buffer.
+        dtype = np.float64 if img.dtype == np.float64 else np.float32
+        noise = self.buffer((c,) + img.shape[-3:], dtype)
+        rng.standard_normal(out=noise, dtype=dtype)
+
+        if img.dtype == np.uint8:
+            # Saturating integer math: the rounded noise is added in int16
+            # and clipped back to [0,255]. Noise beyond +-255 saturates
+            # anyway, so it is clipped first to fit int16.
+            noise *= sigma * 255
+            np.rint(noise, out=noise)
+            np.clip(noise, -255, 255, out=noise)
+            out = np.add(img, noise.astype(np.int16), dtype=np.int16)
+            np.clip(out, 0, 255, out=out)
+            img[...] = out
+        else:
+            assert img.dtype in (np.float32, np.float64)
+            noise *= sigma
+            img += noise
+            np.clip(img, 0, 1, out=img)
+
+    def buffer(self, shape, dtype):
+        if (self._buffer is None or self._buffer.shape != shape or
+            self._buffer.dtype != dtype):
+            self._buffer = np.empty(shape, dtype=dtype)
+        return self._buffer
@@ -2,10 +2,110 @@ from __future__ import print_function
 import numpy as np
 from scipy.ndimage.filters import gaussian_filter
 
+from . import utils
+from .perturbing import perturbing
+from .warping import warping
+
+
+# Blur backends. 'scipy' convolves with a truncated Gaussian kernel, whose
+# cost grows with sigma. 'iir' is a recursive approximation of constant cost
+# per voxel, accurate enough from a sigma of about 2 on, with the same
+# 'reflect' borders. 'auto' uses 'iir' for the axes with sigma of at least
+# IIR_SIGMA, where it is also faster, and 'scipy' for the rest.
+BLUR_BACKENDS = ('auto', 'scipy', 'iir')
+IIR_SIGMA = 3.0
+
+
+def iir_sigma(backend):
+    """Smallest sigma that backend blurs recursively."""
+    assert backend in BLUR_BACKENDS
+    return dict(auto=IIR_SIGMA, scipy=np.inf, iir=0)[backend]
+
+
+def _gaussian_filter(img, sigma, backend='auto'):
+    """In-place Gaussian filter. Integer images are filtered in float and
+    rounded once, since scipy truncates them after every 1D pass."""
+    assert backend in BLUR_BACKENDS
+    if np.issubdtype(img.dtype, np.integer):
+        tmp = img.astype(np.float32)
+        _gaussian_filter(tmp, sigma, backend=backend)
+        img[...] = np.rint(tmp, out=tmp)
+        return
+
+    if backend == 'scipy' or img.dtype not in (np.float32, np.float64):
+        gaussian_filter(img, sigma=sigma, output=img)
+        return
+    if backend == 'iir':
+        perturbing.gaussian(img, sigma)
+        return
+
+    # Split the axes between the backends.
+    sigma = np.broadcast_to(np.asarray(sigma, dtype=np.float64), (img.ndim,))
+    iir = sigma >= IIR_SIGMA
+    if iir.all():
+        perturbing.gaussian(img, sigma)
+    elif not iir.any():
+        gaussian_filter(img, sigma=sigma, output=img)
+    else:
+        perturbing.gaussian(img, np.where(iir, sigma, 0))
+        gaussian_filter(img, sigma=np.where(iir, 0, sigma), output=img)
+
+
+# Random fields blurred in-plane with sigma are synthesized at a resolution
+# reduced by a factor of about sigma / LOWRES_SIGMA, then upsampled.
+LOWRES_SIGMA = 2.0
+
+
+def _upsample(field, shape, factor):
+    """Separable linear upsampling of the last two axes of field, whose
+    samples are factor pixels apart, to shape (y,x), in float32."""
+    for axis, n in zip((-2, -1), shape):
+        pos = np.arange(n, dtype=np.float32) / factor
+        i0 = np.minimum(pos.astype(int), field.shape[axis] - 2)
+        w = pos - i0
+        w = w.reshape((-1,) + (1,) * (-1 - axis))
+        lo = np.take(field, i0, axis=axis)
+        hi = np.take(field, i0 + 1, axis=axis)
+        hi -= lo
+        hi *= w
+        lo += hi
+        field = lo
+    return field
+
+
+def smooth_noise(shape, sigma):
+    """Standard normal noise blurred in-plane with sigma, in float32.
+
+    The noise is drawn and blurred at a resolution reduced in proportion to
+    sigma, rescaled to the amplitude it would have at full resolution, and
+    upsampled linearly.
+
+    Args:
+        shape (3-tuple): (z,y,x) shape.
+        sigma (float): in-plane standard deviation.
+    """
+    f = max(int(sigma / LOWRES_SIGMA), 1)
+    z, y, x = shape
+    if f == 1:
+        field = np.random.normal(0, 1, shape).astype(np.float32)
+        _gaussian_filter(field, (0,sigma,sigma))
+        return field
+
+    low = (z, -(-y // f) + 1, -(-x // f) + 1)
+    field = np.random.normal(0, 1, low).astype(np.float32)
+    _gaussian_filter(field, (0,sigma/f,sigma/f))
+    # Blurred noise is f times weaker with f times more samples per sigma.
+    field *= np.float32(1.0/f)
+    return _upsample(field, (y, x), f)
+
 
 class Perturb(object):
     """
     Callable class for in-place image perturbation.
+
+    Batches of perturbations of sections go through ``draw`` and ``apply``,
+    which work on the parameters of all perturbations as arrays (struct of
+    arrays) instead of on one object per perturbation.
     """
     def __init__(self):
         raise NotImplementedError
@@ -13,12 +113,48 @@ class Perturb(object):
     def __call__(self, img):
         raise NotImplementedError
 
+    @classmethod
+    def draw(cls, n, **params):
+        """Draw n random perturbations.
+
+        Args:
+            n (int): number of perturbations.
+            params: constructor arguments.
+
+        Returns:
+            dict of arrays of length n. By default, the perturbations
+            themselves.
+        """
+        perturbs = np.empty(n, dtype=object)
+        for i in range(n):
+            perturbs[i] = cls(**params)
+        return dict(perturb=perturbs)
+
+    @classmethod
+    def apply(cls, img, zlocs, boxes, values, **params):
+        """Perturb boxes of sections of a (c,z,y,x) tensor in place.
+
+        Args:
+            img (ndarray): (c,z,y,x) tensor.
+            zlocs (ndarray): section of every box.
+            boxes (ndarray): (n,4) boxes (y0,y1,x0,x1).
+            values (dict): perturbations from ``draw``, one per box.
+            params: constructor arguments.
+        """
+        for z, box, perturb in zip(zlocs, boxes, values['perturb']):
+            y0, y1, x0, x1 = box
+            perturb(img[...,z,y0:y1,x0:x1])
+
     def __repr__(self):
         return self.__class__.__name__ + '()'
 
 
 class Grayscale(Perturb):
-    """Grayscale intensity perturbation."""
+    """Grayscale intensity perturbation.
+
+    Float images are assumed to be in [0,1]. uint8 images are perturbed
+    through a 256-entry lookup table with [0,255] mapped to [0,1].
+    """
     def __init__(self, contrast_factor=0.3, brightness_factor=0.3):
         contrast_factor = np.clip(contrast_factor, 0, 2)
         brightness_factor = np.clip(brightness_factor, 0, 2)
@@ -29,11 +165,48 @@ class Grayscale(Perturb):
         self.params = params
 
     def __call__(self, img):
+        if img.dtype in (np.float32, np.float64, np.uint8):
+            # Single pass over img.
+            perturbing.grayscale(img, *self.values())
+            return
         img *= self.params['contrast']
         img += self.params['brightness']
         np.clip(img, 0, 1, out=img)
         img **= 2.0**self.params['gamma']
 
+    def values(self):
+        """Contrast, brightness and gamma exponent."""
+        p = self.params
+        return p['contrast'], p['brightness'], 2.0**p['gamma']
+
+    @classmethod
+    def draw(cls, n, contrast_factor=0.3, brightness_factor=0.3):
+        contrast_factor = np.clip(contrast_factor, 0, 2)
+        brightness_factor = np.clip(brightness_factor, 0, 2)
+        rand = np.random.rand(n, 3)
+        values = dict()
+        values['contrast'] = 1 + (rand[:,0] - 0.5) * contrast_factor
+        values['brightness'] = (rand[:,1] - 0.5) * brightness_factor
+        values['gamma'] = rand[:,2]*2 - 1
+        return values
+
+    @classmethod
+    def apply(cls, img, zlocs, boxes, values, **params):
+        contrast = values['contrast']
+        brightness = values['brightness']
+        gamma = 2.0**values['gamma']
+        if img.dtype in (np.float32, np.float64, np.uint8):
+            perturbing.grayscale(img, contrast, brightness, gamma,
+                                 zlocs=zlocs, boxes=boxes)
+            return
+        for z, (y0, y1, x0, x1), c, b, g in zip(zlocs, boxes, contrast,
+                                                brightness, gamma):
+            box = img[...,z,y0:y1,x0:x1]
+            box *= c
+            box += b
+            np.clip(box, 0, 1, out=box)
+            box **= g
+
     def __repr__(self):
         format_string = self.__class__.__name__ + '('
         format_string += 'contrast={:.2f}, '.format(self.params['contrast'])
@@ -44,13 +217,28 @@ class Grayscale(Perturb):
 
 
 class Fill(Perturb):
-    """Fill with a scalar."""
+    """Fill with a scalar in [0,1], scaled to [0,255] for uint8."""
     def __init__(self, value=0, random=False):
         value = np.clip(value, 0, 1)
         self.value = np.random.rand() if random else value
 
     def __call__(self, img):
-        img[...] = self.value
+        img[...] = utils.from_float(self.value, img.dtype)
+
+    @classmethod
+    def draw(cls, n, value=0, random=False):
+        if random:
+            return dict(value=np.random.rand(n))
+        return dict(value=np.full(n, np.clip(value, 0, 1)))
+
+    @classmethod
+    def apply(cls, img, zlocs, boxes, values, **params):
+        value = utils.from_float(values['value'], img.dtype)
+        if img.dtype in (np.float32, np.float64, np.uint8):
+            perturbing.fill(img, zlocs, value, boxes=boxes)
+            return
+        for z, (y0, y1, x0, x1), v in zip(zlocs, boxes, value):
+            img[...,z,y0:y1,x0:x1] = v
 
     def __repr__(self):
         format_string = self.__class__.__name__ + '('
@@ -60,13 +248,40 @@ class Fill(Perturb):
 
 
 class Blur(Perturb):
-    """Gaussian blurring."""
-    def __init__(self, sigma=5.0, random=False):
+    """Gaussian blurring.
+
+    Args:
+        backend (str, optional): one of ``BLUR_BACKENDS``.
+    """
+    def __init__(self, sigma=5.0, random=False, backend='auto'):
         sigma = max(sigma, 0)
         self.sigma = np.random.rand()*sigma if random else sigma
+        self.backend = backend
 
     def __call__(self, img):
-        gaussian_filter(img, sigma=self.sigma, output=img)
+        _gaussian_filter(img, self.sigma, backend=self.backend)
+
+    @classmethod
+    def draw(cls, n, sigma=5.0, random=False, backend='auto'):
+        sigma = max(sigma, 0)
+        if random:
+            return dict(sigma=np.random.rand(n)*sigma)
+        return dict(sigma=np.full(n, float(sigma)))
+
+    @classmethod
+    def apply(cls, img, zlocs, boxes, values, backend='auto', **params):
+        """Blur every box in-plane, on its own."""
+        sigma = values['sigma']
+        if img.dtype in (np.float32, np.float64):
+            perturbing.blur_sections(img, zlocs, sigma, boxes=boxes,
+                                     iir_sigma=iir_sigma(backend))
+            return
+        # Blur in float, and round once.
+        uniq, idx = np.unique(zlocs, return_inverse=True)
+        tmp = img[...,uniq,:,:].astype(np.float32)
+        perturbing.blur_sections(tmp, idx, sigma, boxes=boxes,
+                                 iir_sigma=iir_sigma(backend))
+        img[...,uniq,:,:] = np.rint(tmp, out=tmp)
 
     def __repr__(self):
         format_string = self.__class__.__name__ + '('
@@ -76,12 +291,17 @@ class Blur(Perturb):
 
 
 class Blur3D(Perturb):
-    """Gaussian blurring."""
-    def __init__(self, sigma=(5.0,5.0,5.0), random=False):
+    """Gaussian blurring.
+
+    Args:
+        backend (str, optional): one of ``BLUR_BACKENDS``.
+    """
+    def __init__(self, sigma=(5.0,5.0,5.0), random=False, backend='auto'):
         self.sigma = [np.random.rand()*s for s in sigma] if random else sigma
+        self.backend = backend
 
     def __call__(self, img):
-        gaussian_filter(img, sigma=self.sigma, output=img)
+        _gaussian_filter(img, self.sigma, backend=self.backend)
 
     def __repr__(self):
         format_string = self.__class__.__name__ + '('
@@ -91,22 +311,119 @@ class Blur3D(Perturb):
 
 
 class Noise(Perturb):
-    """Uniform noise + Gaussian blurring."""
+    """Thresholded smooth noise + Gaussian blurring.
+
+    Normal noise is blurred in-plane with sigma[0], synthesized at a reduced
+    resolution and upsampled (see ``smooth_noise``), thresholded at 0, and
+    the binary pattern is blurred in-plane with sigma[1].
+    """
     def __init__(self, sigma=(2,5)):
         assert len(sigma)==2
         self.sigma = tuple(max(s, 0) for s in sigma)
 
     def __call__(self, img):
-        patch = (np.random.rand(*img.shape[-3:])).astype(img.dtype)
-        s1 = self.sigma[0]
-        gaussian_filter(patch, sigma=(0,s1,s1), output=patch)
-        patch = (patch > 0.5).astype(img.dtype)
+        dtype = img.dtype if img.dtype == np.float64 else np.float32
+        # Thresholding blurred noise at its mean.
+        patch = smooth_noise(img.shape[-3:], self.sigma[0])
+        patch = (patch > 0).astype(dtype)
         s2 = self.sigma[1]
-        gaussian_filter(patch, sigma=(0,s2,s2), output=patch)
-        img[...,:,:,:] = patch
+        _gaussian_filter(patch, (0,s2,s2))
+        img[...,:,:,:] = utils.from_float(patch, img.dtype)
 
     def __repr__(self):
         format_string = self.__class__.__name__ + '('
         format_string += 'sigma={:}'.format(self.sigma)
         format_string += ')'
         return format_string
+
+
+class Texture(Perturb):
+    """Fill with a random crop of a bank of textures.
+
+    The crop starts at a random section, cycling through the sections of
+    the bank along z, and at a random in-plane offset that keeps it inside
+    the bank. It is randomly flipped and transposed in-plane.
+
+    Args:
+        bank (ndarray): (n,y,x) independent texture sections in [0,1], at
+            least as large in-plane as the images to fill.
+    """
+    def __init__(self, bank):
+        self.bank = bank
+        self.start = np.random.randint(bank.shape[0])
+        self.offset = np.random.rand(2)
+        self.flip = np.random.rand(2) > 0.5
+        self.transpose = np.random.rand() > 0.5
+
+    def __call__(self, img):
+        n, y, x = self.bank.shape
+        d, h, w = img.shape[-3:]
+        if self.transpose:
+            h, w = w, h
+        idx = [(self.start + np.arange(d)) % n]
+        for size, dim, offset, flip in zip((h, w), (y, x), self.offset,
+                                           self.flip):
+            assert size <= dim
+            i = int(offset * (dim - size + 1)) + np.arange(size)
+            idx.append(i[::-1] if flip else i)
+        crop = self.bank[np.ix_(*idx)]
+        if self.transpose:
+            crop = crop.transpose(0, 2, 1)
+        img[...] = utils.from_float(crop, img.dtype)
+
+    def __repr__(self):
+        format_string = self.__class__.__name__ + '('
+        format_string += 'bank={}'.format(self.bank.shape)
+        format_string += ')'
+        return format_string
+
+
+class Warp2D(Perturb):
+    """2D warping by rotation, shear, scale and perspective stretch."""
+    def __init__(self, rot_max=3.0, shear_max=1.0, scale_max=1.05,
+                 stretch_max=0.05, threads=1):
+        self.rot = rot_max * 2 * (np.random.rand() - 0.5)
+        self.shear = shear_max * 2 * (np.random.rand() - 0.5)
+        self.scale = tuple(1 - (scale_max - 1) * np.random.rand(2))
+        self.stretch = tuple(stretch_max * 2 * (np.random.rand(2) - 0.5))
+        self.threads = threads
+
+    @classmethod
+    def draw(cls, n, rot_max=3.0, shear_max=1.0, scale_max=1.05,
+             stretch_max=0.05, threads=1):
+        rand = np.random.rand(n, 6)
+        values = dict()
+        values['rot'] = rot_max * 2 * (rand[:,0] - 0.5)
+        values['shear'] = shear_max * 2 * (rand[:,1] - 0.5)
+        values['scale'] = 1 - (scale_max - 1) * rand[:,2:4]
+        values['stretch'] = stretch_max * 2 * (rand[:,4:6] - 0.5)
+        return values
+
+    @classmethod
+    def apply(cls, img, zlocs, boxes, values, threads=1, **params):
+        """Warp every box in place, clamped to its border."""
+        args = [values[k] for k in ('rot', 'shear', 'scale', 'stretch')]
+        full = (0, img.shape[-2], 0, img.shape[-1])
+        if np.all(boxes == full):
+            warping.warp2dSections(img, zlocs, *args, threads=threads)
+            return
+        for i, (z, (y0, y1, x0, x1)) in enumerate(zip(zlocs, boxes)):
+            warping.warp2dSections(img[...,y0:y1,x0:x1], [z],
+                                   *[a[i] for a in args], threads=threads)
+
+    def __call__(self, img):
+        # Every section of img is warped in place.
+        if img.ndim == 3:
+            img = img[np.newaxis,...]
+        zlocs = np.arange(img.shape[-3])
+        warping.warp2dSections(img, zlocs, self.rot, self.shear, self.scale,
+                               self.stretch, threads=self.threads)
+
+    def __repr__(self):
+        format_string = self.__class__.__name__ + '('
+        format_string += 'rot={:.2f}, '.format(self.rot)
+        format_string += 'shear={:.2f}, '.format(self.shear)
+        format_string += 'scale=({:.3f},{:.3f}), '.format(*self.scale)
+        format_string += 'stretch=({:.3f},{:.3f})'.format(*self.stretch)
+        format_string += ')'
+        return format_string
@@ -0,0 +1,406 @@
+"""
+Compiled intensity perturbations.
+"""
+
+import numpy as np
+from cython cimport floating
+from libc.stdint cimport uint8_t
+
+ctypedef fused pixel:
+    float
+    double
+    uint8_t
+
+cdef extern from 'perturbing.c' nogil:
+    int grayscale_f32(float * img, const int sh[4], const long strd[4],
+                      const int * zs, const int * boxes, const int n,
+                      const float * params, const int nthreads)
+    int grayscale_f64(double * img, const int sh[4], const long strd[4],
+                      const int * zs, const int * boxes, const int n,
+                      const double * params, const int nthreads)
+    int gaussian_iir_f32(float * img, const int sh[4], const long strd[4],
+                         const double sigma[4], const int nthreads)
+    int gaussian_iir_f64(double * img, const int sh[4], const long strd[4],
+                         const double sigma[4], const int nthreads)
+    int blur_sections_f32(float * img, const int sh[4], const long strd[4],
+                          const int * zs, const int * boxes, const int n,
+                          const double * sigmas, const double iir_sigma,
+                          const int nthreads)
+    int blur_sections_f64(double * img, const int sh[4], const long strd[4],
+                          const int * zs, const int * boxes, const int n,
+                          const double * sigmas, const double iir_sigma,
+                          const int nthreads)
+    int fill_f32(float * img, const int sh[4], const long strd[4],
+                 const int * zs, const int * boxes, const int n,
+                 const float * values, const int nthreads)
+    int fill_f64(double * img, const int sh[4], const long strd[4],
+                 const int * zs, const int * boxes, const int n,
+                 const double * values, const int nthreads)
+    int fill_u8(uint8_t * img, const int sh[4], const long strd[4],
+                const int * zs, const int * boxes, const int n,
+                const uint8_t * values, const int nthreads)
+    int lookup_u8(uint8_t * img, const int sh[4], const long strd[4],
+                  const int * zs, const int * boxes, const int n,
+                  const uint8_t * luts, const int nthreads)
+
+
+def _sections(arr, zlocs, boxes):
+    """
+    Validated section indices and (n,4) boxes of a (ch,z,y,x) array, as
+    contiguous int32 arrays. Boxes are (y0,y1,x0,x1) in the sections, and
+    default to the whole sections.
+    """
+    zs = np.ascontiguousarray(zlocs, dtype=np.int32).reshape(-1)
+    n = zs.shape[0]
+    if boxes is None:
+        bx = np.empty((n, 4), dtype=np.int32)
+        bx[:] = (0, arr.shape[2], 0, arr.shape[3])
+    else:
+        bx = np.ascontiguousarray(boxes, dtype=np.int32).reshape(n, 4)
+    if n > 0:
+        assert zs.min() >= 0 and zs.max() < arr.shape[1]
+        assert bx.min() >= 0
+        assert bx[:,1].max() <= arr.shape[2] and bx[:,3].max() <= arr.shape[3]
+    return zs, bx
+
+
+def _grayscale(floating[:, :, :, :] img, int[::1] zs, int[:, ::1] boxes,
+               floating[:, ::1] params, int threads):
+    """
+    Dispatch to the grayscale kernel matching the pixel type. img is a
+    (ch,z,x,y) array of any memory layout, perturbed in place.
+    """
+    cdef int sh[4]
+    cdef long strd[4]
+    cdef int i
+    cdef int n = zs.shape[0]
+    for i in range(4):
+        sh[i] = img.shape[i]
+        strd[i] = img.strides[i] // <long>sizeof(floating)
+
+    cdef int err
+    with nogil:
+        if floating is float:
+            err = grayscale_f32(&img[0, 0, 0, 0], sh, strd, &zs[0],
+                                &boxes[0, 0], n, &params[0, 0], threads)
+        else:
+            err = grayscale_f64(&img[0, 0, 0, 0], sh, strd, &zs[0],
+                                &boxes[0, 0], n, &params[0, 0], threads)
+    if err != 0:
+        raise MemoryError()
+
+
+def _gaussian(floating[:, :, :, :] img, double[::1] sigma, int threads):
+    """
+    Dispatch to the recursive Gaussian kernel matching the pixel type. img
+    is a (ch,z,x,y) array of any memory layout, blurred in place.
+    """
+    cdef int sh[4]
+    cdef long strd[4]
+    cdef int i
+    for i in range(4):
+        sh[i] = img.shape[i]
+        strd[i] = img.strides[i] // <long>sizeof(floating)
+
+    cdef int err
+    with nogil:
+        if floating is float:
+            err = gaussian_iir_f32(&img[0, 0, 0, 0], sh, strd, &sigma[0],
+                                   threads)
+        else:
+            err = gaussian_iir_f64(&img[0, 0, 0, 0], sh, strd, &sigma[0],
+                                   threads)
+    if err != 0:
+        raise MemoryError()
+
+
+def gaussian(img, sigma, threads=1):
+    """
+    Recursive Gaussian blur in place (Young & van Vliet, 1995).
+
+    The cost per pixel is constant in sigma, unlike a convolution with a
+    truncated kernel. The approximation is close for sigma >= 2 or so.
+    Borders are handled as scipy's 'reflect' mode, by extending every line
+    with 4 sigma of mirrored samples.
+
+    Parameters
+    ----------
+
+    img: array
+      float32 or float64 array of up to 4 dimensions, writable and of any
+      memory layout.
+    sigma: float or sequence of float
+      Standard deviation, for all axes or per axis of img. Axes with sigma
+      below 0.5 are not blurred.
+    threads: int
+      Number of OpenMP threads. Non-positive values use all available cores.
+      The GIL is released while blurring.
+
+    Returns
+    -------
+
+    img: array
+      The blurred input.
+    """
+    assert img.dtype in (np.float32, np.float64)
+    assert img.ndim <= 4
+    if img.size == 0:
+        return img
+    sigmas = np.zeros(4, dtype=np.float64)
+    sigmas[4 - img.ndim:] = np.broadcast_to(sigma, (img.ndim,))
+    arr = img[(np.newaxis,) * (4 - img.ndim)]
+    _gaussian(arr, sigmas, threads)
+    return img
+
+
+def _blur_sections(floating[:, :, :, :] img, int[::1] zs, int[:, ::1] boxes,
+                   double[::1] sigmas, double iir_sigma, int threads):
+    """
+    Dispatch to the section blur kernel matching the pixel type. img is a
+    (ch,z,x,y) array of any memory layout, blurred in place.
+    """
+    cdef int sh[4]
+    cdef long strd[4]
+    cdef int i
+    cdef int n = zs.shape[0]
+    for i in range(4):
+        sh[i] = img.shape[i]
+        strd[i] = img.strides[i] // <long>sizeof(floating)
+
+    cdef int err
+    with nogil:
+        if floating is float:
+            err = blur_sections_f32(&img[0, 0, 0, 0], sh, strd, &zs[0],
+                                    &boxes[0, 0], n, &sigmas[0], iir_sigma,
+                                    threads)
+        else:
+            err = blur_sections_f64(&img[0, 0, 0, 0], sh, strd, &zs[0],
+                                    &boxes[0, 0], n, &sigmas[0], iir_sigma,
+                                    threads)
+    if err != 0:
+        raise MemoryError()
+
+
+def blur_sections(img, zlocs, sigma, boxes=None, iir_sigma=3.0, threads=1):
+    """
+    In-plane Gaussian blur of sections (or boxes in them) in place, all in a
+    single call.
+
+    Boxes with sigma of at least iir_sigma are blurred recursively (see
+    gaussian), the others with the truncated kernel and 'reflect' borders of
+    scipy.ndimage.gaussian_filter. Every box is blurred on its own.
+
+    Parameters
+    ----------
+
+    img: array
+      float32 or float64 array of 3 or 4 dimensions (c,z,y,x), writable and
+      of any memory layout.
+    zlocs: sequence of int
+      Sections to blur. Every channel of a section is blurred. A repeated
+      section is blurred again, in order if threads is 1.
+    sigma: float or sequence of float
+      Standard deviation in y and x, per section of zlocs.
+    boxes: array, optional
+      (n,4) boxes (y0,y1,x0,x1), one per section of zlocs. Whole sections
+      by default.
+    iir_sigma: float
+      Smallest sigma blurred recursively. inf to never do so.
+    threads: int
+      Number of OpenMP threads. Non-positive values use all available cores.
+      The GIL is released while blurring.
+
+    Returns
+    -------
+
+    img: array
+      The blurred input.
+    """
+    assert img.dtype in (np.float32, np.float64)
+    assert 3 <= img.ndim <= 4
+    arr = img[(np.newaxis,) * (4 - img.ndim)]
+    zs, bx = _sections(arr, zlocs, boxes)
+    n = zs.shape[0]
+    if n == 0 or arr.size == 0:
+        return img
+
+    sigmas = np.empty(n, dtype=np.float64)
+    sigmas[:] = np.broadcast_to(sigma, (n,))
+    _blur_sections(arr, zs, bx, sigmas, iir_sigma, threads)
+    return img
+
+
+def _fill(pixel[:, :, :, :] img, int[::1] zs, int[:, ::1] boxes,
+          pixel[::1] values, int threads):
+    """
+    Dispatch to the fill kernel matching the pixel type. img is a (ch,z,x,y)
+    array of any memory layout, filled in place.
+    """
+    cdef int sh[4]
+    cdef long strd[4]
+    cdef int i
+    cdef int n = zs.shape[0]
+    for i in range(4):
+        sh[i] = img.shape[i]
+        strd[i] = img.strides[i] // <long>sizeof(pixel)
+
+    cdef int err
+    with nogil:
+        if pixel is float:
+            err = fill_f32(&img[0, 0, 0, 0], sh, strd, &zs[0], &boxes[0, 0],
+                           n, &values[0], threads)
+        elif pixel is double:
+            err = fill_f64(&img[0, 0, 0, 0], sh, strd, &zs[0], &boxes[0, 0],
+                           n, &values[0], threads)
+        else:
+            err = fill_u8(&img[0, 0, 0, 0], sh, strd, &zs[0], &boxes[0, 0],
+                          n, &values[0], threads)
+    if err != 0:
+        raise MemoryError()
+
+
+def fill(img, zlocs, value, boxes=None, threads=1):
+    """
+    Fill sections (or boxes in them) in place, all in a single call.
+
+    Parameters
+    ----------
+
+    img: array
+      float32, float64 or uint8 array of 3 or 4 dimensions (c,z,y,x),
+      writable and of any memory layout.
+    zlocs: sequence of int
+      Sections to fill. Every channel of a section is filled.
+    value: scalar or sequence of scalars
+      Value per section of zlocs, in the dtype of img.
+    boxes: array, optional
+      (n,4) boxes (y0,y1,x0,x1), one per section of zlocs. Whole sections
+      by default.
+    threads: int
+      Number of OpenMP threads. Non-positive values use all available cores.
+
+    Returns
+    -------
+
+    img: array
+      The filled input.
+    """
+    assert img.dtype in (np.float32, np.float64, np.uint8)
+    assert 3 <= img.ndim <= 4
+    arr = img[(np.newaxis,) * (4 - img.ndim)]
+    zs, bx = _sections(arr, zlocs, boxes)
+    n = zs.shape[0]
+    if n == 0 or arr.size == 0:
+        return img
+
+    values = np.empty(n, dtype=img.dtype)
+    values[:] = np.broadcast_to(value, (n,))
+    _fill(arr, zs, bx, values, threads)
+    return img
+
+
+def _lookup(uint8_t[:, :, :, :] img, int[::1] zs, int[:, ::1] boxes,
+            uint8_t[:, ::1] luts, int threads):
+    """
+    Per-box table lookup of a uint8 (ch,z,x,y) array of any memory layout,
+    in place.
+    """
+    cdef int sh[4]
+    cdef long strd[4]
+    cdef int i
+    cdef int n = zs.shape[0]
+    for i in range(4):
+        sh[i] = img.shape[i]
+        strd[i] = img.strides[i]
+
+    cdef int err
+    with nogil:
+        err = lookup_u8(&img[0, 0, 0, 0], sh, strd, &zs[0], &boxes[0, 0], n,
+                        &luts[0, 0], threads)
+    if err != 0:
+        raise MemoryError()
+
+
+def grayscale_lut(contrast, brightness, gamma):
+    """
+    256-entry uint8 lookup tables of the grayscale perturbation, with the
+    uint8 range mapped to [0, 1].
+
+    Parameters
+    ----------
+
+    contrast, brightness, gamma: float or sequence of float
+      Parameters, one table per entry.
+
+    Returns
+    -------
+
+    luts: array
+      (n, 256) uint8 array.
+    """
+    n = np.broadcast(contrast, brightness, gamma).size
+    x = np.empty((1, n, 1, 256), dtype=np.float64)
+    x[...] = np.arange(256) / 255.0
+    grayscale(x, contrast, brightness, gamma)
+    x *= 255
+    np.rint(x, out=x)
+    return x.reshape(n, 256).astype(np.uint8)
+
+
+def grayscale(img, contrast, brightness, gamma, zlocs=None, boxes=None,
+              threads=1):
+    """
+    Grayscale perturbation in place, in a single pass over the data:
+
+        img = clip(img * contrast + brightness, 0, 1) ** gamma
+
+    Parameters
+    ----------
+
+    img: array
+      float32, float64 or uint8 array of up to 4 dimensions (c,z,y,x),
+      writable and of any memory layout. uint8 images go through a lookup
+      table per section, with the uint8 range mapped to [0, 1].
+    contrast, brightness, gamma: float or sequence of float
+      Parameters, per section of zlocs.
+    zlocs: sequence of int, optional
+      Sections to perturb. All sections by default. A repeated section is
+      perturbed again, in order if threads is 1.
+    boxes: array, optional
+      (n,4) boxes (y0,y1,x0,x1), one per section of zlocs. Whole sections
+      by default.
+    threads: int
+      Number of OpenMP threads. Non-positive values use all available cores.
+      The GIL is released while perturbing.
+
+    Returns
+    -------
+
+    img: array
+      The perturbed input.
+    """
+    assert img.dtype in (np.float32, np.float64, np.uint8)
+    assert img.ndim <= 4
+    arr = img[(np.newaxis,) * (4 - img.ndim)]
+    if arr.size == 0:
+        return img
+
+    if zlocs is None:
+        zlocs = np.arange(arr.shape[1])
+    zs, bx = _sections(arr, zlocs, boxes)
+    n = zs.shape[0]
+    if n == 0:
+        return img
+
+    if img.dtype == np.uint8:
+        luts = grayscale_lut(np.broadcast_to(contrast, (n,)), brightness,
+                             gamma)
+        _lookup(arr, zs, bx, luts, threads)
+        return img
+
+    params = np.empty((n, 3), dtype=img.dtype)
+    params[:,0] = np.broadcast_to(contrast, (n,))
+    params[:,1] = np.broadcast_to(brightness, (n,))
+    params[:,2] = np.broadcast_to(gamma, (n,))
+    _grayscale(arr, zs, bx, params, threads)
+    return img
@@ -0,0 +1,210 @@
+/*
+Intensity perturbation kernels.
+
+The kernels work in place on (c,z,y,x) tensors of any memory layout, with
+strides given in pixels.
+*/
+
+#include <math.h>
+#include <stdint.h>
+#include <stdlib.h>
+
+#ifdef _OPENMP
+#include <omp.h>
+#else
+#define omp_get_max_threads() 1
+#endif
+
+// Number of OpenMP threads to use; non-positive means all available.
+#define N_THREADS(n) ((n) > 0 ? (n) : omp_get_max_threads())
+
+// Young & van Vliet (1995) recursive Gaussian coefficients, as
+// (B, b1/b0, b2/b0, b3/b0). The cost of the filter does not depend on sigma.
+static void yvv_coefficients(const double sigma, double c[4]) {
+    double q, q2, q3, b0;
+    if (sigma >= 2.5) {
+        q = 0.98711 * sigma - 0.96330;
+    } else {
+        q = 3.97156 - 4.14554 * sqrt(1 - 0.26891 * sigma);
+    }
+    q2 = q * q;
+    q3 = q2 * q;
+    b0 = 1.57825 + 2.44413 * q + 1.4281 * q2 + 0.422205 * q3;
+    c[1] = (2.44413 * q + 2.85619 * q2 + 1.26661 * q3) / b0;
+    c[2] = -(1.4281 * q2 + 1.26661 * q3) / b0;
+    c[3] = 0.422205 * q3 / b0;
+    c[0] = 1 - (c[1] + c[2] + c[3]);
+}
+
+// Boundary matrix of Triggs & Sdika (2006) for the anti-causal pass, when
+// the signal continues with its last value past the end. Row-major M maps
+// the deviations of the causal output (w[n-1], w[n-2], w[n-3]) from that
+// value to the deviations of (y[n-1], y[n], y[n+1]). Computed by running
+// the filters on each deviation until it has decayed, over len samples.
+static int yvv_boundary(const double c[4], const int len, double M[9]) {
+    int col, t;
+    double *d = (double *)malloc(2 * (len + 6) * sizeof(double));
+    double *e = d + len + 6;
+    if (d == NULL) {
+        return -1;
+    }
+    for (col = 0; col < 3; col++) {
+        d[0] = d[1] = d[2] = 0;
+        d[2 - col] = 1;
+        for (t = 3; t < len + 3; t++) {
+            d[t] = c[1] * d[t - 1] + c[2] * d[t - 2] + c[3] * d[t - 3];
+        }
+        e[len + 3] = e[len + 4] = e[len + 5] = 0;
+        for (t = len + 2; t >= 2; t--) {
+            e[t] = c[0] * d[t] + c[1] * e[t + 1] + c[2] * e[t + 2]
+                   + c[3] * e[t + 3];
+        }
+        M[0 + col] = e[2];
+        M[3 + col] = e[3];
+        M[6 + col] = e[4];
+    }
+    free(d);
+    return 0;
+}
+
+// Recursive Gaussian along n samples of m interleaved lines (sample i of
+// line k at b[i * m + k]), in place. The signal is taken to continue with
+// its edge values on both ends, which the causal pass handles by starting in
+// steady state, and the anti-causal pass by the boundary matrix M (see
+// yvv_boundary).
+static int yvv_lines(double *b, const int n, const int m, const double c[4],
+                     const double M[9]) {
+    int i, k;
+    long i1, i2, i3;
+    // Per line: last input sample, and y[n], y[n+1] past the end.
+    double *ext = (double *)malloc(3 * m * sizeof(double));
+    if (ext == NULL) {
+        return -1;
+    }
+    for (k = 0; k < m; k++) {
+        ext[k] = b[(long)(n - 1) * m + k];
+    }
+
+    // Causal pass.
+    for (i = 1; i < n; i++) {
+        double *q = b + (long)i * m;
+        i1 = -(long)m;
+        i2 = (long)((i >= 2 ? i - 2 : 0) - i) * m;
+        i3 = (long)((i >= 3 ? i - 3 : 0) - i) * m;
+        for (k = 0; k < m; k++) {
+            q[k] = c[0] * q[k] + c[1] * q[k + i1] + c[2] * q[k + i2]
+                   + c[3] * q[k + i3];
+        }
+    }
+
+    // Anti-causal pass, started from the boundary values.
+    i1 = (long)(n - 1) * m;
+    i2 = (long)(n >= 2 ? n - 2 : 0) * m;
+    i3 = (long)(n >= 3 ? n - 3 : 0) * m;
+    for (k = 0; k < m; k++) {
+        const double v = ext[k];
+        const double d0 = b[i1 + k] - v, d1 = b[i2 + k] - v,
+                     d2 = b[i3 + k] - v;
+        b[i1 + k] = v + M[0] * d0 + M[1] * d1 + M[2] * d2;
+        ext[m + k] = v + M[3] * d0 + M[4] * d1 + M[5] * d2;
+        ext[2 * m + k] = v + M[6] * d0 + M[7] * d1 + M[8] * d2;
+    }
+    for (i = n - 2; i >= 0 && i >= n - 3; i--) {
+        // Near the end, some taps fall past it.
+        for (k = 0; k < m; k++) {
+            const double y1 = b[(long)(i + 1) * m + k];
+            const double y2 = i + 2 < n ? b[(long)(i + 2) * m + k]
+                                        : ext[m + k];
+            const double y3 = i + 3 < n ? b[(long)(i + 3) * m + k]
+                                        : ext[(i + 3 - n + 1) * m + k];
+            b[(long)i * m + k] = c[0] * b[(long)i * m + k] + c[1] * y1
+                                 + c[2] * y2 + c[3] * y3;
+        }
+    }
+    for (i = n - 4; i >= 0; i--) {
+        double *q = b + (long)i * m;
+        for (k = 0; k < m; k++) {
+            q[k] = c[0] * q[k] + c[1] * q[k + m] + c[2] * q[k + 2 * m]
+                   + c[3] * q[k + 3 * m];
+        }
+    }
+    free(ext);
+    return 0;
+}
+
+// Truncated Gaussian kernel of scipy.ndimage.gaussian_filter (truncate=4),
+// w[-r..r] normalized to unit sum. w must hold 2 * radius + 1 values.
+static int fir_radius(const double sigma) {
+    return (int)(4.0 * sigma + 0.5);
+}
+
+static void fir_weights(const double sigma, const int r, double *w) {
+    int k;
+    double sum = 0;
+    for (k = -r; k <= r; k++) {
+        w[k + r] = exp(-0.5 * k * k / (sigma * sigma));
+        sum += w[k + r];
+    }
+    for (k = 0; k <= 2 * r; k++) {
+        w[k] /= sum;
+    }
+}
+
+// Index i of an axis of length n, mirrored at the borders including the
+// edge sample (d c b a | a b c d | d c b a), as scipy's 'reflect' mode.
+static int reflect(int i, const int n) {
+    if (n == 1) {
+        return 0;
+    }
+    i %= 2 * n;
+    if (i < 0) {
+        i += 2 * n;
+    }
+    return i < n ? i : 2 * n - 1 - i;
+}
+
+#define PIXEL float
+#define SUFFIX f32
+#define POW powf
+#include "perturbing_float.h"
+
+#define PIXEL double
+#define SUFFIX f64
+#define POW pow
+#include "perturbing_float.h"
+
+#define PIXEL float
+#define SUFFIX f32
+#include "perturbing_pixel.h"
+
+#define PIXEL double
+#define SUFFIX f64
+#include "perturbing_pixel.h"
+
+#define PIXEL uint8_t
+#define SUFFIX u8
+#include "perturbing_pixel.h"
+
+// Look up n boxes of a uint8 img (c,z,y,x) in place, in a single pass. Box
+// m spans section zs[m], rows boxes[4m]:boxes[4m+1] and columns
+// boxes[4m+2]:boxes[4m+3]. luts holds a 256-entry table per box.
+int lookup_u8(uint8_t *img, const int sh[4], const long strd[4],
+              const int *zs, const int *boxes, const int n,
+              const uint8_t *luts, const int nthreads) {
+    int m, ch;
+    #pragma omp parallel for collapse(2) schedule(static) num_threads(N_THREADS(nthreads))
+    for (m = 0; m < n; m++) {
+        for (ch = 0; ch < sh[0]; ch++) {
+            int i, j;
+            const int *box = boxes + 4 * m;
+            const uint8_t *lut = luts + 256 * m;
+            for (i = box[0]; i < box[1]; i++) {
+                uint8_t *row = img + ch * strd[0] + zs[m] * strd[1] + i * strd[2];
+                for (j = box[2]; j < box[3]; j++) {
+                    row[j * strd[3]] = lut[row[j * strd[3]]];
+                }
+            }
+        }
+    }
+    return 0;
+}
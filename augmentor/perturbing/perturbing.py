@@ -0,0 +1,4 @@
+from __future__ import print_function
+
+from ._perturbing import (blur_sections, fill, gaussian, grayscale,
+                          grayscale_lut)
@@ -0,0 +1,226 @@
+/*
+Intensity perturbation of floating point tensors, instantiated once per
+pixel type.
+
+Include this file after defining PIXEL (the C pixel type), SUFFIX (the
+function name suffix) and POW (the power function of the pixel type).
+Arithmetic is done in the pixel type, as numpy does for in-place operations
+with scalars.
+*/
+
+#define TEMPLATE_CAT_(name, suffix) name##_##suffix
+#define TEMPLATE_CAT(name, suffix) TEMPLATE_CAT_(name, suffix)
+#define TEMPLATE(name) TEMPLATE_CAT(name, SUFFIX)
+
+// Grayscale perturbation of n boxes of img (c,z,y,x), in a single pass:
+//   v = clip(v * contrast + brightness, 0, 1) ** gamma
+// Box m spans section zs[m], rows boxes[4m]:boxes[4m+1] and columns
+// boxes[4m+2]:boxes[4m+3]. params holds (contrast, brightness, gamma) per
+// box.
+int TEMPLATE(grayscale)(PIXEL *img, const int sh[4], const long strd[4],
+                        const int *zs, const int *boxes, const int n,
+                        const PIXEL *params, const int nthreads) {
+    int m, ch;
+    #pragma omp parallel for collapse(2) schedule(static) num_threads(N_THREADS(nthreads))
+    for (m = 0; m < n; m++) {
+        for (ch = 0; ch < sh[0]; ch++) {
+            int i, j;
+            const int *box = boxes + 4 * m;
+            const PIXEL contrast = params[3 * m + 0];
+            const PIXEL brightness = params[3 * m + 1];
+            const PIXEL gamma = params[3 * m + 2];
+            for (i = box[0]; i < box[1]; i++) {
+                PIXEL *row = img + ch * strd[0] + zs[m] * strd[1] + i * strd[2];
+                for (j = box[2]; j < box[3]; j++) {
+                    PIXEL v = row[j * strd[3]];
+                    v = v * contrast;
+                    v = v + brightness;
+                    v = v < 0 ? 0 : (v > 1 ? 1 : v);
+                    if (gamma != 1) {
+                        v = POW(v, gamma);
+                    }
+                    row[j * strd[3]] = v;
+                }
+            }
+        }
+    }
+    return 0;
+}
+
+// Recursive Gaussian along one axis of n samples (stride sn), over m
+// independent lines at once (stride sm), in place. The lines are copied to
+// a buffer, extended by pad samples mirrored at each border as scipy's
+// 'reflect' mode, and filtered in double precision (see yvv_lines).
+static int TEMPLATE(iir_lines)(PIXEL *p, const int n, const long sn,
+                               const int m, const long sm, const int pad,
+                               const double c[4], const double M[9]) {
+    const int len = n + 2 * pad;
+    int i, k, err;
+    double *b = (double *)malloc((long)len * m * sizeof(double));
+    if (b == NULL) {
+        return -1;
+    }
+    for (i = 0; i < len; i++) {
+        const PIXEL *src = p + reflect(i - pad, n) * sn;
+        double *dst = b + (long)i * m;
+        for (k = 0; k < m; k++) {
+            dst[k] = src[k * sm];
+        }
+    }
+    err = yvv_lines(b, len, m, c, M);
+    for (i = 0; i < n; i++) {
+        PIXEL *dst = p + i * sn;
+        const double *src = b + (long)(i + pad) * m;
+        for (k = 0; k < m; k++) {
+            dst[k * sm] = src[k];
+        }
+    }
+    free(b);
+    return err;
+}
+
+// Recursive Gaussian blur of img (c,z,y,x) in place, with one sigma per
+// axis. Axes with sigma below 0.5 (or of length 1) are left alone.
+// Every pass recurses along its axis while sweeping the innermost other
+// axis, so that consecutive updates touch consecutive memory.
+int TEMPLATE(gaussian_iir)(PIXEL *img, const int sh[4], const long strd[4],
+                           const double sigma[4], const int nthreads) {
+    int axis;
+    for (axis = 0; axis < 4; axis++) {
+        // Swept axis, and the two outer axes.
+        const int sweep = axis == 3 ? 2 : 3;
+        int outer[2], a, o0, o1, err = 0;
+        double c[4], M[9];
+        const int pad = fir_radius(sigma[axis]);
+        if (sigma[axis] < 0.5 || sh[axis] < 2) {
+            continue;
+        }
+        yvv_coefficients(sigma[axis], c);
+        if (yvv_boundary(c, 64 + (int)(20 * sigma[axis]), M) != 0) {
+            return -1;
+        }
+        for (a = 0, o0 = 0; a < 4; a++) {
+            if (a != axis && a != sweep) {
+                outer[o0++] = a;
+            }
+        }
+        #pragma omp parallel for collapse(2) schedule(static) num_threads(N_THREADS(nthreads)) reduction(|:err)
+        for (o0 = 0; o0 < sh[outer[0]]; o0++) {
+            for (o1 = 0; o1 < sh[outer[1]]; o1++) {
+                PIXEL *p = img + o0 * strd[outer[0]] + o1 * strd[outer[1]];
+                err |= TEMPLATE(iir_lines)(p, sh[axis], strd[axis],
+                                           sh[sweep], strd[sweep], pad, c, M);
+            }
+        }
+        if (err != 0) {
+            return -1;
+        }
+    }
+    return 0;
+}
+
+// In-plane Gaussian blur of a (y,x) plane with the truncated kernel w of
+// radius r, in place. copy holds ny * nx pixels, and acc nx + 2 * r values.
+static void TEMPLATE(fir_plane)(PIXEL *p, const int ny, const int nx,
+                                const long sy, const long sx,
+                                const double *w, const int r,
+                                PIXEL *copy, double *acc) {
+    int i, j, k;
+    // Along y, a row at a time.
+    for (i = 0; i < ny; i++) {
+        for (j = 0; j < nx; j++) {
+            copy[i * nx + j] = p[i * sy + j * sx];
+        }
+    }
+    for (i = 0; i < ny; i++) {
+        PIXEL *row = p + i * sy;
+        for (j = 0; j < nx; j++) {
+            acc[j] = 0;
+        }
+        for (k = -r; k <= r; k++) {
+            const PIXEL *src = copy + reflect(i + k, ny) * nx;
+            const double wk = w[k + r];
+            for (j = 0; j < nx; j++) {
+                acc[j] += wk * src[j];
+            }
+        }
+        for (j = 0; j < nx; j++) {
+            row[j * sx] = acc[j];
+        }
+    }
+    // Along x, a padded row at a time.
+    for (i = 0; i < ny; i++) {
+        PIXEL *row = p + i * sy;
+        for (j = -r; j < nx + r; j++) {
+            acc[j + r] = row[reflect(j, nx) * sx];
+        }
+        for (j = 0; j < nx; j++) {
+            double v = 0;
+            for (k = 0; k <= 2 * r; k++) {
+                v += w[k] * acc[j + k];
+            }
+            row[j * sx] = v;
+        }
+    }
+}
+
+// In-plane Gaussian blur of n boxes of img (c,z,y,x), in place, with one
+// sigma per box. Box m spans section zs[m], rows boxes[4m]:boxes[4m+1] and
+// columns boxes[4m+2]:boxes[4m+3], and is blurred on its own. Boxes with
+// sigma of at least iir_sigma are blurred recursively, the others with a
+// truncated kernel as scipy does.
+int TEMPLATE(blur_sections)(PIXEL *img, const int sh[4], const long strd[4],
+                            const int *zs, const int *boxes, const int n,
+                            const double *sigmas, const double iir_sigma,
+                            const int nthreads) {
+    int m, ch, err = 0;
+    #pragma omp parallel for collapse(2) schedule(dynamic) num_threads(N_THREADS(nthreads)) reduction(|:err)
+    for (m = 0; m < n; m++) {
+        for (ch = 0; ch < sh[0]; ch++) {
+            const int *box = boxes + 4 * m;
+            const int ny = box[1] - box[0], nx = box[3] - box[2];
+            PIXEL *p = img + ch * strd[0] + zs[m] * strd[1]
+                       + box[0] * strd[2] + box[2] * strd[3];
+            const double sigma = sigmas[m];
+            if (sigma <= 0 || ny <= 0 || nx <= 0) {
+                continue;
+            }
+            if (sigma >= iir_sigma && sigma >= 0.5) {
+                double c[4], M[9];
+                const int pad = fir_radius(sigma);
+                yvv_coefficients(sigma, c);
+                if (yvv_boundary(c, 64 + (int)(20 * sigma), M) != 0) {
+                    err |= 1;
+                    continue;
+                }
+                err |= TEMPLATE(iir_lines)(p, ny, strd[2], nx, strd[3], pad,
+                                           c, M);
+                err |= TEMPLATE(iir_lines)(p, nx, strd[3], ny, strd[2], pad,
+                                           c, M);
+            } else {
+                // Kernel weights, then the accumulator.
+                const int r = fir_radius(sigma);
+                const long nw = (2 * r + 1) + (nx + 2 * r);
+                double *w = (double *)malloc(nw * sizeof(double));
+                PIXEL *copy = (PIXEL *)malloc((long)ny * nx * sizeof(PIXEL));
+                if (w == NULL || copy == NULL) {
+                    err |= 1;
+                } else {
+                    fir_weights(sigma, r, w);
+                    TEMPLATE(fir_plane)(p, ny, nx, strd[2], strd[3], w, r,
+                                        copy, w + 2 * r + 1);
+                }
+                free(w);
+                free(copy);
+            }
+        }
+    }
+    return err ? -1 : 0;
+}
+
+#undef TEMPLATE
+#undef TEMPLATE_CAT
+#undef TEMPLATE_CAT_
+#undef PIXEL
+#undef SUFFIX
+#undef POW
@@ -0,0 +1,39 @@
+/*
+Perturbation kernels of any pixel type, instantiated once per pixel type.
+
+Include this file after defining PIXEL (the C pixel type) and SUFFIX (the
+function name suffix).
+*/
+
+#define TEMPLATE_CAT_(name, suffix) name##_##suffix
+#define TEMPLATE_CAT(name, suffix) TEMPLATE_CAT_(name, suffix)
+#define TEMPLATE(name) TEMPLATE_CAT(name, SUFFIX)
+
+// Fill n boxes of img (c,z,y,x) with one value per box. Box m spans section
+// zs[m], rows boxes[4m]:boxes[4m+1] and columns boxes[4m+2]:boxes[4m+3].
+int TEMPLATE(fill)(PIXEL *img, const int sh[4], const long strd[4],
+                   const int *zs, const int *boxes, const int n,
+                   const PIXEL *values, const int nthreads) {
+    int m, ch;
+    #pragma omp parallel for collapse(2) schedule(static) num_threads(N_THREADS(nthreads))
+    for (m = 0; m < n; m++) {
+        for (ch = 0; ch < sh[0]; ch++) {
+            int i, j;
+            const int *box = boxes + 4 * m;
+            const PIXEL v = values[m];
+            for (i = box[0]; i < box[1]; i++) {
+                PIXEL *row = img + ch * strd[0] + zs[m] * strd[1] + i * strd[2];
+                for (j = box[2]; j < box[3]; j++) {
+                    row[j * strd[3]] = v;
+                }
+            }
+        }
+    }
+    return 0;
+}
+
+#undef TEMPLATE
+#undef TEMPLATE_CAT
+#undef TEMPLATE_CAT_
+#undef PIXEL
+#undef SUFFIX
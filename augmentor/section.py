@@ -8,13 +8,24 @@ from .perturb import Perturb
 class Section(Augment):
     """Perturb random sections in a training sample.
 
+    The perturbations of all sections are drawn in ``prepare``, as arrays of
+    parameters with one entry per perturbed box (a whole section here, or a
+    quadrant of one for ``PartialSection``). ``__call__`` then applies all
+    of them with a single ``Perturb.apply`` per image. Perturbations without
+    a batched ``apply`` are called one by one, on both sections of a double
+    section at once.
+
     Args:
         perturb_cls (``Perturb``): ``Perturb`` class.
         maxsec (int):
         prob (float, optional):
         skip (float, optional): skip probability.
         double (bool, optional): double section.
+        individual (bool, optional): draw a perturbation per section, rather
+            than one for all.
     """
+    view_compatible = True
+
     def __init__(self, perturb_cls, maxsec=0, prob=None, skip=0, double=False,
                  individual=True, **params):
         assert issubclass(perturb_cls, Perturb)
@@ -28,16 +39,15 @@ class Section(Augment):
         self.params = params
         self.zlocs = []
         self.imgs = []
+        self.entries = None
 
     def prepare(self, spec, imgs=[], **kwargs):
         # Biased coin toss
         if np.random.rand() < self.skip:
             self.zlocs = []
+            self.entries = None
             return dict(spec)
 
-        # Perturbation
-        self.perturb = self.get_perturb()
-
         # Random sections
         zdim = self._validate(spec, imgs) - self.margin
         if self.prob is None:
@@ -48,17 +58,25 @@ class Section(Augment):
             zlocs = np.where(zlocs)[0]
         self.zlocs = zlocs
         self.imgs = imgs
+
+        # Perturbations
+        self.entries = self.draw(zlocs)
         return dict(spec)
 
     def __call__(self, sample, **kwargs):
         sample = Augment.to_tensor(sample)
-        for z in self.zlocs:
-            if self.margin > 0:
-                z = slice(z, z + self.margin + 1)
-            if self.individual:
-                self.perturb = self.get_perturb()
+        if self.entries is not None and len(self.entries['z']) > 0:
             for k in self.imgs:
-                self.perturb(sample[k][...,z,:,:])
+                img = sample[k]
+                zlocs, boxes, values = self.locate(img.shape[-2:])
+                if self._batched():
+                    self.perturb_cls.apply(img, zlocs, boxes, values,
+                                           **self.params)
+                    continue
+                depth = self.margin + 1
+                for z, box, perturb in zip(zlocs, boxes, values['perturb']):
+                    y0, y1, x0, x1 = box
+                    perturb(img[...,z:z+depth,y0:y1,x0:x1])
         return Augment.sort(sample)
 
     def __repr__(self):
@@ -74,8 +92,66 @@ class Section(Augment):
         format_string += ')'
         return format_string
 
-    def get_perturb(self):
-        return self.perturb_cls(**self.params)
+    def draw(self, zlocs):
+        """Draw the perturbed boxes of sections zlocs, and their perturbations.
+
+        Returns:
+            dict with the section ``z`` (the first of a double section, for
+            unbatched perturbations) and fractional box ``box`` (y0,y1,x0,x1)
+            of every entry, and ``values``, the parameters of its perturbation
+            as a dict of arrays. Entries are in the order the perturbations
+            would be applied one by one.
+        """
+        zlocs = np.asarray(zlocs, dtype=int)
+        n = len(zlocs) if self.individual else min(len(zlocs), 1)
+        box, sec, val, nval = self.get_boxes(n)
+        values = self.perturb_cls.draw(nval, **self.params)
+
+        # A single draw is shared by all sections.
+        if not self.individual:
+            k = len(sec)
+            box = np.tile(box, (len(zlocs), 1))
+            val = np.tile(val, len(zlocs))
+            sec = np.repeat(np.arange(len(zlocs)), k)
+
+        # Double sections get the same perturbation. Unbatched perturbations
+        # are applied to both sections at once.
+        depth = self.margin + 1 if self._batched() else 1
+        e = np.tile(np.arange(len(sec)), depth)
+        dz = np.repeat(np.arange(depth), len(sec))
+        order = np.lexsort((e, dz, sec[e]))
+        e, dz = e[order], dz[order]
+        entries = dict()
+        entries['z'] = zlocs[sec[e]] + dz
+        entries['box'] = box[e]
+        entries['values'] = {k: v[val[e]] for k, v in values.items()}
+        return entries
+
+    def get_boxes(self, n):
+        """Fractional boxes of n perturbed sections.
+
+        Returns:
+            ``(box, sec, val, nval)``: (m,4) boxes (y0,y1,x0,x1) as fractions
+            of the section size, the section and the perturbation index of
+            every box, and the number of perturbations to draw.
+        """
+        box = np.tile([0.0, 1.0, 0.0, 1.0], (n, 1))
+        sec = np.arange(n)
+        return box, sec, sec, n
+
+    def locate(self, shape):
+        """Entries with boxes in pixels, for sections of size shape (y,x).
+        Empty boxes are dropped."""
+        y, x = shape
+        boxes = np.floor(self.entries['box'] * [y, y, x, x]).astype(int)
+        keep = (boxes[:,1] > boxes[:,0]) & (boxes[:,3] > boxes[:,2])
+        values = {k: v[keep] for k, v in self.entries['values'].items()}
+        return self.entries['z'][keep], boxes[keep], values
+
+    def _batched(self):
+        """Whether perturb_cls applies batches of perturbations itself,
+        rather than with the default ``Perturb.apply``."""
+        return self.perturb_cls.apply.__func__ is not Perturb.apply.__func__
 
     def _validate(self, spec, imgs):
         assert len(imgs) > 0
@@ -88,42 +164,43 @@ class Section(Augment):
 
 
 class PartialSection(Section):
-    def get_perturb(self):
-        class _PerturbQuadrant():
-            def __init__(self, perturb, rx, ry, quad):
-                self.perturb = perturb
-                self.rx = rx
-                self.ry = ry
-                self.quad = quad
-
-            def __call__(self, img):
-                x = int(np.floor(self.rx * img.shape[-1]))
-                y = int(np.floor(self.ry * img.shape[-2]))
-                # 1st quadrant.
-                if self.quad[0]:
-                    self.perturb[0](img[...,:y,:x])
-                # 2nd quadrant.
-                if self.quad[1]:
-                    self.perturb[1](img[...,y:,:x])
-                # 3nd quadrant.
-                if self.quad[2]:
-                    self.perturb[2](img[...,:y,x:])
-                # 4nd quadrant.
-                if self.quad[3]:
-                    self.perturb[3](img[...,y:,x:])
-
-        rx, ry = np.random.rand(2)
-        quad = np.random.rand(4) > 0.5
+    """Perturb random quadrants of random sections, split at a random point.
+    """
+    def get_boxes(self, n):
+        # Split point and quadrants.
+        rand = np.random.rand(n, 6)
+        rx, ry = rand[:,0], rand[:,1]
+        quad = rand[:,2:] > 0.5
+
+        # 1st to 4th quadrant: [:y,:x], [y:,:x], [:y,x:], [y:,x:].
+        zero, one = np.zeros(n), np.ones(n)
+        box = np.stack([np.stack([zero, ry, zero, rx], axis=-1),
+                        np.stack([ry, one, zero, rx], axis=-1),
+                        np.stack([zero, ry, rx, one], axis=-1),
+                        np.stack([ry, one, rx, one], axis=-1)], axis=1)
+        sec = np.repeat(np.arange(n), 4)
         if self.individual:
-            perturb = [self.perturb_cls(**self.params) for _ in range(4)]
+            val, nval = np.arange(4*n), 4*n
         else:
-            perturb = [self.perturb_cls(**self.params)] * 4
-        return _PerturbQuadrant(perturb, rx, ry, quad)
+            val, nval = sec, n
+        quad = quad.reshape(-1)
+        return box.reshape(-1, 4)[quad], sec[quad], val[quad], nval
 
 
 class MixedSection(PartialSection):
-    def get_perturb(self):
-        if np.random.rand() > 0.5:
-            return Section.get_perturb(self)
-        else:
-            return PartialSection.get_perturb(self)
+    """Perturb random sections, either fully or partially.
+    """
+    def get_boxes(self, n):
+        full = np.random.rand(n) > 0.5
+        boxes = [Section.get_boxes(self, np.count_nonzero(full)),
+                 PartialSection.get_boxes(self, np.count_nonzero(~full))]
+        box, sec, val, nval = [], [], [], 0
+        for (b, s, v, nv), secs in zip(boxes, [np.where(full)[0],
+                                               np.where(~full)[0]]):
+            box.append(b)
+            sec.append(secs[s])
+            val.append(v + nval)
+            nval += nv
+        box, sec, val = [np.concatenate(a) for a in (box, sec, val)]
+        order = np.argsort(sec, kind='stable')
+        return box[order], sec[order], val[order], nval
@@ -2,24 +2,46 @@ from __future__ import print_function
 import numpy as np
 import time
 
+from . import utils
 from .augment import Augment
 from .flip import FlipRotate
-from .perturb import Blur3D
+from .perturb import Blur3D, smooth_noise
 
 
 __all__ = ['Track']
 
 
 class Track(Augment):
+    """Track marks.
+
+    Stencils are drawn from a bank of precomputed stencil sections, built
+    on the first use (or by ``build_bank``) and rebuilt only for taller
+    sections. Every sample takes random sections of the bank, cropped at
+    random heights and randomly flipped, and shares them across images.
+
+    Args:
+        width (int, optional): track width.
+        margin (int, optional): gradation margin on each side of the track.
+        sigma (3-tuple, optional): in-plane blur of the gradation, of the
+            noise, and of the final stencil.
+        thresh (float, optional): noise threshold.
+        skip (float, optional): skip probability.
+        bank (int, optional): number of stencil sections in the bank.
+    """
     def __init__(self, width=120, margin=20, sigma=(15,10,3), thresh=0,
-                 skip=0, **kwargs):
+                 skip=0, bank=32, **kwargs):
         self.width = int(width)
         self.margin = int(margin)
+        self.sigma = tuple(sigma)
         self.blur = list()
         for s in sigma:
             self.blur.append(Blur3D((0,s,s)))
+        # The gradation is a single row, cheap to blur exactly.
+        self.blur[0].backend = 'scipy'
         self.thresh = np.clip(thresh, 0, 1)
         self.skip = np.clip(skip, 0, 1)
+        self.bank_size = max(int(bank), 1)
+        self.bank = None
         self.do_aug = False
         self.imgs = []
         self.flip_rotate = FlipRotate()
@@ -57,33 +79,66 @@ class Track(Augment):
     def augment(self, sample, **kwargs):
         loc = np.random.rand() * 0.5 + 0.25
 
+        # Stencils shared by all images, centered on each.
+        depth = max(sample[k].shape[-3] for k in self.imgs)
+        height = max(sample[k].shape[-2] for k in self.imgs)
+        stencils = [self.sample_stencil(depth, height) for _ in range(2)]
+
         for k in self.imgs:
             img = sample[k]
             [depth,height,width] = img.shape[-3:]
             a = int(width * loc) - (self.width // 2)
             b = a + self.width
             assert a >= 0 and b < width
-            s0 = self.stencil(depth, height)
-            s1 = self.stencil(depth, height)
-            img[...,:,:,a:b] *= (1 - s0)
-            img[...,:,:,a:b] += s0
-            img[...,:,:,a:b] *= (1 - s1)
-            img[...,:,:,a:b] += s1
+            s0, s1 = [self._center(s, depth, height) for s in stencils]
+            if img.dtype == np.uint8:
+                # Blend in float, only over the track.
+                track = utils.to_float(img[...,:,:,a:b])
+            else:
+                track = img[...,:,:,a:b]
+            track *= (1 - s0)
+            track += s0
+            track *= (1 - s1)
+            track += s1
+            if img.dtype == np.uint8:
+                img[...,:,:,a:b] = utils.from_float(track, img.dtype)
 
         return sample
 
+    def build_bank(self, height):
+        """Precompute the stencil bank for sections up to height tall."""
+        # Twice as tall, for random crops away from the bank borders.
+        self.bank = self.stencil(self.bank_size, 2 * height)
+
+    def sample_stencil(self, depth, height):
+        """Stencil of random sections of the bank."""
+        if self.bank is None or self.bank.shape[-2] < 2 * height:
+            self.build_bank(height)
+        bank = self.bank
+        idx = np.random.randint(bank.shape[0], size=depth)
+        off = np.random.randint(bank.shape[-2] - height + 1, size=depth)
+        stencil = bank[idx[:,np.newaxis], off[:,np.newaxis] + np.arange(height)]
+        if np.random.rand() > 0.5:
+            stencil = stencil[:,::-1,:]
+        if np.random.rand() > 0.5:
+            stencil = stencil[:,:,::-1]
+        return stencil
+
+    def _center(self, stencil, depth, height):
+        z = (stencil.shape[0] - depth) // 2
+        y = (stencil.shape[1] - height) // 2
+        return stencil[z:z+depth,y:y+height,:]
+
     def stencil(self, depth, height):
         size = (depth, height, self.width)
 
-        # Gradation
-        grad = np.zeros(size).astype('float32')
+        # Gradation, constant along z and y.
+        grad = np.zeros((1,1,self.width)).astype('float32')
         grad[:,:,self.margin:-self.margin] = 1
         self.blur[0](grad)
 
-        # Stencil for track mark
-        # stencil = np.random.rand(depth, height, self.width).astype('float32')
-        stencil = np.random.normal(0, 1, size).astype('float32')
-        self.blur[1](stencil)
+        # Stencil for track mark, synthesized at low resolution.
+        stencil = smooth_noise(size, self.sigma[1])
         stencil = (stencil > self.thresh).astype(stencil.dtype)
         stencil *= grad
         self.blur[2](stencil)
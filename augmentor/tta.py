@@ -0,0 +1,128 @@
+from __future__ import print_function
+import itertools
+import numpy as np
+
+from . import utils
+from .flip import Flip, Transpose
+
+
+__all__ = ['TTA']
+
+
+class TTA(object):
+    """Test-time augmentation over the ``FlipRotate`` symmetry group.
+
+    Enumerates the 16 orientations of ``FlipRotate`` (48 of
+    ``FlipRotateIsotropic``) of an input as strided views, feeds them to a
+    model in batches, maps every prediction back to the original orientation
+    (again as a view), and accumulates the average into a single output
+    buffer.
+
+    Args:
+        isotropic (bool, optional): also permute z with y/x, as
+            ``FlipRotateIsotropic`` does.
+
+    Example:
+        >>> tta = TTA()
+        >>> pred = tta(model, img, batch_size=4)
+    """
+    def __init__(self, isotropic=False):
+        self.isotropic = isotropic
+        if isotropic:
+            perms = list(itertools.permutations((1,2,3)))
+        else:
+            perms = [(1,2,3), (1,3,2)]
+
+        # Each variant is a chain of flips and a transpose, in the order
+        # FlipRotate applies them.
+        self.variants = []
+        for perm in perms:
+            for flips in itertools.product((False, True), repeat=3):
+                augs = [Flip(axis=a) for a in (-1,-2,-3)]
+                augs.append(Transpose(axes=(0,) + perm))
+                for aug, flip in zip(augs, flips):
+                    aug.do_aug = flip
+                augs[-1].do_aug = perm != (1,2,3)
+                self.variants.append(augs)
+
+    def __len__(self):
+        return len(self.variants)
+
+    def __call__(self, model, img, batch_size=1, out=None):
+        """Average the predictions of model over every variant of img.
+
+        Args:
+            model (callable): maps a batch (b,c,z,y,x) to a prediction
+                (b,c',z,y,x) of the same spatial shape.
+            img (ndarray): (z,y,x) or (c,z,y,x) input.
+            batch_size (int, optional): number of variants per model call.
+            out (ndarray, optional): (c',z,y,x) floating-point buffer for
+                the result, overwritten.
+
+        Returns:
+            (c',z,y,x) average prediction in the original orientation.
+        """
+        img = utils.to_tensor(img)
+        batch_size = max(int(batch_size), 1)
+        batch = None
+        first = True
+        for idx, variants in self.batches(img, batch_size):
+            # One reusable buffer per batch shape.
+            shape = (len(variants),) + variants[0].shape
+            if batch is None or batch.shape != shape:
+                batch = np.empty(shape, dtype=img.dtype)
+            for b, v in zip(batch, variants):
+                b[...] = v
+            pred = model(batch)
+
+            for i, p in zip(idx, pred):
+                p = self.inverse(p, i)
+                if first:
+                    out = self._output(out, p)
+                    first = False
+                out += p
+        out /= len(self)
+        return out
+
+    @staticmethod
+    def _output(out, pred):
+        """Zeroed output buffer for predictions like pred."""
+        if out is None:
+            return np.zeros(pred.shape, dtype=np.float32)
+        assert out.shape == pred.shape
+        assert np.issubdtype(out.dtype, np.floating)
+        out[...] = 0
+        return out
+
+    def forward(self, img, i):
+        """Variant i of a (c,z,y,x) tensor, as a view."""
+        for aug in self.variants[i]:
+            img = aug.view(img)
+        return img
+
+    def inverse(self, img, i):
+        """Map a (c,z,y,x) tensor in the orientation of variant i back to
+        the original orientation, as a view."""
+        for aug in reversed(self.variants[i]):
+            img = aug.inverse_view(img)
+        return img
+
+    def batches(self, img, batch_size=1):
+        """Yield the variants of a (c,z,y,x) tensor in batches of at most
+        batch_size views of the same shape, with their indices."""
+        idx, views = [], []
+        for i in range(len(self)):
+            v = self.forward(img, i)
+            if views and (len(views) == batch_size or v.shape != views[0].shape):
+                yield idx, views
+                idx, views = [], []
+            idx.append(i)
+            views.append(v)
+        if views:
+            yield idx, views
+
+    def __repr__(self):
+        format_string = self.__class__.__name__ + '('
+        format_string += 'isotropic={}'.format(self.isotropic)
+        format_string += ')'
+        return format_string
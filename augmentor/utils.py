@@ -14,3 +14,83 @@ def to_tensor(data):
         raise RuntimeError("data must be a numpy 4D array")
     assert data.ndim==4
     return data
+
+
+def take_slabs(data, slabs, shape, out=None):
+    """Assemble a 4D tensor from z-slabs of data, writing every voxel once.
+
+    Args:
+        data (ndarray): (c,z,y,x) source tensor.
+        slabs (list): ``(z0, z1, index)`` triples, where sections ``z0:z1``
+            of the output are copied from ``data[..., index]`` and index is
+            a (z,y,x) tuple of slices.
+        shape (3-tuple): output shape (z,y,x).
+        out (ndarray, optional): (c,z,y,x) array of any memory layout (e.g.
+            a flipped or transposed view) to write into.
+
+    Returns:
+        The assembled tensor.
+    """
+    if out is None:
+        out = np.empty(data.shape[:-3] + tuple(shape), dtype=data.dtype)
+    for z0, z1, index in slabs:
+        out[...,z0:z1,:,:] = data[(Ellipsis,) + tuple(index)]
+    return out
+
+
+def empty_oriented(shape, dtype, augs):
+    """Uninitialized tensor in the orientation produced by flips/transposes.
+
+    Args:
+        shape (tuple): tensor shape before augs.
+        dtype: tensor dtype.
+        augs (list): augments with ``view``/``inverse_view`` (e.g. the
+            stages of a prepared ``FlipRotate``), in the order applied.
+
+    Returns:
+        ``(final, view)``: a new contiguous array in the orientation after
+        augs, and a view of it in the orientation before them. Writing into
+        view yields the augmented tensor in final without another copy.
+    """
+    final = np.broadcast_to(np.empty((), dtype=dtype), shape)
+    for aug in augs:
+        final = aug.view(final)
+    final = np.empty(final.shape, dtype=dtype)
+    view = final
+    for aug in reversed(augs):
+        view = aug.inverse_view(view)
+    return final, view
+
+
+def to_float(data, dtype=np.float32):
+    """Cast an image to floating point in [0,1].
+
+    Args:
+        data (ndarray): image. uint8 images are scaled by 1/255, floating
+            point images are assumed to be in [0,1] already.
+        dtype: floating point dtype.
+
+    Returns:
+        The image in dtype, without a copy if it already is.
+    """
+    if data.dtype == np.uint8:
+        out = data.astype(dtype)
+        out *= out.dtype.type(1/255.0)
+        return out
+    return data.astype(dtype, copy=False)
+
+
+def from_float(value, dtype):
+    """Cast values in [0,1] to an image dtype.
+
+    Args:
+        value (float or ndarray): values in [0,1].
+        dtype: image dtype. uint8 maps [0,1] to [0,255], rounding and
+            saturating; any other dtype is a plain cast.
+
+    Returns:
+        The values in dtype.
+    """
+    if np.dtype(dtype) == np.uint8:
+        value = np.rint(np.clip(np.multiply(value, 255), 0, 255))
+    return np.asarray(value).astype(dtype, copy=False)
@@ -1,9 +1,11 @@
 from __future__ import print_function
+from collections import OrderedDict
 import numpy as np
 
 from .augment import Augment
+from . import utils
 from .warping import warping
-from .geometry.box import Box
+from .geometry.box import Box, centered_box
 
 
 class Warp(Augment):
@@ -14,9 +16,53 @@ class Warp(Augment):
         3. Twist
         4. Scale
         5. Perspective stretch
+
+    Args:
+        skip (float, optional): skip probability.
+        threads (int, optional): number of threads for the warp kernel.
+            Non-positive values use all available cores. The GIL is
+            released while warping.
+        joint (bool, optional): warp all keys of a sample (e.g. image, label
+            and mask) in a single pass over the output, computing the source
+            coordinates of each pixel once, instead of precomputing a source
+            index map and gathering every key from it.
+        quantize (bool or dict, optional): snap the random warp parameters
+            to a grid, so that source index maps can be reused across
+            samples. By default the grid step of each parameter is its
+            configured range (e.g. ``2 * shear_max`` for the shear) divided
+            by ``QUANTIZE_LEVELS``, so every parameter keeps varying over its
+            range. A dict sets the steps of any of ``rot``, ``shear``,
+            ``twist`` (degrees), ``scale`` and ``stretch`` instead. A step of
+            0 leaves the parameter continuous. The number of distinct warps
+            grows quickly with the number of varying parameters: with the
+            default ranges there are about 18000 of them and the cache
+            practically never hits. With ``stretch_max=0`` there are about
+            400, and the cache hits 15% and 30% of the time when it holds 48
+            and 96 of them. With ``shear_max=0`` as well there are about 85,
+            and the cache hits 35% and 70% of the time when it holds 24 and
+            48 of them.
+        cache_bytes (int, optional): maximum total size in bytes of the source
+            index maps kept in the least-recently-used cache of quantized
+            warps. A map of a (20,256,256) patch takes about 10 MB.
     """
-    def __init__(self, skip=0, **params):
+    view_compatible = True
+    QUANTIZE_PARAMS = ('rot', 'shear', 'twist', 'scale', 'stretch')
+    QUANTIZE_LEVELS = 4
+
+    def __init__(self, skip=0, threads=1, joint=False, quantize=False,
+                 cache_bytes=512*2**20, **params):
         self.skip = np.clip(skip, 0, 1)
+        self.threads = int(threads)
+        self.joint = bool(joint)
+        self.quantize = None
+        if quantize:
+            self.quantize = dict()
+            if isinstance(quantize, dict):
+                assert all(k in self.QUANTIZE_PARAMS for k in quantize)
+                self.quantize.update(quantize)
+        self.cache_bytes = max(int(cache_bytes), 0)
+        self.cache = OrderedDict()
+        self.cache_nbytes = 0
         self.params = dict(params)
         self.do_warp = False
         self.imgs = []
@@ -38,20 +84,9 @@ class Warp(Augment):
             box = box.merge(Box((0,0,0), v[-3:]))
         maxsz = tuple(box.size())
 
-        # Random warp parameters
-        params = dict(self.params)
-        params.update(kwargs)
-        warp_params = warping.getWarpParams(maxsz, **params)
-        self.size = tuple(x for x in warp_params[0])
+        # Random warp parameters & source index map.
+        self._random_warp(maxsz, **kwargs)
         size_diff = tuple(x-y for x,y in zip(self.size, maxsz))
-        self.rot     = warp_params[1]
-        self.shear   = warp_params[2]
-        self.scale   = warp_params[3]
-        self.stretch = warp_params[4]
-        self.twist   = warp_params[5]
-
-        # DEBUG
-        # print(warp_params)
 
         # Increase tensor size.
         ret = dict()
@@ -65,29 +100,253 @@ class Warp(Augment):
     def __call__(self, sample, **kwargs):
         sample = Augment.to_tensor(sample)
         if self.do_warp:
-            for k, v in sample.items():
-                v = np.transpose(v, (1,0,2,3))
-                if k in self.imgs:
-                    v = warping.warp3d(v, self.spec[k][-3:],
-                            self.rot, self.shear,
-                            self.scale, self.stretch, self.twist
-                        )
-                else:
-                    v = warping.warp3dLab(v, self.spec[k][-3:], self.size,
-                            self.rot, self.shear,
-                            self.scale, self.stretch, self.twist
-                        )
-                # Prevent potential negative stride issues by copying.
-                sample[k] = np.copy(np.transpose(v, (1,0,2,3)))
+            sample.update(self.warp(sample))
         return Augment.sort(sample)
 
+    def warp(self, sample, out=None):
+        """Warp every key of a sample with the prepared transformation.
+
+        Inputs of any memory layout (e.g. flipped or transposed views) are
+        read directly without copying.
+
+        Args:
+            sample (dict): (c,z,y,x) tensors.
+            out (dict, optional): arrays of any memory layout to write the
+                result of a key into, instead of allocating a new one.
+
+        Returns:
+            dict of warped tensors.
+        """
+        out = dict() if out is None else out
+        keys = list(sample.keys())
+        if self.joint:
+            res = warping.warp3dJointFast([sample[k] for k in keys],
+                        [self.spec[k][-3:] for k in keys], self.size,
+                        self.rot, self.shear, self.scale, self.stretch,
+                        self.twist, threads=self.threads,
+                        outs=[out.get(k) for k in keys]
+                    )
+            return dict(zip(keys, res))
+        res = dict()
+        for k in keys:
+            res[k] = warping.warp3dGather(sample[k], self.warp_map,
+                        self.spec[k][-3:], self.size,
+                        threads=self.threads, out=out.get(k)
+                    )
+        return res
+
+    def apply_from_volume(self, volume, center, out_shape, **kwargs):
+        """Warp a patch directly out of a large volume.
+
+        Only the voxels the random transformation maps to are read, so there
+        is no need to cut out the enlarged input patch first, and a large
+        ``np.memmap`` is read without loading it into memory.
+
+        Args:
+            volume (ndarray): (z,y,x) or (c,z,y,x) volume, e.g. ``np.memmap``.
+            center (3-tuple of int): patch center (z,y,x) in the volume.
+            out_shape (3-tuple of int): output patch size (z,y,x).
+
+        Returns:
+            (c,z,y,x) warped patch in the dtype of ``volume``. Voxels mapped
+            outside of the volume are zero.
+        """
+        volume = utils.to_tensor(volume)
+        out_shape = tuple(int(x) for x in out_shape[-3:])
+
+        # Biased coin toss
+        self.do_warp = np.random.rand() > self.skip
+        if not self.do_warp:
+            # Plain crop, zero-padded outside of the volume.
+            out = np.zeros(volume.shape[:1] + out_shape, dtype=volume.dtype)
+            box = centered_box(center, out_shape)
+            vbox = Box((0,0,0), volume.shape[-3:]).intersect(box)
+            if vbox is not None:
+                vmin, vmax = vbox.min(), vbox.max()
+                dst = tuple(slice(int(a-b), int(c-b)) for a,b,c in zip(vmin, box.min(), vmax))
+                src = tuple(slice(int(a), int(c)) for a,c in zip(vmin, vmax))
+                out[(slice(None),) + dst] = volume[(slice(None),) + src]
+            return out
+
+        # The input frame of the warp, centered on center.
+        self._random_warp(out_shape, **kwargs)
+        frame = centered_box(center, self.size)
+        offset = tuple(-int(x) for x in frame.min())
+        if self.joint:
+            return warping.warp3dJointFast([volume], [out_shape], self.size,
+                        self.rot, self.shear, self.scale, self.stretch,
+                        self.twist, threads=self.threads, offsets=[offset]
+                    )[0]
+        return warping.warp3dGather(volume, self.warp_map, out_shape,
+                    self.size, offset=offset, threads=self.threads
+                )
+
     def __repr__(self):
         format_string = self.__class__.__name__ + '('
-        format_string += 'skip={:.2f}'.format(self.skip)
+        format_string += 'skip={:.2f}, '.format(self.skip)
+        format_string += 'threads={}, '.format(self.threads)
+        format_string += 'joint={}'.format(self.joint)
+        if self.quantize is not None:
+            format_string += ', quantize={}, '.format(self.quantize)
+            format_string += 'cache_bytes={}'.format(self.cache_bytes)
         format_string += ')'
         return format_string
 
+    def _random_warp(self, maxsz, **kwargs):
+        """Draw random warp parameters and compute the source index map,
+        unless warping jointly."""
+        key = self._random_params(maxsz, **kwargs)
+
+        # Source index map, shared by every key of the sample.
+        if self.joint:
+            self.warp_map = None
+            return
+        if key is not None and key in self.cache:
+            self.cache.move_to_end(key)
+            self.warp_map = self.cache[key]
+            return
+        self.warp_map = warping.warp3dMap(self.size, maxsz,
+                            self.rot, self.shear,
+                            self.scale, self.stretch, self.twist,
+                            threads=self.threads
+                        )
+        if key is not None:
+            self._cache(key, self.warp_map)
+
+    def _cache(self, key, warp_map):
+        """Add a source index map to the cache, evicting the least recently
+        used ones beyond cache_bytes."""
+        nbytes = sum(a.nbytes for a in warp_map)
+        if nbytes > self.cache_bytes:
+            return
+        self.cache[key] = warp_map
+        self.cache_nbytes += nbytes
+        while self.cache_nbytes > self.cache_bytes:
+            _, old = self.cache.popitem(last=False)
+            self.cache_nbytes -= sum(a.nbytes for a in old)
+
+    def _random_params(self, maxsz, **kwargs):
+        """Draw random warp parameters and the required input size. Returns
+        the cache key of the warp if quantized, None otherwise."""
+        params = dict(self.params)
+        params.update(kwargs)
+        warp_params = warping.getWarpParams(maxsz, **params)
+        self.size = tuple(int(x) for x in warp_params[0])
+        self.rot     = warp_params[1]
+        self.shear   = warp_params[2]
+        self.scale   = warp_params[3]
+        self.stretch = warp_params[4]
+        self.twist   = warp_params[5]
+
+        if self.quantize is None:
+            return None
+        return self._quantize(maxsz, self._quantize_steps(**params))
+
+    def _quantize_steps(self, **params):
+        """Grid steps of the quantized warp parameters, for the parameter
+        ranges configured by params (see ``warping.getWarpParams``)."""
+        ranges = warping.getWarpRanges(**params)
+        spans = {'rot': ranges['rot_max'],
+                 'shear': 2 * ranges['shear_max'],
+                 'twist': 2 * ranges['rot_max'],
+                 'scale': abs(ranges['scale_max'] - 1),
+                 'stretch': 2 * ranges['stretch_max']}
+        steps = {k: float(v) / self.QUANTIZE_LEVELS for k, v in spans.items()}
+        steps.update(self.quantize)
+        return steps
+
+    def _quantize(self, maxsz, steps):
+        """Snap the warp parameters to the quantization grid, update the
+        required input size, and return the cache key of the warp."""
+        def snap(x, step):
+            x = np.asarray(x, dtype=np.float64)
+            if step:
+                x = np.round(x / step) * step
+            return x, tuple(float(v) for v in x.flat)
+
+        self.rot, rot_k = snap(self.rot, steps['rot'])
+        self.shear, shear_k = snap(self.shear, steps['shear'])
+        self.twist, twist_k = snap(self.twist, steps['twist'])
+        self.scale, scale_k = snap(self.scale, steps['scale'])
+        self.stretch, stretch_k = snap(self.stretch, steps['stretch'])
+        self.rot, self.shear, self.twist = (float(self.rot), float(self.shear),
+                                            float(self.twist))
+
+        # Snapping changes the extent of the transformation.
+        req_size, _, _ = warping.getRequiredPatchSize(maxsz,
+                            self.rot, self.shear, self.scale, self.stretch,
+                            self.twist
+                        )
+        self.size = tuple(int(x) for x in req_size)
+        return (tuple(maxsz), rot_k, shear_k, twist_k, scale_k, stretch_k)
+
     def _validate(self, spec, imgs):
         assert len(imgs) > 0
         assert all(k in spec for k in imgs)
         return imgs
+
+
+class ElasticWarp(Warp):
+    """Elastic deformation composed with the linear transformations of Warp.
+
+    Random in-plane displacements are drawn on a coarse grid spanning the
+    output patch, and upsampled (linearly) inside the warp kernel while the
+    source index map is computed, so that the deformation costs about the
+    same as the linear warp alone. The linear transformation is that of
+    Warp, and the input patch is enlarged in-plane by the largest
+    displacement on each side.
+
+    Args:
+        grid (3-tuple of int, optional): number of grid nodes (z,y,x).
+        sigma (float, optional): standard deviation of the displacements of
+            the grid nodes, in pixels.
+        skip (float, optional): skip probability.
+        threads (int, optional): number of threads for the warp kernel.
+    """
+    def __init__(self, grid=(3,5,5), sigma=2.0, skip=0, threads=1, **params):
+        # The deformation is applied while computing the source index map,
+        # which is specific to every sample: there is no joint warping and
+        # no quantized map cache.
+        super(ElasticWarp, self).__init__(skip=skip, threads=threads,
+                                          joint=False, quantize=False,
+                                          cache_bytes=0, **params)
+        self.grid = tuple(max(int(x), 1) for x in grid)
+        self.sigma = max(float(sigma), 0)
+        self.margin = 0
+
+    def prepare(self, spec, imgs=[], **kwargs):
+        ret = super(ElasticWarp, self).prepare(spec, imgs=imgs, **kwargs)
+        if not self.do_warp:
+            return ret
+
+        # Enlarge the inputs in-plane to contain the displaced coordinates.
+        # The transformation stays centered on the frame of the linear warp,
+        # and the inputs are centered on it, i.e. start at offset -margin.
+        m = self.margin
+        return {k: v[:-2] + tuple(x + 2*m for x in v[-2:])
+                for k, v in ret.items()}
+
+    def __repr__(self):
+        format_string = self.__class__.__name__ + '('
+        format_string += 'grid={}, '.format(self.grid)
+        format_string += 'sigma={:.2f}, '.format(self.sigma)
+        format_string += 'skip={:.2f}, '.format(self.skip)
+        format_string += 'threads={}'.format(self.threads)
+        format_string += ')'
+        return format_string
+
+    def _random_warp(self, maxsz, **kwargs):
+        """Draw random warp parameters and displacements, and compute the
+        source index map."""
+        self._random_params(maxsz, **kwargs)
+
+        # Coarse displacement grid (y,x).
+        self.displacement = self.sigma * np.random.randn(2, *self.grid)
+        self.margin = int(np.ceil(np.abs(self.displacement).max()))
+
+        self.warp_map = warping.warp3dMap(self.size, maxsz,
+                            self.rot, self.shear,
+                            self.scale, self.stretch, self.twist,
+                            threads=self.threads,
+                            displacement=self.displacement
+                        )
@@ -3,8 +3,10 @@ Adapted from ELEKTRONN (http://elektronn.org/).
 """
 
 import numpy as np
+from libc.stdint cimport uint8_t, uint16_t, uint32_t, uint64_t, uintptr_t
+from libc.stdlib cimport malloc, free
 
-cdef extern from 'warping.c':
+cdef extern from 'warping.c' nogil:
     int fastwarp2d_opt(const float * src,
                float * dest_d,
                const int sh[3],
@@ -13,15 +15,279 @@ cdef extern from 'warping.c':
                const float shear,
                const float scale[2],
                const float stretch_in[2])
-    int fastwarp3d_opt_zxy(const float * src,
-                     float * dest_d,
-                     const int sh[4],
-                     const int ps[4],
-                     const float rot,
-                     const float shear,
-                     const float scale[3],
-                     const float stretch_in[4],
-                     const float twist_in)
+    int fastwarp3d_opt_zxy_f32(const float * src, float * dest_d,
+                              const int sh[4], const int src_sh[4],
+                              const int off[3], const int ps[4],
+                              const float rot, const float shear,
+                              const float scale[3], const float stretch_in[4],
+                              const float twist_in, const int nthreads)
+    int fastwarp3d_opt_zxy_u8(const uint8_t * src, uint8_t * dest_d,
+                              const int sh[4], const int src_sh[4],
+                              const int off[3], const int ps[4],
+                              const float rot, const float shear,
+                              const float scale[3], const float stretch_in[4],
+                              const float twist_in, const int nthreads)
+    int fastwarp3d_opt_zxy_u16(const uint16_t * src, uint16_t * dest_d,
+                              const int sh[4], const int src_sh[4],
+                              const int off[3], const int ps[4],
+                              const float rot, const float shear,
+                              const float scale[3], const float stretch_in[4],
+                              const float twist_in, const int nthreads)
+    int fastwarp3d_opt_zxy_u32(const uint32_t * src, uint32_t * dest_d,
+                              const int sh[4], const int src_sh[4],
+                              const int off[3], const int ps[4],
+                              const float rot, const float shear,
+                              const float scale[3], const float stretch_in[4],
+                              const float twist_in, const int nthreads)
+    int fastwarp3d_opt_zxy_u64(const uint64_t * src, uint64_t * dest_d,
+                              const int sh[4], const int src_sh[4],
+                              const int off[3], const int ps[4],
+                              const float rot, const float shear,
+                              const float scale[3], const float stretch_in[4],
+                              const float twist_in, const int nthreads)
+
+    int warpmap3d(int * zmap, int * xmap, int * ymap,
+                  const int sh[3], const int ps[3],
+                  const float rot, const float shear,
+                  const float scale[3], const float stretch_in[4],
+                  const float twist_in, const float * disp, const int gs[3],
+                  const int nthreads)
+    int warpsections2d_f32(float * img, const int sh[4], const long strd[4],
+                            const int * zs, const int n, const float * params,
+                            const int nthreads)
+    int warpsections2d_u8(uint8_t * img, const int sh[4], const long strd[4],
+                           const int * zs, const int n, const float * params,
+                           const int nthreads)
+    int warpsections2d_u16(uint16_t * img, const int sh[4], const long strd[4],
+                            const int * zs, const int n, const float * params,
+                            const int nthreads)
+    int warpsections2d_u32(uint32_t * img, const int sh[4], const long strd[4],
+                            const int * zs, const int n, const float * params,
+                            const int nthreads)
+    int warpsections2d_u64(uint64_t * img, const int sh[4], const long strd[4],
+                            const int * zs, const int n, const float * params,
+                            const int nthreads)
+    int warpjoint3d(const int n, const void * const * src, void * const * dest,
+                    const int * itemsize, const int * src_sh,
+                    const long * strd_src, const int * off, const int * ps,
+                    const long * strd, const int * pos,
+                    const int sh[3], const int ms[3],
+                    const float rot, const float shear,
+                    const float scale[3], const float stretch_in[4],
+                    const float twist_in, const int nthreads)
+    int warpgather3d_f32(const float * src, float * dest_d,
+                         const int * zmap, const int * xmap, const int * ymap,
+                         const int map_sh[3], const int map_off[3],
+                         const int src_sh[4], const long strd_src[4],
+                         const int off[3], const int ps[4],
+                         const long strd[4], const int nthreads)
+    int warpgather3d_u8(const uint8_t * src, uint8_t * dest_d,
+                         const int * zmap, const int * xmap, const int * ymap,
+                         const int map_sh[3], const int map_off[3],
+                         const int src_sh[4], const long strd_src[4],
+                         const int off[3], const int ps[4],
+                         const long strd[4], const int nthreads)
+    int warpgather3d_u16(const uint16_t * src, uint16_t * dest_d,
+                         const int * zmap, const int * xmap, const int * ymap,
+                         const int map_sh[3], const int map_off[3],
+                         const int src_sh[4], const long strd_src[4],
+                         const int off[3], const int ps[4],
+                         const long strd[4], const int nthreads)
+    int warpgather3d_u32(const uint32_t * src, uint32_t * dest_d,
+                         const int * zmap, const int * xmap, const int * ymap,
+                         const int map_sh[3], const int map_off[3],
+                         const int src_sh[4], const long strd_src[4],
+                         const int off[3], const int ps[4],
+                         const long strd[4], const int nthreads)
+    int warpgather3d_u64(const uint64_t * src, uint64_t * dest_d,
+                         const int * zmap, const int * xmap, const int * ymap,
+                         const int map_sh[3], const int map_off[3],
+                         const int src_sh[4], const long strd_src[4],
+                         const int off[3], const int ps[4],
+                         const long strd[4], const int nthreads)
+
+ctypedef fused pixel_t:
+    float
+    uint8_t
+    uint16_t
+    uint32_t
+    uint64_t
+
+
+# Pixel types with a native 3D warping kernel.
+NATIVE_DTYPES = (np.dtype(np.float32), np.dtype(np.uint8), np.dtype(np.uint16),
+                 np.dtype(np.uint32), np.dtype(np.uint64))
+
+
+def _native_dtype(dtype):
+    """
+    Pixel type to warp ``dtype`` with. Nearest-neighbour warping only copies
+    pixels, so any other 1/2/4/8-byte numeric dtype is warped bit-exactly as
+    an unsigned integer of the same size (zero bits are zero in all of them).
+    Returns None if there is no such type.
+    """
+    dtype = np.dtype(dtype)
+    if dtype in NATIVE_DTYPES:
+        return dtype
+    if dtype.kind in 'biuf' and dtype.itemsize in (1, 2, 4, 8):
+        return np.dtype('uint{}'.format(8 * dtype.itemsize))
+    return None
+
+
+def _fastwarp3d(pixel_t[:, :, :, ::1] src, pixel_t[:, :, :, ::1] dest,
+                frame_sh, offset, float rot, float shear, float twist,
+                scale, stretch, int threads):
+    """
+    Dispatch to the 3D warping kernel matching the pixel type. The warp is
+    centered on a frame of shape frame_sh (z,x,y), of which src covers the
+    part from offset (z,x,y) on.
+    """
+    # Scale.
+    scale = np.array(scale, dtype=np.float32, order='C', ndmin=1)
+    scale = 1.0/scale
+    cdef float [:] scale_view = scale
+    cdef float * scale_ptr = &scale_view[0]
+
+    # Perspective stretch.
+    stretch = np.array(stretch, dtype=np.float32, order='C', ndmin=1)
+    cdef float [:] stretch_view = stretch
+    cdef float * stretch_ptr = &stretch_view[0]
+
+    # Frame/input/output shapes.
+    cdef int sh[4]
+    cdef int src_sh[4]
+    cdef int off[3]
+    cdef int ps[4]
+    cdef int i
+    for i in range(4):
+        src_sh[i] = src.shape[i]
+        ps[i] = dest.shape[i]
+    sh[0], sh[1], sh[2], sh[3] = frame_sh[0], src.shape[1], frame_sh[1], frame_sh[2]
+    off[0], off[1], off[2] = offset[0], offset[1], offset[2]
+
+    cdef int err
+    with nogil:
+        if pixel_t is float:
+            err = fastwarp3d_opt_zxy_f32(&src[0, 0, 0, 0], &dest[0, 0, 0, 0],
+                                         sh, src_sh, off, ps, rot, shear,
+                                         scale_ptr, stretch_ptr, twist, threads)
+        elif pixel_t is uint8_t:
+            err = fastwarp3d_opt_zxy_u8(&src[0, 0, 0, 0], &dest[0, 0, 0, 0],
+                                        sh, src_sh, off, ps, rot, shear,
+                                        scale_ptr, stretch_ptr, twist, threads)
+        elif pixel_t is uint16_t:
+            err = fastwarp3d_opt_zxy_u16(&src[0, 0, 0, 0], &dest[0, 0, 0, 0],
+                                         sh, src_sh, off, ps, rot, shear,
+                                         scale_ptr, stretch_ptr, twist, threads)
+        elif pixel_t is uint32_t:
+            err = fastwarp3d_opt_zxy_u32(&src[0, 0, 0, 0], &dest[0, 0, 0, 0],
+                                         sh, src_sh, off, ps, rot, shear,
+                                         scale_ptr, stretch_ptr, twist, threads)
+        else:
+            err = fastwarp3d_opt_zxy_u64(&src[0, 0, 0, 0], &dest[0, 0, 0, 0],
+                                         sh, src_sh, off, ps, rot, shear,
+                                         scale_ptr, stretch_ptr, twist, threads)
+    if err != 0:
+        raise MemoryError()
+
+
+def _warpgather3d(const pixel_t[:, :, :, :] src, pixel_t[:, :, :, :] dest,
+                  int[::1] zmap, int[:, :, ::1] xmap, int[:, :, ::1] ymap,
+                  map_offset, offset, int threads):
+    """
+    Dispatch to the 3D gather kernel matching the pixel type. src and dest
+    are (ch,z,x,y) arrays of any memory layout. dest covers the map from
+    map_offset (z,x,y) on, and src covers the frame the map refers to from
+    offset (z,x,y) on.
+    """
+    cdef int map_sh[3]
+    cdef int map_off[3]
+    cdef int src_sh[4]
+    cdef long strd_src[4]
+    cdef int off[3]
+    cdef int ps[4]
+    cdef long strd[4]
+    cdef int i
+    for i in range(3):
+        map_sh[i] = xmap.shape[i]
+        map_off[i] = map_offset[i]
+        off[i] = offset[i]
+
+    # Kernel axes are (z,ch,x,y).
+    cdef int[4] axes = [1, 0, 2, 3]
+    for i in range(4):
+        src_sh[i] = src.shape[axes[i]]
+        strd_src[i] = src.strides[axes[i]] // <long>sizeof(pixel_t)
+        ps[i] = dest.shape[axes[i]]
+        strd[i] = dest.strides[axes[i]] // <long>sizeof(pixel_t)
+
+    cdef int err
+    with nogil:
+        if pixel_t is float:
+            err = warpgather3d_f32(&src[0, 0, 0, 0], &dest[0, 0, 0, 0],
+                                   &zmap[0], &xmap[0, 0, 0], &ymap[0, 0, 0],
+                                   map_sh, map_off, src_sh, strd_src, off, ps,
+                                   strd, threads)
+        elif pixel_t is uint8_t:
+            err = warpgather3d_u8(&src[0, 0, 0, 0], &dest[0, 0, 0, 0],
+                                  &zmap[0], &xmap[0, 0, 0], &ymap[0, 0, 0],
+                                  map_sh, map_off, src_sh, strd_src, off, ps,
+                                  strd, threads)
+        elif pixel_t is uint16_t:
+            err = warpgather3d_u16(&src[0, 0, 0, 0], &dest[0, 0, 0, 0],
+                                   &zmap[0], &xmap[0, 0, 0], &ymap[0, 0, 0],
+                                   map_sh, map_off, src_sh, strd_src, off, ps,
+                                   strd, threads)
+        elif pixel_t is uint32_t:
+            err = warpgather3d_u32(&src[0, 0, 0, 0], &dest[0, 0, 0, 0],
+                                   &zmap[0], &xmap[0, 0, 0], &ymap[0, 0, 0],
+                                   map_sh, map_off, src_sh, strd_src, off, ps,
+                                   strd, threads)
+        else:
+            err = warpgather3d_u64(&src[0, 0, 0, 0], &dest[0, 0, 0, 0],
+                                   &zmap[0], &xmap[0, 0, 0], &ymap[0, 0, 0],
+                                   map_sh, map_off, src_sh, strd_src, off, ps,
+                                   strd, threads)
+    if err != 0:
+        raise MemoryError()
+
+
+def _warpsections2d(pixel_t[:, :, :, :] img, int[::1] zs, float[:, ::1] params,
+                    int threads):
+    """
+    Dispatch to the batched 2D section kernel matching the pixel type. img is
+    a (ch,z,x,y) array of any memory layout, warped in place.
+    """
+    cdef int sh[4]
+    cdef long strd[4]
+    cdef int i
+    cdef int n = zs.shape[0]
+
+    # Kernel axes are (z,ch,x,y).
+    cdef int[4] axes = [1, 0, 2, 3]
+    for i in range(4):
+        sh[i] = img.shape[axes[i]]
+        strd[i] = img.strides[axes[i]] // <long>sizeof(pixel_t)
+
+    cdef int err
+    with nogil:
+        if pixel_t is float:
+            err = warpsections2d_f32(&img[0, 0, 0, 0], sh, strd, &zs[0], n,
+                                     &params[0, 0], threads)
+        elif pixel_t is uint8_t:
+            err = warpsections2d_u8(&img[0, 0, 0, 0], sh, strd, &zs[0], n,
+                                    &params[0, 0], threads)
+        elif pixel_t is uint16_t:
+            err = warpsections2d_u16(&img[0, 0, 0, 0], sh, strd, &zs[0], n,
+                                     &params[0, 0], threads)
+        elif pixel_t is uint32_t:
+            err = warpsections2d_u32(&img[0, 0, 0, 0], sh, strd, &zs[0], n,
+                                     &params[0, 0], threads)
+        else:
+            err = warpsections2d_u64(&img[0, 0, 0, 0], sh, strd, &zs[0], n,
+                                     &params[0, 0], threads)
+    if err != 0:
+        raise MemoryError()
 
 
 def warp2dFast(img, patch_size, rot=0, shear=0, scale=(1,1), stretch=(0,0)):
@@ -84,7 +350,8 @@ def warp2dFast(img, patch_size, rot=0, shear=0, scale=(1,1), stretch=(0,0)):
     cdef int [:] ps_view = np.ascontiguousarray(out_arr.shape, dtype=np.int32)
     cdef int * ps_ptr  = &ps_view[0]
 
-    fastwarp2d_opt(in_ptr, out_ptr, in_sh_ptr, ps_ptr, rot, shear, scale_ptr, stretch_ptr)
+    if fastwarp2d_opt(in_ptr, out_ptr, in_sh_ptr, ps_ptr, rot, shear, scale_ptr, stretch_ptr) != 0:
+        raise MemoryError()
     return out_arr
 
 
@@ -121,12 +388,14 @@ def _warp2dFastLab(lab, patch_size, img_sh, rot, shear, scale, stretch):
     cdef int [:] ps_view = np.ascontiguousarray(out_arr.shape, dtype=np.int32)
     cdef int * ps_ptr  = &ps_view[0]
 
-    fastwarp2d_opt(in_ptr, out_ptr, in_sh_ptr, ps_ptr, rot, shear, scale_ptr, stretch_ptr)
+    if fastwarp2d_opt(in_ptr, out_ptr, in_sh_ptr, ps_ptr, rot, shear, scale_ptr, stretch_ptr) != 0:
+        raise MemoryError()
     out_arr = out_arr.astype(np.int16)[0]
     return out_arr
 
 
-def warp3dFast(img, patch_size, rot=0, shear=0, scale=(1,1,1), stretch=(0,0,0,0), twist=0):
+def warp3dFast(img, patch_size, rot=0, shear=0, scale=(1,1,1), stretch=(0,0,0,0), twist=0,
+               threads=1):
     """
     Create warped mapping for a spatial 3D input image.
     The transformation is done w.r.t to the *center* of the image.
@@ -159,12 +428,16 @@ def warp3dFast(img, patch_size, rot=0, shear=0, scale=(1,1,1), stretch=(0,0,0,0)
 
     twist: float
       Dependence of the rotation angle on z in deg from center to outer border
+    threads: int
+      Number of OpenMP threads. Non-positive values use all available cores.
+      The GIL is released while warping.
 
     Returns
     -------
 
     img: np.ndarray
-      Warped array (cropped to patch_size)
+      Warped array (cropped to patch_size), in the dtype of img. Numeric
+      dtypes without a 1/2/4/8-byte pixel size are warped as float32.
 
     """
     assert len(img.shape)==4
@@ -174,44 +447,249 @@ def warp3dFast(img, patch_size, rot=0, shear=0, scale=(1,1,1), stretch=(0,0,0,0)
     shear = shear * np.pi / 180
     twist = twist * np.pi / 180
 
+    # Image, warped in its own dtype if possible.
+    dtype = _native_dtype(img.dtype)
+    if dtype is None:
+        img = np.ascontiguousarray(img, dtype=np.float32)
+    else:
+        img = np.ascontiguousarray(img)
+    in_arr = img if dtype is None else img.view(dtype)
+
+    # Output.
+    out_shape = (patch_size[0], img.shape[1], patch_size[1], patch_size[2])
+    out_arr = np.zeros(out_shape, dtype=img.dtype)
+
+    frame_sh = (img.shape[0], img.shape[2], img.shape[3])
+    _fastwarp3d(in_arr, out_arr.view(in_arr.dtype), frame_sh, (0, 0, 0),
+                rot, shear, twist, scale, stretch, threads)
+    return out_arr
+
+
+def _warp3dFastLab(lab, patch_size, img_sh, rot, shear, scale, stretch, twist,
+                   threads=1):
+    """
+    Warp label data (z,ch,x,y) centered inside a larger image of spatial
+    shape img_sh (z,x,y) with the same transformation as the image. Labels
+    are read in place through their offset within the image and keep their
+    dtype, so integer segment IDs are preserved exactly.
+    """
+    n_chann = lab.shape[1]
+    lab_sh  = (lab.shape[0], lab.shape[2], lab.shape[3])
+
+    # Rotation, shear, twist.
+    rot   = rot   * np.pi / 180
+    shear = shear * np.pi / 180
+    twist = twist * np.pi / 180
+
+    # Label.
+    dtype = _native_dtype(lab.dtype)
+    if dtype is None:
+        lab = np.ascontiguousarray(lab, dtype=np.float32)
+    else:
+        lab = np.ascontiguousarray(lab)
+    in_arr = lab if dtype is None else lab.view(dtype)
+    off = list(map(lambda x: (x[0]-x[1])//2, zip(img_sh, lab_sh)))
+
+    out_shape = patch_size
+    out_shape = (out_shape[0], n_chann, out_shape[1], out_shape[2])
+    out_arr = np.zeros(out_shape, dtype=lab.dtype)
+
+    _fastwarp3d(in_arr, out_arr.view(in_arr.dtype), img_sh, off,
+                rot, shear, twist, scale, stretch, threads)
+    return out_arr
+
+
+def warp3dMap(frame_sh, patch_size, rot=0, shear=0, scale=(1,1,1), stretch=(0,0,0,0), twist=0,
+              threads=1, displacement=None):
+    """
+    Compute the source pixel index map of a 3D warp once, so that it can be
+    applied to any number of inputs by warp3dGather. Parameters are the same
+    as for warp3dFast.
+
+    Parameters
+    ----------
+
+    frame_sh: 3-tuple
+      Spatial shape (z,x,y) of the frame the transformation is centered on,
+      i.e. the size of the warping input.
+    patch_size: 3-tuple
+      Largest output patch size (pz, px, py) the map is applied for.
+    displacement: array, optional
+      Elastic deformation composed with the transformation, as a coarse grid
+      (2, gz, gx, gy) of in-plane displacements (along x and y, in source
+      pixels). The grid spans the output patch and is upsampled linearly
+      inside the kernel. The frame must be large enough to contain the
+      displaced coordinates.
+
+    Returns
+    -------
+
+    warp_map: 3-tuple of np.ndarray
+      Nearest source slice of every output slice (pz,), and nearest source
+      row and column of every output pixel (pz, px, py), in frame coordinates.
+    """
+    # Rotation, shear, twist.
+    rot   = rot   * np.pi / 180
+    shear = shear * np.pi / 180
+    twist = twist * np.pi / 180
+
     # Scale.
     scale = np.array(scale, dtype=np.float32, order='C', ndmin=1)
     scale = 1.0/scale
     cdef float [:] scale_view = scale
-    cdef float * scale_ptr = &scale_view[0]
 
     # Perspective stretch.
     stretch = np.array(stretch, dtype=np.float32, order='C', ndmin=1)
     cdef float [:] stretch_view = stretch
-    cdef float * stretch_ptr = &stretch_view[0]
 
-    # Image.
-    img = np.ascontiguousarray(img, dtype=np.float32)
-    cdef float [:, :, :, :] img_view = img
-    cdef float * in_ptr = &img_view[0, 0, 0, 0]
+    patch_size = tuple(int(x) for x in patch_size)
+    zmap = np.empty(patch_size[:1], dtype=np.int32)
+    xmap = np.empty(patch_size, dtype=np.int32)
+    ymap = np.empty(patch_size, dtype=np.int32)
+    cdef int [::1] zmap_view = zmap
+    cdef int [:, :, ::1] xmap_view = xmap
+    cdef int [:, :, ::1] ymap_view = ymap
+
+    cdef int sh[3]
+    cdef int ps[3]
+    cdef int gs[3]
+    cdef int i
+    for i in range(3):
+        sh[i] = frame_sh[i]
+        ps[i] = patch_size[i]
+
+    # Coarse displacement grid.
+    cdef float [:, :, :, ::1] disp_view
+    cdef const float * disp = NULL
+    if displacement is not None:
+        displacement = np.ascontiguousarray(displacement, dtype=np.float32)
+        assert displacement.ndim == 4 and displacement.shape[0] == 2
+        assert all(g > 0 for g in displacement.shape[1:])
+        disp_view = displacement
+        disp = &disp_view[0, 0, 0, 0]
+        for i in range(3):
+            gs[i] = displacement.shape[i + 1]
+
+    cdef float c_rot = rot
+    cdef float c_shear = shear
+    cdef float c_twist = twist
+    cdef int n_threads = threads
+    cdef int err
+    with nogil:
+        err = warpmap3d(&zmap_view[0], &xmap_view[0, 0, 0], &ymap_view[0, 0, 0],
+                        sh, ps, c_rot, c_shear, &scale_view[0], &stretch_view[0],
+                        c_twist, disp, gs, n_threads)
+    if err != 0:
+        raise MemoryError()
+    return zmap, xmap, ymap
+
+
+def warp3dGather(img, warp_map, patch_size, frame_sh, threads=1, out=None,
+                 offset=None):
+    """
+    Apply a source pixel index map computed by warp3dMap.
 
-    # Image shape.
-    cdef int [:] in_sh_view = np.ascontiguousarray(img.shape, dtype=np.int32)
-    cdef int * in_sh_ptr = &in_sh_view[0]
+    Parameters
+    ----------
+
+    img: array
+      The array must be 4-dimensional (ch,z,x,y), i.e. in the (c,z,y,x)
+      layout of augmentor samples. Any memory layout (e.g. a transposed or
+      flipped view) is read directly without copying. It is centered in the
+      frame the map was computed for, and may be smaller than it (e.g.
+      labels).
+    warp_map: 3-tuple of np.ndarray
+      Map returned by warp3dMap.
+    patch_size: 3-tuple
+      Patch size *excluding* channel: (pz, px, py), no larger than the patch
+      size of the map. The output is centered in the map.
+    frame_sh: 3-tuple
+      Spatial shape (z,x,y) of the frame the map was computed for.
+    threads: int
+      Number of OpenMP threads. Non-positive values use all available cores.
+      The GIL is released while warping.
+    out: array, optional
+      (ch,pz,px,py) array of the dtype of img to write the result into.
+      Any memory layout is allowed.
+    offset: 3-tuple, optional
+      Position (z,x,y) of img within the frame, if not centered. It may be
+      negative, e.g. for a large volume (or np.memmap) containing the frame,
+      of which only the pixels the map refers to are read.
+
+    Returns
+    -------
+
+    img: np.ndarray
+      Warped array (cropped to patch_size), in the dtype of img.
+    """
+    assert len(img.shape)==4
+    zmap, xmap, ymap = warp_map
+    map_sh = xmap.shape
+    assert all(p <= m for p, m in zip(patch_size, map_sh))
+
+    # Input, warped in its own dtype if possible.
+    dtype = _native_dtype(img.dtype)
+    if dtype is None:
+        img = np.asarray(img, dtype=np.float32)
+    in_arr = img if dtype is None else img.view(dtype)
+    img_sh = img.shape[1:]
+
+    # Offsets of the output within the map, and of the input within the frame.
+    map_off = [(f - p)//2 - (f - m)//2 for f, p, m in zip(frame_sh, patch_size, map_sh)]
+    if offset is None:
+        off = [(f - s)//2 for f, s in zip(frame_sh, img_sh)]
+    else:
+        off = [int(x) for x in offset]
 
     # Output.
-    out_shape = (patch_size[0], img.shape[1], patch_size[1], patch_size[2])
-    out_arr = np.zeros(out_shape, dtype=np.float32)
-    cdef float [:, :, :, :] out_view = out_arr
-    cdef float * out_ptr = &out_view[0, 0, 0, 0]
+    out_shape = (img.shape[0],) + tuple(patch_size)
+    if out is None:
+        out = np.empty(out_shape, dtype=img.dtype)
+    assert out.shape == out_shape and out.dtype == img.dtype
 
-    # Output shape.
-    cdef int [:] ps_view = np.ascontiguousarray(out_arr.shape, dtype=np.int32)
-    cdef int * ps_ptr = &ps_view[0]
+    _warpgather3d(in_arr, out.view(in_arr.dtype), zmap, xmap, ymap,
+                  map_off, off, threads)
+    return out
 
-    fastwarp3d_opt_zxy(in_ptr, out_ptr, in_sh_ptr, ps_ptr, rot, shear,
-                        scale_ptr, stretch_ptr, twist)
-    return out_arr
 
+def warp3dJointFast(imgs, patch_sizes, frame_sh, rot=0, shear=0, scale=(1,1,1),
+                    stretch=(0,0,0,0), twist=0, threads=1, offsets=None,
+                    outs=None):
+    """
+    Warp several inputs (e.g. image, label and mask) with the same
+    transformation in a single pass: the source coordinates of every output
+    pixel are computed once and all outputs are written from them, without
+    materializing an index map. Parameters are the same as for warp3dFast.
 
-def _warp3dFastLab(lab, patch_size, img_sh, rot, shear, scale, stretch, twist):
-    n_chann = lab.shape[1]
-    lab_sh  = (lab.shape[0], lab.shape[2], lab.shape[3])
+    Parameters
+    ----------
+
+    imgs: list of array
+      4-dimensional (ch,z,x,y) arrays, i.e. in the (c,z,y,x) layout of
+      augmentor samples, each warped in its own dtype. Any memory layout is
+      read directly without copying.
+    patch_sizes: list of 3-tuple
+      Output patch size (pz, px, py) of every input. Outputs are centered in
+      the frame.
+    frame_sh: 3-tuple
+      Spatial shape (z,x,y) of the frame the transformation is centered on.
+    offsets: list of 3-tuple, optional
+      Position (z,x,y) of every input within the frame. Inputs are centered
+      in the frame by default.
+    outs: list of array, optional
+      (ch,pz,px,py) arrays of the dtype of the inputs to write the results
+      into (None to allocate one). Any memory layout is allowed.
+
+    Returns
+    -------
+
+    imgs: list of np.ndarray
+      Warped arrays (ch,pz,px,py), in the dtype of the inputs.
+    """
+    cdef int n = len(imgs)
+    assert len(patch_sizes) == n
+    if n == 0:
+        return []
 
     # Rotation, shear, twist.
     rot   = rot   * np.pi / 180
@@ -222,37 +700,140 @@ def _warp3dFastLab(lab, patch_size, img_sh, rot, shear, scale, stretch, twist):
     scale = np.array(scale, dtype=np.float32, order='C', ndmin=1)
     scale = 1.0/scale
     cdef float [:] scale_view = scale
-    cdef float * scale_ptr = &scale_view[0]
 
     # Perspective stretch.
     stretch = np.array(stretch, dtype=np.float32, order='C', ndmin=1)
     cdef float [:] stretch_view = stretch
-    cdef float * stretch_ptr = &stretch_view[0]
 
-    # Label.
-    new_lab_sh = (img_sh[0], n_chann, img_sh[1],img_sh[2])
-    new_lab = np.zeros(new_lab_sh, dtype=np.float32)
-    off = list(map(lambda x: (x[0]-x[1])//2, zip(img_sh, lab_sh)))
-    new_lab[off[0]:lab_sh[0]+off[0], :, off[1]:lab_sh[1]+off[1], off[2]:lab_sh[2]+off[2]] = lab
-    lab = new_lab
-    cdef float [:, :, :, :] lab_view = lab
-    cdef float * in_ptr = &lab_view[0, 0, 0, 0]
+    # The output grid is the largest patch, each output is centered in it.
+    patch_sizes = [tuple(int(x) for x in p) for p in patch_sizes]
+    max_sz = tuple(max(p[i] for p in patch_sizes) for i in range(3))
+
+    # Inputs, in their own dtype if possible, and outputs.
+    ins, res, views = [], [], []
+    for m, (img, p) in enumerate(zip(imgs, patch_sizes)):
+        assert len(img.shape)==4
+        dtype = _native_dtype(img.dtype)
+        if dtype is None:
+            img = np.asarray(img, dtype=np.float32)
+            dtype = img.dtype
+        out_shape = (img.shape[0],) + p
+        out = None if outs is None else outs[m]
+        if out is None:
+            out = np.empty(out_shape, dtype=img.dtype)
+        assert out.shape == out_shape and out.dtype == img.dtype
+        ins.append(img.view(dtype))
+        views.append(out.view(dtype))
+        res.append(out)
+
+    itemsize = np.empty(n, dtype=np.intc)
+    src_sh = np.empty((n, 4), dtype=np.intc)
+    strd_src = np.empty((n, 4), dtype=np.dtype('l'))
+    off = np.empty((n, 3), dtype=np.intc)
+    ps = np.empty((n, 4), dtype=np.intc)
+    strd = np.empty((n, 4), dtype=np.dtype('l'))
+    pos = np.empty((n, 3), dtype=np.intc)
+    axes = [1, 0, 2, 3]  # (ch,z,x,y) -> (z,ch,x,y)
+    for m in range(n):
+        src, dest, p = ins[m], views[m], patch_sizes[m]
+        itemsize[m] = src.itemsize
+        src_sh[m] = [src.shape[a] for a in axes]
+        strd_src[m] = [src.strides[a] // src.itemsize for a in axes]
+        ps[m] = [dest.shape[a] for a in axes]
+        strd[m] = [dest.strides[a] // dest.itemsize for a in axes]
+        pos[m] = [(f - q)//2 - (f - s)//2 for f, q, s in zip(frame_sh, p, max_sz)]
+        if offsets is None:
+            off[m] = [(f - s)//2 for f, s in zip(frame_sh, src.shape[1:])]
+        else:
+            off[m] = [int(x) for x in offsets[m]]
+
+    cdef int [::1] itemsize_view = itemsize
+    cdef int [:, ::1] src_sh_view = src_sh
+    cdef long [:, ::1] strd_src_view = strd_src
+    cdef int [:, ::1] off_view = off
+    cdef int [:, ::1] ps_view = ps
+    cdef long [:, ::1] strd_view = strd
+    cdef int [:, ::1] pos_view = pos
+
+    cdef int sh[3]
+    cdef int ms[3]
+    cdef int i
+    for i in range(3):
+        sh[i] = frame_sh[i]
+        ms[i] = max_sz[i]
+
+    cdef const void ** src_ptr = <const void **>malloc(n * sizeof(void *))
+    cdef void ** dest_ptr = <void **>malloc(n * sizeof(void *))
+    if src_ptr == NULL or dest_ptr == NULL:
+        free(src_ptr)
+        free(dest_ptr)
+        raise MemoryError()
+    for i in range(n):
+        src_ptr[i] = <const void *><uintptr_t>ins[i].__array_interface__['data'][0]
+        dest_ptr[i] = <void *><uintptr_t>views[i].__array_interface__['data'][0]
+
+    cdef float c_rot = rot
+    cdef float c_shear = shear
+    cdef float c_twist = twist
+    cdef int n_threads = threads
+    cdef int err
+    with nogil:
+        err = warpjoint3d(n, src_ptr, dest_ptr, &itemsize_view[0],
+                          &src_sh_view[0, 0], &strd_src_view[0, 0],
+                          &off_view[0, 0], &ps_view[0, 0], &strd_view[0, 0],
+                          &pos_view[0, 0], sh, ms, c_rot, c_shear,
+                          &scale_view[0], &stretch_view[0], c_twist, n_threads)
+    free(src_ptr)
+    free(dest_ptr)
+    if err != 0:
+        raise MemoryError()
+    return res
+
+
+def warp2dSections(img, zlocs, rot, shear, scale, stretch, threads=1):
+    """
+    Warp sections of a 3D input in place, each with its own 2D transformation
+    w.r.t. the center of the section, in a single batched kernel call. Other
+    sections are neither read nor written. Source pixels outside of a section
+    are clamped to its border.
 
-    # Label shape.
-    cdef int [:] in_sh_view = np.ascontiguousarray(lab.shape, dtype=np.int32)
-    cdef int * in_sh_ptr = &in_sh_view[0]
+    Parameters
+    ----------
 
-    out_shape = patch_size
-    out_shape = (out_shape[0], n_chann, out_shape[1], out_shape[2])
-    out_arr = np.zeros(out_shape, dtype=np.float32)
-    cdef float [:, :, :, :] out_view = out_arr
-    cdef float * out_ptr = &out_view[0, 0, 0, 0]
+    img: array
+      The array must be 4-dimensional (ch,z,x,y), i.e. in the (c,z,y,x)
+      layout of augmentor samples, and writable. Any memory layout is warped
+      directly without copying.
+    zlocs: sequence of int
+      Sections to warp.
+    rot, shear: sequence of float
+      Rotation and shear angle in deg per section (see warp2dFast).
+    scale, stretch: sequence of 2-tuple of float
+      Scale and perspective stretch per section (see warp2dFast).
+    threads: int
+      Number of OpenMP threads. Non-positive values use all available cores.
+      The GIL is released while warping.
 
-    # Output shape.
-    cdef int [:] ps_view = np.ascontiguousarray(out_arr.shape, dtype=np.int32)
-    cdef int * ps_ptr = &ps_view[0]
+    Returns
+    -------
 
-    fastwarp3d_opt_zxy(in_ptr, out_ptr, in_sh_ptr, ps_ptr, rot, shear,
-                        scale_ptr, stretch_ptr, twist)
-    # out_arr = out_arr.astype(np.int16)[:,0]
-    return out_arr
+    img: array
+      The warped input.
+    """
+    assert len(img.shape)==4
+    zs = np.ascontiguousarray(zlocs, dtype=np.int32).reshape(-1)
+    n = zs.shape[0]
+    if n == 0:
+        return img
+    assert zs.min() >= 0 and zs.max() < img.shape[1]
+
+    params = np.empty((n, 6), dtype=np.float32)
+    params[:,0] = np.broadcast_to(rot, (n,)) * (np.pi / 180)
+    params[:,1] = np.broadcast_to(shear, (n,)) * (np.pi / 180)
+    params[:,2:4] = 1.0/np.broadcast_to(scale, (n, 2))
+    params[:,4:6] = np.broadcast_to(stretch, (n, 2))
+
+    dtype = _native_dtype(img.dtype)
+    assert dtype is not None, 'unsupported dtype {}'.format(img.dtype)
+    _warpsections2d(img.view(dtype), zs, params, threads)
+    return img
@@ -5,145 +5,474 @@ Max-Planck-Institute for Medical Research, Heidelberg, Germany
 Authors: Marius Killinger, Gregor Urban
 */
 
+#include <limits.h>
 #include <math.h>
+#include <stdint.h>
+#include <stdlib.h>
 
+#ifdef _OPENMP
+#include <omp.h>
+#else
+#define omp_get_max_threads() 1
+#endif
 
-void NN2d(const float *src, float u, float v, int ch, const int sh[3],
-                  const int strd_src[2], float *ret) {
-    int x = trunc(u + 0.5);
-    int y = trunc(v + 0.5);
-    if (x >= sh[1] || y >= sh[2] || x < 0 || y < 0) {
-        *ret = 0;
-    } else {
-        *ret = src[ch * strd_src[0] + x * strd_src[1] + y];
-    }
+// Number of OpenMP threads to use; non-positive means all available.
+#define N_THREADS(n) ((n) > 0 ? (n) : omp_get_max_threads())
+
+// Source pixel offset of pixels outside of the source. Offsets of pixels
+// inside may be negative for views with negative strides.
+#define OUTSIDE LONG_MIN
+
+// Nearest source pixel index of a coordinate.
+static inline int nearest(float u) {
+    return (int)trunc(u + 0.5);
 }
 
-int fastwarp2d_opt(const float *src, float *dest_d, const int sh[3],
-                   const int ps[3], const float rot, const float shear,
-                   const float scale[2], const float stretch_in[2]) {
-    // Loop/coord indices
-    int i, j, ch; // pixel index in dest
-    float xt, yt; // Intermediate coordinates
-    float u, v;   // pixel coordinate in src (mapping origin)
 
-    float x_center_off = (float)sh[1] / 2 - 0.5; // used to center coordinates
-    float y_center_off = (float)sh[2] / 2 - 0.5;
-    float x, y; // center pixel index in dest (because it is centered it may  x.5!)
+// 2D transformation shared by the warping kernels.
+
+typedef struct {
+    float x_center_off, y_center_off; // used to center coordinates
+    float x0, y0; // centered coordinates of the first output pixel
+    float scale[2];
+    float stretch[2];
+    float sin_plus, cos_plus, sin_minu, cos_minu;
+} Warp2d;
+
+// The transformation is done w.r.t. the center of a frame of shape sh (x,y)
+// and maps an output patch of shape ps (x,y) centered in that frame.
+static void warp2d_init(Warp2d *t, const int sh[2], const int ps[2],
+                        const float rot, const float shear,
+                        const float scale[2], const float stretch_in[2]) {
+    t->x_center_off = (float)sh[0] / 2 - 0.5;
+    t->y_center_off = (float)sh[1] / 2 - 0.5;
+    // center pixel index in dest (because it is centered it may  x.5!)
     // the source coordinates u,v calculated from x,y must be 'de-centered'
+    t->x0 = -t->x_center_off + (sh[0] - ps[0]) / 2;
+    t->y0 = -t->y_center_off + (sh[1] - ps[1]) / 2;
 
-    int strd[2] = {ps[1] * ps[2], ps[2]};
-    int strd_src[2] = {sh[1] * sh[2], sh[2]};
     // Parameter constant handling
-    float stretch[2];
-    stretch[0] = stretch_in[0] / x_center_off;
-    stretch[1] = stretch_in[1] / y_center_off;
+    t->scale[0] = scale[0];
+    t->scale[1] = scale[1];
+    t->stretch[0] = stretch_in[0] / t->x_center_off;
+    t->stretch[1] = stretch_in[1] / t->y_center_off;
 
     // Loop Optimisation
-    float ret;
-    float sin_plus = sin(rot + shear);
-    float cos_plus = cos(rot + shear);
-    float sin_minu = sin(rot - shear);
-    float cos_minu = cos(rot - shear);
-    // printf("dx=%.4f dy=%.4f\n", x_center_off, y_center_off);
-    // printf("(%i, %i %i)", sh[0], sh[1], sh[2]);
-    for (ch = 0; ch < sh[0]; ch++) {
-        x = -x_center_off + (sh[1] - ps[1]) / 2;
-        for (i = 0; i < ps[1]; i++) {
-            y = -y_center_off + (sh[2] - ps[2]) / 2;
-            for (j = 0; j < ps[2]; j++) {
-                xt = x * (scale[0] + stretch[0] * y); // /sqrt(1+abs(x)));
-                yt = y * (scale[1] + stretch[1] * x); // /sqrt(1+abs(y)));
-                u = xt * cos_minu - yt * sin_plus + x_center_off;
-                v = yt * cos_plus + xt * sin_minu + y_center_off;
+    t->sin_plus = sin(rot + shear);
+    t->cos_plus = cos(rot + shear);
+    t->sin_minu = sin(rot - shear);
+    t->cos_minu = cos(rot - shear);
+}
+
+// Source coordinates along an output row. The terms that are constant along
+// the row are computed once per row, and pixel j of the row is then mapped by
+// row_coords with the same float operations as the original per-pixel
+// formula, so that it rounds to the same nearest source pixel.
+typedef struct {
+    float x, y0; // centered coordinates of the row and of its first pixel
+    float scale_x, stretch_x, stretch_xz; // x scaling as a function of y
+    float scale_y; // y scaling of the row
+    float sin_plus, cos_plus, sin_minu, cos_minu;
+    float x_center_off, y_center_off;
+} WarpRow;
+
+static inline void row_coords(const WarpRow *r, int j, float *u, float *v) {
+    float y = r->y0 + j;
+    float xt = r->x * (r->scale_x + r->stretch_x * y + r->stretch_xz);
+    float yt = y * r->scale_y;
+    *u = xt * r->cos_minu - yt * r->sin_plus + r->x_center_off;
+    *v = yt * r->cos_plus + xt * r->sin_minu + r->y_center_off;
+}
+
+// Source coordinates of output row i of a 2D warp.
+static inline void warp2d_row(const Warp2d *t, int i, WarpRow *r) {
+    r->x = t->x0 + i;
+    r->y0 = t->y0;
+    r->scale_x = t->scale[0];
+    r->stretch_x = t->stretch[0];
+    r->stretch_xz = 0;
+    r->scale_y = t->scale[1] + t->stretch[1] * r->x;
+    r->sin_plus = t->sin_plus;
+    r->cos_plus = t->cos_plus;
+    r->sin_minu = t->sin_minu;
+    r->cos_minu = t->cos_minu;
+    r->x_center_off = t->x_center_off;
+    r->y_center_off = t->y_center_off;
+}
+
+int fastwarp2d_opt(const float *src, float *dest_d, const int sh[3],
+                   const int ps[3], const float rot, const float shear,
+                   const float scale[2], const float stretch_in[2]) {
+    // Loop/coord indices
+    int i, j, ch; // pixel index in dest
+    WarpRow row; // source coordinates along an output row
 
-                NN2d(src, u, v, ch, sh, strd_src, &ret);
-                dest_d[ch * strd[0] + i * strd[1] + j] = ret;
+    long strd[2] = {(long)ps[1] * ps[2], ps[2]};
+    long strd_src[2] = {(long)sh[1] * sh[2], sh[2]};
+    Warp2d t;
+    warp2d_init(&t, sh + 1, ps + 1, rot, shear, scale, stretch_in);
 
-                // printf("WRITE dest_d[%9i]\n", ch*ps[0]*ps[1]*ps[2] + i*ps[1]*ps[2] + j*ps[2] + k);
-                // printf("u=%2.1f v=%2.1f x=%2.1f y=%2.1f i=%02i j=%02i val=%.1f\n", u, v, x, y, i, j, ret);
-                y++;
+    // Source pixel offset of every pixel in a row (OUTSIDE if outside of src).
+    long *idx = (long *)malloc((ps[2] > 0 ? ps[2] : 1) * sizeof(long));
+    if (idx == NULL) {
+        return -1;
+    }
+    for (i = 0; i < ps[1]; i++) {
+        warp2d_row(&t, i, &row);
+        for (j = 0; j < ps[2]; j++) {
+            float u, v;
+            row_coords(&row, j, &u, &v);
+            int x = nearest(u);
+            int y = nearest(v);
+            int inside = (x >= 0) & (x < sh[1]) & (y >= 0) & (y < sh[2]);
+            idx[j] = inside ? x * strd_src[1] + y : OUTSIDE;
+        }
+        // Coordinates are computed once per pixel and shared by all channels.
+        for (ch = 0; ch < ps[0]; ch++) {
+            const float *src_ch = src + ch * strd_src[0];
+            float *dest_row = dest_d + ch * strd[0] + i * strd[1];
+            for (j = 0; j < ps[2]; j++) {
+                dest_row[j] = idx[j] == OUTSIDE ? 0 : src_ch[idx[j]];
             }
-            x++;
         }
     }
+    free(idx);
     return 0;
 }
 
 /************************************************************************************************************/
-void NN3d_zxy(const float *src, float u, float v, float w, int ch,
-                      const int sh[4], const int strd_src[3], float *ret) {
-    int x = trunc(u + 0.5);
-    int y = trunc(v + 0.5);
-    int z = trunc(w + 0.5);
-    if (x >= sh[2] || y >= sh[3] || x < 0 || y < 0 || z >= sh[0] || z < 0) {
-        *ret = 0;
-    } else {
-        *ret = src[z * strd_src[0] + ch * strd_src[1] + x * strd_src[2] + y];
-    }
-}
+// 3D transformation shared by the warping kernels.
+
+typedef struct {
+    float x_center_off, y_center_off, z_center_off; // used to center coordinates
+    float x0, y0, z0; // centered coordinates of the first output pixel
+    float scale[3];
+    float stretch[4];
+    float *trig; // sin_plus, cos_plus, sin_minu, cos_minu per output slice
+} Warp3d;
 
-int fastwarp3d_opt_zxy(const float *src, float *dest_d,
-                       const int sh[4], // z,ch,x,y
-                       const int ps[4], // z,ch,x,y
+// The transformation is done w.r.t. the center of a frame of shape sh (z,x,y)
+// and maps an output patch of shape ps (z,x,y) centered in that frame.
+static int warp3d_init(Warp3d *t, const int sh[3], const int ps[3],
                        const float rot, const float shear, const float scale[3],
                        const float stretch_in[4], const float twist_in) {
-    // Loop/coord indices
-    int i, j, k, ch; // pixel index in dest
-    float xt, yt;    // Intermediate coordinates
-    float u, v, w;   // pixel coordinate in src (mapping origin)
-
-    float x_center_off = (float)sh[2] / 2 - 0.5; // used to center coordinates
-    float y_center_off = (float)sh[3] / 2 - 0.5;
-    float z_center_off = (float)sh[0] / 2 - 0.5;
-    float x, y, z; // center pixel index in dest (because it is centered it may  x.5!)
+    int k;
+    t->x_center_off = (float)sh[1] / 2 - 0.5;
+    t->y_center_off = (float)sh[2] / 2 - 0.5;
+    t->z_center_off = (float)sh[0] / 2 - 0.5;
+    // center pixel index in dest (because it is centered it may  x.5!)
     // the source coordinates u,v calculated from x,y must be 'de-centered'
+    t->x0 = -t->x_center_off + (sh[1] - ps[1]) / 2;
+    t->y0 = -t->y_center_off + (sh[2] - ps[2]) / 2;
+    t->z0 = -t->z_center_off + (sh[0] - ps[0]) / 2;
 
-    int strd[3] = {ps[1] * ps[2] * ps[3], ps[2] * ps[3], ps[3]};
-    int strd_src[3] = {sh[1] * sh[2] * sh[3], sh[2] * sh[3], sh[3]};
     // Parameter constant handling
-    float stretch[4];
-    stretch[0] = stretch_in[0] / x_center_off;
-    stretch[1] = stretch_in[1] / y_center_off;
-    stretch[2] = stretch_in[2] / z_center_off;
-    stretch[3] = stretch_in[3] / z_center_off;
-    float twist = twist_in / z_center_off;
+    t->scale[0] = scale[0];
+    t->scale[1] = scale[1];
+    t->scale[2] = scale[2];
+    t->stretch[0] = stretch_in[0] / t->x_center_off;
+    t->stretch[1] = stretch_in[1] / t->y_center_off;
+    t->stretch[2] = stretch_in[2] / t->z_center_off;
+    t->stretch[3] = stretch_in[3] / t->z_center_off;
+    float twist = twist_in / t->z_center_off;
 
-    // Loop Optimisation
-    float ret;
-    float sin_plus;
-    float cos_plus;
-    float sin_minu;
-    float cos_minu;
+    // Loop Optimisation: per-slice rotation terms are shared by all rows.
+    t->trig = (float *)malloc(4 * (ps[0] > 0 ? ps[0] : 1) * sizeof(float));
+    if (t->trig == NULL) {
+        return -1;
+    }
+    for (k = 0; k < ps[0]; k++) {
+        float z = t->z0 + k;
+        t->trig[4 * k + 0] = sin(rot + shear + z * twist);
+        t->trig[4 * k + 1] = cos(rot + shear + z * twist);
+        t->trig[4 * k + 2] = sin(rot - shear + z * twist);
+        t->trig[4 * k + 3] = cos(rot - shear + z * twist);
+    }
+    return 0;
+}
+
+static void warp3d_free(Warp3d *t) {
+    free(t->trig);
+    t->trig = NULL;
+}
+
+// Source coordinates of output row (k,i) of a 3D warp, and its source slice w.
+static inline void warp3d_row(const Warp3d *t, int k, int i, WarpRow *r,
+                              float *w) {
+    float z = t->z0 + k;
+    const float *trig = t->trig + 4 * k;
+    r->x = t->x0 + i;
+    r->y0 = t->y0;
+    r->scale_x = t->scale[0];
+    r->stretch_x = t->stretch[0];
+    r->stretch_xz = t->stretch[2] * z;
+    r->scale_y = t->scale[1] + t->stretch[1] * r->x + t->stretch[3] * z;
+    r->sin_plus = trig[0];
+    r->cos_plus = trig[1];
+    r->sin_minu = trig[2];
+    r->cos_minu = trig[3];
+    r->x_center_off = t->x_center_off;
+    r->y_center_off = t->y_center_off;
+    *w = z * t->scale[2] + t->z_center_off;
+}
+
+// Linear interpolation position of output pixel i of n on a grid of m nodes
+// spanning the output: node c and weight f of node c + 1.
+static inline void grid_pos(int i, int n, int m, int *c, float *f) {
+    float g = (n > 1 && m > 1) ? (float)i * (m - 1) / (n - 1) : 0;
+    *c = (int)g;
+    if (*c > m - 2) {
+        *c = m > 1 ? m - 2 : 0;
+    }
+    *f = m > 1 ? g - *c : 0;
+}
+
+// In-plane displacement (du, dv) of every pixel of output row (k,i), upsampled
+// from a coarse grid disp (2, gs[0], gs[1], gs[2]) spanning the output patch
+// ps (z,x,y). The grid is interpolated bilinearly in (z,x) once per row into
+// the buffer row (2 * gs[2]), then linearly along the row.
+static void displacement_row(const float *disp, const int gs[3], const int ps[3],
+                             int k, int i, float *row, float *du, float *dv) {
+    int c, d, j, cz, cx;
+    float fz, fx;
+    long n = (long)gs[0] * gs[1] * gs[2];
+    long sz = gs[0] > 1 ? (long)gs[1] * gs[2] : 0; // grid strides (0 if a single node)
+    long sx = gs[1] > 1 ? gs[2] : 0;
+    int sy = gs[2] > 1 ? 1 : 0;
+    grid_pos(k, ps[0], gs[0], &cz, &fz);
+    grid_pos(i, ps[1], gs[1], &cx, &fx);
+    for (d = 0; d < 2; d++) {
+        for (c = 0; c < gs[2]; c++) {
+            const float *g = disp + d * n + ((long)cz * gs[1] + cx) * gs[2] + c;
+            row[d * gs[2] + c] = (1 - fz) * ((1 - fx) * g[0] + fx * g[sx])
+                                 + fz * ((1 - fx) * g[sz] + fx * g[sz + sx]);
+        }
+    }
+    for (j = 0; j < ps[2]; j++) {
+        float f;
+        grid_pos(j, ps[2], gs[2], &c, &f);
+        du[j] = (1 - f) * row[c] + f * row[c + sy];
+        dv[j] = (1 - f) * row[gs[2] + c] + f * row[gs[2] + c + sy];
+    }
+}
+
+// Source pixel index map of a warp: zmap (z) holds the nearest source slice
+// of every output slice, xmap and ymap (z,x,y) the nearest source row and
+// column of every output pixel, all in frame coordinates. The map can then be
+// applied to any number of inputs by warpgather3d.
+//
+// If disp is not NULL, an elastic deformation given by a coarse grid of
+// in-plane displacements (2, gs[0], gs[1], gs[2]), in source pixels along x
+// and y, is added to the source coordinates of the transformation.
+int warpmap3d(int *zmap, int *xmap, int *ymap,
+              const int sh[3], // z,x,y (frame)
+              const int ps[3], // z,x,y
+              const float rot, const float shear, const float scale[3],
+              const float stretch_in[4], const float twist_in,
+              const float *disp, const int gs[3],
+              const int nthreads) {
+    int k, err = 0;
+    Warp3d t;
+    if (warp3d_init(&t, sh, ps, rot, shear, scale, stretch_in, twist_in) != 0) {
+        return -1;
+    }
 
-    z = -z_center_off + (sh[0] - ps[0]) / 2;
     for (k = 0; k < ps[0]; k++) {
-        sin_plus = sin(rot + shear + z * twist);
-        cos_plus = cos(rot + shear + z * twist);
-        sin_minu = sin(rot - shear + z * twist);
-        cos_minu = cos(rot - shear + z * twist);
-        w = z * scale[2] + z_center_off;
-        for (ch = 0; ch < sh[1]; ch++) {
-            x = -x_center_off + (sh[2] - ps[2]) / 2;
-            for (i = 0; i < ps[2]; i++) {
-                y = -y_center_off + (sh[3] - ps[3]) / 2;
-                for (j = 0; j < ps[3]; j++) {
-                    xt = x * (scale[0] + stretch[0] * y + stretch[2] * z);
-                    yt = y * (scale[1] + stretch[1] * x + stretch[3] * z);
-                    u = xt * cos_minu - yt * sin_plus + x_center_off;
-                    v = yt * cos_plus + xt * sin_minu + y_center_off;
-
-                    NN3d_zxy(src, u, v, w, ch, sh, strd_src, &ret);
-                    dest_d[k * strd[0] + ch * strd[1] + i * strd[2] + j] = ret;
-
-                    // printf("WRITE dest_d[%9i]\n", ch*ps[0]*ps[1]*ps[2] + i*ps[1]*ps[2] + j*ps[2] + k);
-                    // printf("u=%.1f v=%.1f w=%.1f x=%.1f y=%.1f z=%.1f i=%i j=%i k=%i val=%.1f\n", u, v, w, x, y, z, i, j, k, ret);
-                    y++;
+        WarpRow wr;
+        float w;
+        warp3d_row(&t, k, 0, &wr, &w);
+        zmap[k] = nearest(w);
+    }
+
+    #pragma omp parallel num_threads(N_THREADS(nthreads))
+    {
+        int i, j;
+        float *row = NULL, *xd = NULL, *yd = NULL;
+        int ok = 1;
+        if (disp != NULL) {
+            int len = ps[2] > 0 ? ps[2] : 1;
+            row = (float *)malloc(2 * gs[2] * sizeof(float));
+            xd = (float *)malloc(len * sizeof(float));
+            yd = (float *)malloc(len * sizeof(float));
+            ok = row != NULL && xd != NULL && yd != NULL;
+            if (!ok) {
+                #pragma omp atomic write
+                err = -1;
+            }
+        }
+        #pragma omp for collapse(2) schedule(static)
+        for (k = 0; k < ps[0]; k++) {
+            for (i = 0; i < ps[1]; i++) {
+                WarpRow wr;
+                float u, v, w;
+                long r = ((long)k * ps[1] + i) * ps[2];
+                if (!ok) {
+                    continue;
+                }
+                warp3d_row(&t, k, i, &wr, &w);
+                if (disp == NULL) {
+                    for (j = 0; j < ps[2]; j++) {
+                        row_coords(&wr, j, &u, &v);
+                        xmap[r + j] = nearest(u);
+                        ymap[r + j] = nearest(v);
+                    }
+                } else {
+                    displacement_row(disp, gs, ps, k, i, row, xd, yd);
+                    for (j = 0; j < ps[2]; j++) {
+                        row_coords(&wr, j, &u, &v);
+                        xmap[r + j] = nearest(u + xd[j]);
+                        ymap[r + j] = nearest(v + yd[j]);
+                    }
                 }
-                x++;
             }
         }
-        z++; // put into loop from above!?
+        free(row);
+        free(xd);
+        free(yd);
     }
-    return 0;
+    warp3d_free(&t);
+    return err;
+}
+
+/************************************************************************************************************/
+// 3D warping kernels specialized per pixel type (see warping_3d.h).
+
+#define PIXEL float
+#define SUFFIX f32
+#include "warping_3d.h"
+
+#define PIXEL uint8_t
+#define SUFFIX u8
+#include "warping_3d.h"
+
+#define PIXEL uint16_t
+#define SUFFIX u16
+#include "warping_3d.h"
+
+#define PIXEL uint32_t
+#define SUFFIX u32
+#include "warping_3d.h"
+
+#define PIXEL uint64_t
+#define SUFFIX u64
+#include "warping_3d.h"
+
+/************************************************************************************************************/
+// Joint warping of several inputs in a single pass.
+
+// Copy all channels of an output row for pixels of the given size in bytes.
+// src and dest_row point to pixel 0 of the source and of the output row.
+static inline void copy_row_any(const void *src, void *dest_row, int itemsize,
+                                const long *idx, int n, int nch,
+                                long strd_src, long strd, long strd_j) {
+    switch (itemsize) {
+    case 1:
+        copy_row_u8((const uint8_t *)src, (uint8_t *)dest_row, idx, n, nch,
+                    strd_src, strd, strd_j);
+        break;
+    case 2:
+        copy_row_u16((const uint16_t *)src, (uint16_t *)dest_row, idx, n, nch,
+                     strd_src, strd, strd_j);
+        break;
+    case 4:
+        copy_row_u32((const uint32_t *)src, (uint32_t *)dest_row, idx, n, nch,
+                     strd_src, strd, strd_j);
+        break;
+    case 8:
+        copy_row_u64((const uint64_t *)src, (uint64_t *)dest_row, idx, n, nch,
+                     strd_src, strd, strd_j);
+        break;
+    }
+}
+
+// Warp n inputs (e.g. image, label and mask) with the same transformation,
+// walking the output grid once: the source coordinates of every output pixel
+// are computed once and all outputs are written from them. Pixels are copied
+// by size, so every input keeps its dtype (nearest-neighbour sampling is
+// exact for labels and masks).
+//
+// The transformation is done w.r.t. the center of a frame of shape sh (z,x,y)
+// and the output grid is the largest output patch ms (z,x,y), centered in the
+// frame. Per input (arrays of n entries, or n x 3/4 values):
+//   src_sh, strd_src: shape and strides (z,ch,x,y) of the input
+//   off: position (z,x,y) of the input within the frame
+//   ps, strd: shape and strides (z,ch,x,y) of the output
+//   pos: position (z,x,y) of the output within the output grid
+// Strides are in pixels and may be negative. Pixels mapped outside of an
+// input are set to zero.
+int warpjoint3d(const int n, const void *const *src, void *const *dest,
+                const int *itemsize, const int *src_sh, const long *strd_src,
+                const int *off, const int *ps, const long *strd, const int *pos,
+                const int sh[3], const int ms[3],
+                const float rot, const float shear, const float scale[3],
+                const float stretch_in[4], const float twist_in,
+                const int nthreads) {
+    int err = 0;
+    Warp3d t;
+    if (warp3d_init(&t, sh, ms, rot, shear, scale, stretch_in, twist_in) != 0) {
+        return -1;
+    }
+
+    #pragma omp parallel num_threads(N_THREADS(nthreads))
+    {
+        int i, j, k, m;
+        int len = ms[2] > 0 ? ms[2] : 1;
+        // Nearest source row/column of every pixel in a row, in the frame.
+        int *xn = (int *)malloc(len * sizeof(int));
+        int *yn = (int *)malloc(len * sizeof(int));
+        // Source pixel offset of every pixel in a row (OUTSIDE if outside of src).
+        long *idx = (long *)malloc(len * sizeof(long));
+        int ok = xn != NULL && yn != NULL && idx != NULL;
+        if (!ok) {
+            #pragma omp atomic write
+            err = -1;
+        }
+        #pragma omp for collapse(2) schedule(static)
+        for (k = 0; k < ms[0]; k++) {
+            for (i = 0; i < ms[1]; i++) {
+                WarpRow wr;
+                float u, v, w;
+                int zn;
+                if (!ok) {
+                    continue;
+                }
+                warp3d_row(&t, k, i, &wr, &w);
+                zn = nearest(w);
+                for (j = 0; j < ms[2]; j++) {
+                    row_coords(&wr, j, &u, &v);
+                    xn[j] = nearest(u);
+                    yn[j] = nearest(v);
+                }
+                for (m = 0; m < n; m++) {
+                    const int *s_sh = src_sh + 4 * m;
+                    const long *s_st = strd_src + 4 * m;
+                    const int *o = off + 3 * m;
+                    const int *p = ps + 4 * m;
+                    const long *d_st = strd + 4 * m;
+                    const int *q = pos + 3 * m;
+                    int kk = k - q[0];
+                    int ii = i - q[1];
+                    int z = zn - o[0];
+                    if (kk < 0 || kk >= p[0] || ii < 0 || ii >= p[2]) {
+                        continue;
+                    }
+                    for (j = 0; j < p[3]; j++) {
+                        int x = xn[j + q[2]] - o[1];
+                        int y = yn[j + q[2]] - o[2];
+                        int inside = (x >= 0) & (x < s_sh[2]) & (y >= 0) & (y < s_sh[3])
+                                     & (z >= 0) & (z < s_sh[0]);
+                        idx[j] = inside ? z * s_st[0] + x * s_st[2] + y * s_st[3] : OUTSIDE;
+                    }
+                    copy_row_any(src[m],
+                                 (char *)dest[m] + (kk * d_st[0] + ii * d_st[2]) * itemsize[m],
+                                 itemsize[m], idx, p[3], p[1], s_st[1], d_st[1], d_st[3]);
+                }
+            }
+        }
+        free(xn);
+        free(yn);
+        free(idx);
+    }
+    warp3d_free(&t);
+    return err;
 }
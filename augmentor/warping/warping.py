@@ -17,6 +17,7 @@ import numpy as np
 #     raise RuntimeError('_warping.so Cython extension not found.\n'
 #                        'Please run setup.py or manually cythonize _warping.pyx.')
 from ._warping import warp2dFast, warp3dFast, _warp2dFastLab, _warp3dFastLab
+from ._warping import warp3dMap, warp3dGather, warp3dJointFast, warp2dSections
 
 
 def warp2dJoint(img, lab, patch_size, rot, shear, scale, stretch):
@@ -61,7 +62,8 @@ def warp2dJoint(img, lab, patch_size, rot, shear, scale, stretch):
     return img, lab
 
 
-def warp3dJoint(img, lab, patch_size, rot=0, shear=0, scale=(1, 1, 1), stretch=(0, 0, 0, 0), twist=0):
+def warp3dJoint(img, lab, patch_size, rot=0, shear=0, scale=(1, 1, 1), stretch=(0, 0, 0, 0), twist=0,
+                threads=1):
     """
     Warp image and label data jointly. Non-image labels are ignored i.e. lab must be 3d to be warped
 
@@ -93,6 +95,8 @@ def warp3dJoint(img, lab, patch_size, rot=0, shear=0, scale=(1, 1, 1), stretch=(
 
     twist: float
       Dependence of the rotation angle on z in deg from center to outer border
+    threads: int
+      Number of OpenMP threads. Non-positive values use all available cores.
 
     Returns
     -------
@@ -102,17 +106,17 @@ def warp3dJoint(img, lab, patch_size, rot=0, shear=0, scale=(1, 1, 1), stretch=(
 
     """
     if len(lab.shape) == 3:
-        lab = _warp3dFastLab(lab, patch_size, np.array(img.shape)[[0, 2, 3]], rot, shear, scale, stretch, twist)
+        lab = _warp3dFastLab(lab, patch_size, np.array(img.shape)[[0, 2, 3]], rot, shear, scale, stretch, twist, threads)
 
-    img = warp3dFast(img, patch_size, rot, shear, scale, stretch, twist)
+    img = warp3dFast(img, patch_size, rot, shear, scale, stretch, twist, threads)
     return img, lab
 
 
-def warp3d(img, patch_size, rot=0, shear=0, scale=(1, 1, 1), stretch=(0, 0, 0, 0), twist=0):
-    return warp3dFast(img, patch_size, rot, shear, scale, stretch, twist)
+def warp3d(img, patch_size, rot=0, shear=0, scale=(1, 1, 1), stretch=(0, 0, 0, 0), twist=0, threads=1):
+    return warp3dFast(img, patch_size, rot, shear, scale, stretch, twist, threads)
 
-def warp3dLab(lab, patch_size, size, rot=0, shear=0, scale=(1, 1, 1), stretch=(0, 0, 0, 0), twist=0):
-    return _warp3dFastLab(lab, patch_size, size, rot, shear, scale, stretch, twist)
+def warp3dLab(lab, patch_size, size, rot=0, shear=0, scale=(1, 1, 1), stretch=(0, 0, 0, 0), twist=0, threads=1):
+    return _warp3dFastLab(lab, patch_size, size, rot, shear, scale, stretch, twist, threads)
 
 ### Utilities #################################################################
 ###############################################################################
@@ -236,28 +240,34 @@ def getRequiredPatchSize(patch_size, rot, shear, scale, stretch, twist=None):
     return req_size.astype(np.int), eff_size.astype(np.int), left_exc.astype(np.int)
 
 
+def getWarpRanges(amount=1.0, **kwargs):
+    """
+    Maximum warping parameters drawn by getWarpParams, as a dict of rot_max,
+    shear_max, scale_max and stretch_max.
+    """
+    ranges = dict(rot_max=15 * amount, shear_max=3 * amount,
+                  scale_max=1.1 * amount, stretch_max=0.1 * amount)
+
+    # Data-specific max.
+    for k in ranges:
+        if k in kwargs:
+            ranges[k] = kwargs[k]
+    return ranges
+
+
 def getWarpParams(patch_size, amount=1.0, do_twist=True, **kwargs):
     """
     To be called from CNNData. Get warping parameters + required warping input patch size.
     """
     if amount > 1:
         print('WARNING: warpAugment amount > 1 this requires more than 1.4 bigger patches before warping')
-    rot_max = 15 * amount
-    shear_max = 3 * amount
-    scale_max = 1.1 * amount
-    stretch_max = 0.1 * amount
+    ranges = getWarpRanges(amount, **kwargs)
+    rot_max = ranges['rot_max']
+    shear_max = ranges['shear_max']
+    scale_max = ranges['scale_max']
+    stretch_max = ranges['stretch_max']
     n_dim = len(patch_size)
 
-    # Data-specific max.
-    if 'rot_max' in kwargs:  # 0.0
-       rot_max = kwargs['rot_max']
-    if 'shear_max' in kwargs:  # 0.0
-       shear_max = kwargs['shear_max']
-    if 'scale_max' in kwargs:  # 1.0
-       scale_max = kwargs['scale_max']
-    if 'stretch_max' in kwargs:  # 0.0
-       stretch_max = kwargs['stretch_max']
-
     shear = shear_max * 2 * (np.random.rand() - 0.5)
     if n_dim == 3:
         if do_twist:
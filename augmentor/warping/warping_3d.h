@@ -0,0 +1,216 @@
+/*
+Nearest-neighbour warping kernels, instantiated once per pixel type.
+
+Include this file after defining PIXEL (the C pixel type) and SUFFIX (the
+function name suffix). Nearest-neighbour sampling only copies pixels, so the
+input dtype is read and written directly without conversion.
+*/
+
+#define TEMPLATE_CAT_(name, suffix) name##_##suffix
+#define TEMPLATE_CAT(name, suffix) TEMPLATE_CAT_(name, suffix)
+#define TEMPLATE(name) TEMPLATE_CAT(name, SUFFIX)
+
+// Copy all channels of output row dest_row from the source pixel offset idx
+// of every pixel in the row (OUTSIDE if outside of src). Strides are in pixels.
+static inline void TEMPLATE(copy_row)(const PIXEL *src, PIXEL *dest_row,
+                                      const long *idx, int n, int nch,
+                                      long strd_src, long strd, long strd_j) {
+    int j, ch;
+    for (ch = 0; ch < nch; ch++) {
+        const PIXEL *src_ch = src + ch * strd_src;
+        PIXEL *dest_ch = dest_row + ch * strd;
+        if (strd_j == 1) {
+            for (j = 0; j < n; j++) {
+                dest_ch[j] = idx[j] == OUTSIDE ? 0 : src_ch[idx[j]];
+            }
+        } else {
+            for (j = 0; j < n; j++) {
+                dest_ch[j * strd_j] = idx[j] == OUTSIDE ? 0 : src_ch[idx[j]];
+            }
+        }
+    }
+}
+
+// The transformation is done w.r.t. the center of a frame of shape sh. src
+// may be smaller than the frame: it covers the frame from offset off (z,x,y)
+// on, and everything outside of it reads as zero.
+int TEMPLATE(fastwarp3d_opt_zxy)(const PIXEL *src, PIXEL *dest_d,
+                       const int sh[4],     // z,ch,x,y (frame)
+                       const int src_sh[4], // z,ch,x,y
+                       const int off[3],    // z,x,y
+                       const int ps[4],     // z,ch,x,y
+                       const float rot, const float shear, const float scale[3],
+                       const float stretch_in[4], const float twist_in,
+                       const int nthreads) {
+    int err = 0;
+    long strd[3] = {(long)ps[1] * ps[2] * ps[3], (long)ps[2] * ps[3], ps[3]};
+    long strd_src[3] = {(long)src_sh[1] * src_sh[2] * src_sh[3],
+                        (long)src_sh[2] * src_sh[3], src_sh[3]};
+
+    int frame[3] = {sh[0], sh[2], sh[3]};
+    int patch[3] = {ps[0], ps[2], ps[3]};
+    Warp3d t;
+    if (warp3d_init(&t, frame, patch, rot, shear, scale, stretch_in, twist_in) != 0) {
+        return -1;
+    }
+
+    // Output slices and rows are independent of each other.
+    #pragma omp parallel num_threads(N_THREADS(nthreads))
+    {
+        int i, j, k;
+        // Source pixel offset of every pixel in a row (OUTSIDE if outside of src).
+        long *idx = (long *)malloc((ps[3] > 0 ? ps[3] : 1) * sizeof(long));
+        if (idx == NULL) {
+            #pragma omp atomic write
+            err = -1;
+        }
+        #pragma omp for collapse(2) schedule(static)
+        for (k = 0; k < ps[0]; k++) {
+            for (i = 0; i < ps[2]; i++) {
+                WarpRow row;
+                float u, v, w;
+                int z;
+                if (idx == NULL) {
+                    continue;
+                }
+                warp3d_row(&t, k, i, &row, &w);
+                z = nearest(w) - off[0];
+                for (j = 0; j < ps[3]; j++) {
+                    row_coords(&row, j, &u, &v);
+                    int x = nearest(u) - off[1];
+                    int y = nearest(v) - off[2];
+                    int inside = (x >= 0) & (x < src_sh[2]) & (y >= 0) & (y < src_sh[3])
+                                 & (z >= 0) & (z < src_sh[0]);
+                    idx[j] = inside ? z * strd_src[0] + x * strd_src[2] + y : OUTSIDE;
+                }
+                // Coordinates are computed once per pixel and shared by all channels.
+                TEMPLATE(copy_row)(src, dest_d + k * strd[0] + i * strd[2], idx,
+                                   ps[3], ps[1], strd_src[1], strd[1], 1);
+            }
+        }
+        free(idx);
+    }
+    warp3d_free(&t);
+    return err;
+}
+
+// Apply a source pixel index map computed by warpmap3d. dest covers the map
+// from offset map_off (z,x,y) on, and src covers the frame the map refers to
+// from offset off (z,x,y) on. Pixels mapped outside of src are set to zero.
+// src and dest may have any memory layout: their strides (in pixels, possibly
+// negative) are given per axis, so e.g. (ch,z,x,y) arrays and views are
+// gathered directly without transposing or copying them first.
+int TEMPLATE(warpgather3d)(const PIXEL *src, PIXEL *dest_d,
+                       const int *zmap, const int *xmap, const int *ymap,
+                       const int map_sh[3],      // z,x,y
+                       const int map_off[3],     // z,x,y
+                       const int src_sh[4],      // z,ch,x,y
+                       const long strd_src[4],   // z,ch,x,y
+                       const int off[3],         // z,x,y
+                       const int ps[4],          // z,ch,x,y
+                       const long strd[4],       // z,ch,x,y
+                       const int nthreads) {
+    int err = 0;
+
+    #pragma omp parallel num_threads(N_THREADS(nthreads))
+    {
+        int i, j, k;
+        // Source pixel offset of every pixel in a row (OUTSIDE if outside of src).
+        long *idx = (long *)malloc((ps[3] > 0 ? ps[3] : 1) * sizeof(long));
+        if (idx == NULL) {
+            #pragma omp atomic write
+            err = -1;
+        }
+        #pragma omp for collapse(2) schedule(static)
+        for (k = 0; k < ps[0]; k++) {
+            for (i = 0; i < ps[2]; i++) {
+                int z = zmap[k + map_off[0]] - off[0];
+                long row = ((long)(k + map_off[0]) * map_sh[1] + i + map_off[1]) * map_sh[2]
+                           + map_off[2];
+                if (idx == NULL) {
+                    continue;
+                }
+                for (j = 0; j < ps[3]; j++) {
+                    int x = xmap[row + j] - off[1];
+                    int y = ymap[row + j] - off[2];
+                    int inside = (x >= 0) & (x < src_sh[2]) & (y >= 0) & (y < src_sh[3])
+                                 & (z >= 0) & (z < src_sh[0]);
+                    idx[j] = inside ? z * strd_src[0] + x * strd_src[2] + y * strd_src[3] : OUTSIDE;
+                }
+                TEMPLATE(copy_row)(src, dest_d + k * strd[0] + i * strd[2], idx,
+                                   ps[3], ps[1], strd_src[1], strd[1], strd[3]);
+            }
+        }
+        free(idx);
+    }
+    return err;
+}
+
+// Warp n sections zs of img (z,ch,x,y) in place, each with its own 2D
+// transformation w.r.t. the center of the section. params holds 6 values per
+// section: rot, shear (radians), scale (x,y) and stretch (x,y). Source
+// coordinates outside of a section are clamped to its border, so the warped
+// section has no empty margins. Sections are warped in parallel, each copied
+// to a per-thread buffer first. Strides are in pixels.
+int TEMPLATE(warpsections2d)(PIXEL *img, const int sh[4], const long strd[4],
+                             const int *zs, const int n, const float *params,
+                             const int nthreads) {
+    int err = 0;
+    #pragma omp parallel num_threads(N_THREADS(nthreads))
+    {
+        int m;
+        long plane = (long)sh[2] * sh[3];
+        PIXEL *buf = (PIXEL *)malloc((sh[1] * plane > 0 ? sh[1] * plane : 1) * sizeof(PIXEL));
+        long *idx = (long *)malloc((sh[3] > 0 ? sh[3] : 1) * sizeof(long));
+        int ok = buf != NULL && idx != NULL;
+        if (!ok) {
+            #pragma omp atomic write
+            err = -1;
+        }
+        #pragma omp for schedule(dynamic)
+        for (m = 0; m < n; m++) {
+            int i, j, ch;
+            const float *p = params + 6 * m;
+            PIXEL *sec = img + zs[m] * strd[0];
+            Warp2d t;
+            if (!ok) {
+                continue;
+            }
+            // Source section.
+            for (ch = 0; ch < sh[1]; ch++) {
+                for (i = 0; i < sh[2]; i++) {
+                    const PIXEL *row = sec + ch * strd[1] + i * strd[2];
+                    PIXEL *buf_row = buf + ch * plane + (long)i * sh[3];
+                    for (j = 0; j < sh[3]; j++) {
+                        buf_row[j] = row[j * strd[3]];
+                    }
+                }
+            }
+            warp2d_init(&t, sh + 2, sh + 2, p[0], p[1], p + 2, p + 4);
+            for (i = 0; i < sh[2]; i++) {
+                WarpRow row;
+                float u, v;
+                warp2d_row(&t, i, &row);
+                for (j = 0; j < sh[3]; j++) {
+                    row_coords(&row, j, &u, &v);
+                    int x = nearest(u);
+                    int y = nearest(v);
+                    x = x < 0 ? 0 : (x >= sh[2] ? sh[2] - 1 : x);
+                    y = y < 0 ? 0 : (y >= sh[3] ? sh[3] - 1 : y);
+                    idx[j] = (long)x * sh[3] + y;
+                }
+                TEMPLATE(copy_row)(buf, sec + i * strd[2], idx, sh[3], sh[1],
+                                   plane, strd[1], strd[3]);
+            }
+        }
+        free(buf);
+        free(idx);
+    }
+    return err;
+}
+
+#undef TEMPLATE
+#undef TEMPLATE_CAT
+#undef TEMPLATE_CAT_
+#undef PIXEL
+#undef SUFFIX
@@ -1,3 +1,5 @@
+import sys
+
 from Cython.Build import cythonize
 from setuptools import setup, Extension, find_packages
 
@@ -9,10 +11,35 @@ requirements = [
 ]
 
 
+# OpenMP for multithreaded kernels.
+if sys.platform == 'win32':
+    openmp_compile_args = ['/openmp']
+    openmp_link_args = []
+elif sys.platform == 'darwin':
+    openmp_compile_args = ['-Xpreprocessor', '-fopenmp']
+    openmp_link_args = ['-lomp']
+else:
+    openmp_compile_args = ['-fopenmp']
+    openmp_link_args = ['-fopenmp']
+
+
 extensions = [
     Extension(
         'augmentor.warping._warping',
-        sources = ['augmentor/warping/*.pyx']
+        sources = ['augmentor/warping/*.pyx'],
+        depends = ['augmentor/warping/warping.c',
+                   'augmentor/warping/warping_3d.h'],
+        extra_compile_args = openmp_compile_args,
+        extra_link_args = openmp_link_args,
+    ),
+    Extension(
+        'augmentor.perturbing._perturbing',
+        sources = ['augmentor/perturbing/*.pyx'],
+        depends = ['augmentor/perturbing/perturbing.c',
+                   'augmentor/perturbing/perturbing_float.h',
+                   'augmentor/perturbing/perturbing_pixel.h'],
+        extra_compile_args = openmp_compile_args,
+        extra_link_args = openmp_link_args,
     ),
 ]
 
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+import augmentor
+from augmentor.perturb import Noise, Texture, smooth_noise
+
+
+def test_smooth_noise():
+    np.random.seed(0)
+    for sigma in [1, 2, 8]:
+        field = smooth_noise((4, 64, 48), sigma)
+        assert field.shape == (4, 64, 48) and field.dtype == np.float32
+        assert abs(field.mean()) < 0.5
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64, np.uint8])
+def test_noise(dtype):
+    np.random.seed(1)
+    img = np.zeros((1, 3, 40, 40), dtype=dtype)
+    Noise(sigma=(2,5))(img)
+    assert img.dtype == dtype
+    top = 255 if dtype == np.uint8 else 1
+    assert img.min() >= 0 and img.max() <= top and img.std() > 0
+
+
+def bank(rng):
+    return rng.rand(4, 60, 60).astype(np.float32)
+
+
+def test_texture_crops():
+    rng = np.random.RandomState(2)
+    b = bank(rng)
+    np.random.seed(2)
+    for _ in range(100):
+        shape = (3,) + tuple(rng.randint(1, 61, 2))
+        img = np.zeros(shape, dtype=np.float32)
+        t = Texture(b)
+        t(img)
+        crop = img.transpose(0,2,1) if t.transpose else img
+        crop = crop[:, ::-1 if t.flip[0] else 1, ::-1 if t.flip[1] else 1]
+        d, h, w = crop.shape
+        y = int(t.offset[0] * (60 - h + 1))
+        x = int(t.offset[1] * (60 - w + 1))
+        # A contiguous window of consecutive bank sections, no wrapping
+        # in-plane.
+        for z in range(d):
+            ref = b[(t.start + z) % len(b), y:y+h, x:x+w]
+            assert np.array_equal(crop[z], ref)
+
+
+def test_texture_uint8():
+    b = bank(np.random.RandomState(3))
+    img = np.zeros((2, 10, 10), dtype=np.uint8)
+    t = Texture(b)
+    t(img)
+    ref = np.zeros((2, 10, 10), dtype=np.float32)
+    t(ref)
+    assert np.array_equal(img, augmentor.utils.from_float(ref, np.uint8))
+
+
+def test_noise_box_bank():
+    aug = augmentor.NoiseBox(bank=8, refresh=3)
+    spec = {'img': (10, 64, 64), 'aff': (10, 64, 64)}
+    banks = []
+    np.random.seed(4)
+    for _ in range(7):
+        aug.prepare(spec, imgs=['img', 'aff'])
+        sample = {k: np.full((1,) + v, 0.5, dtype=np.float32)
+                  for k, v in spec.items()}
+        out = aug(sample)
+        banks.append(aug.bank)
+        # Same occluders in every image.
+        assert np.array_equal(out['img'], out['aff'])
+    assert aug.bank.shape == (8, 2 * aug.dims[1], 2 * aug.dims[1])
+    assert len(set(id(b) for b in banks)) == 3
+
+
+def test_noise_box_uint8():
+    aug = augmentor.NoiseBox()
+    np.random.seed(5)
+    aug.prepare({'img': (10, 64, 64)}, imgs=['img'])
+    img = np.full((1, 10, 64, 64), 128, dtype=np.uint8)
+    out = aug({'img': img})['img']
+    assert out.dtype == np.uint8 and np.any(out != 128)
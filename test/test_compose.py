@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+import augmentor
+
+
+SPEC = {'img': (6, 24, 24), 'lab': (4, 16, 16)}
+
+
+def stages(case):
+    return {
+        'flips': [augmentor.Flip(-1, prob=1), augmentor.Transpose(prob=1),
+                  augmentor.Flip(-3, prob=1)],
+        'warp': [augmentor.Flip(-2, prob=1), augmentor.Warp(),
+                 augmentor.Transpose(prob=1)],
+        'gray': [augmentor.Flip(-1, prob=1), augmentor.Grayscale3D(skip=0),
+                 augmentor.Flip(-2, prob=1)],
+        'section': [augmentor.Transpose(prob=1),
+                    augmentor.Grayscale2D(prob=1), augmentor.Warp(),
+                    augmentor.Flip(-1, prob=1)],
+    }[case]
+
+
+def sample(spec, seed):
+    rng = np.random.RandomState(seed)
+    return {'img': rng.rand(*spec['img']).astype(np.float32),
+            'lab': rng.randint(0, 100, spec['lab']).astype(np.uint32)}
+
+
+@pytest.mark.parametrize('case', ['flips', 'warp', 'gray', 'section'])
+def test_compose_matches_stages(case):
+    augs = stages(case)
+    compose = augmentor.Compose(augs)
+    np.random.seed(0)
+    spec = compose.prepare(SPEC, imgs=['img'])
+    inputs = sample(spec, 1)
+    arrays = dict(inputs)
+    originals = {k: v.copy() for k, v in inputs.items()}
+
+    # Same prepared augments, applied one at a time.
+    ref = {k: v.copy() for k, v in inputs.items()}
+    np.random.seed(2)
+    for aug in augs:
+        ref = aug(ref)
+    np.random.seed(2)
+    out = compose(inputs)
+    for k in ref:
+        assert np.array_equal(out[k], ref[k])
+
+    # The caller's arrays are left alone, unless an in-place stage comes
+    # first.
+    for k in arrays:
+        assert np.array_equal(arrays[k], originals[k])
+
+
+def test_compose_in_place_first():
+    compose = augmentor.Compose([augmentor.Grayscale3D(skip=0),
+                                 augmentor.Flip(-1, prob=1)])
+    np.random.seed(0)
+    compose.prepare({'img': (4, 8, 8)}, imgs=['img'])
+    img = np.random.rand(1, 4, 8, 8).astype(np.float32)
+    out = compose({'img': img})['img']
+    assert np.array_equal(out, img[...,::-1])
+
+
+@pytest.mark.parametrize('aug', [augmentor.Warp(skip=1),
+                                 augmentor.Grayscale3D(skip=1),
+                                 augmentor.Grayscale2D(prob=1, skip=1)])
+def test_compose_skipped_stage(aug, monkeypatch):
+    # Stages that leave the sample as it is do not copy the views.
+    detached = []
+    detach = augmentor.Compose._detach
+    monkeypatch.setattr(augmentor.Compose, '_detach', staticmethod(
+        lambda sample, inputs: detached.append(detach(sample, inputs))))
+    compose = augmentor.Compose([augmentor.Flip(-1, prob=1), aug,
+                                 augmentor.Flip(-2, prob=1)])
+    np.random.seed(0)
+    compose.prepare({'img': (4, 8, 8)}, imgs=['img'])
+    img = np.random.rand(1, 4, 8, 8).astype(np.float32)
+    out = compose({'img': img})['img']
+    assert np.array_equal(out, img[...,::-1,::-1])
+    assert detached == []
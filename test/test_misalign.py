@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+import augmentor
+from augmentor import utils
+
+
+SPEC = {'img': (8, 20, 20), 'lab': (6, 16, 16)}
+
+
+def sample(spec, seed):
+    rng = np.random.RandomState(seed)
+    return {k: (rng.rand(1, *v[-3:]) * 255).astype(np.float32)
+            for k, v in spec.items()}
+
+
+def test_take_slabs():
+    data = np.random.rand(2, 6, 10, 12)
+    slabs = [(0, 2, (slice(0, 2), slice(0, 8), slice(0, 9))),
+             (2, 5, (slice(2, 5), slice(1, 9), slice(3, 12))),
+             (5, 6, (slice(5, 6), slice(2, 10), slice(1, 10)))]
+    ref = np.concatenate([data[(Ellipsis,) + idx] for _, _, idx in slabs],
+                         axis=1)
+    assert np.array_equal(utils.take_slabs(data, slabs, (6, 8, 9)), ref)
+
+    # Into a strided view.
+    out = np.empty((2, 6, 9, 8))
+    view = out.transpose(0,1,3,2)[:,::-1]
+    utils.take_slabs(data, slabs, (6, 8, 9), out=view)
+    assert np.array_equal(view, ref)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_misalign(seed):
+    aug = augmentor.Misalign((1, 5), margin=1)
+    np.random.seed(seed)
+    spec = aug.prepare(SPEC)
+    inputs = sample(spec, seed)
+    ref = dict()
+    for k, v in inputs.items():
+        z, y, x = aug.spec[k][-3:]
+        zloc = aug.zlocs[k]
+        lower = v[:,:zloc,:y,:x]
+        upper = v[:,zloc:,aug.ty:aug.ty+y,aug.tx:aug.tx+x]
+        ref[k] = np.concatenate([lower, upper], axis=1)
+    ref = aug.flip_rotate(ref)
+    out = aug(dict(inputs))
+    for k in ref:
+        assert np.array_equal(out[k], ref[k])
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_multi_misalign(seed):
+    aug = augmentor.MultiMisalign((1, 4), maxsec=3)
+    np.random.seed(seed)
+    spec = aug.prepare(SPEC)
+    inputs = sample(spec, seed)
+    out = aug(dict(inputs))
+    for k, v in inputs.items():
+        z, y, x = aug.spec[k][-3:]
+        assert out[k].shape == v.shape[:-3] + (z, y, x)
+        for s in range(z):
+            ty, tx = aug.offsets[k][s]
+            assert np.array_equal(out[k][:,s], v[:,s,ty:ty+y,tx:tx+x])
+
+
+
+def lost_reference(aug, inputs, value=None):
+    """Baseline reassembly of a prepared LostSection/LostPlusMissing."""
+    ref = dict()
+    for k, v in inputs.items():
+        zloc, nsec = aug.zloc[k], aug.nsec
+        if value is None:
+            ref[k] = np.concatenate([v[:,:zloc], v[:,zloc+nsec:]], axis=1)
+            continue
+        # Missing section at zloc, filled for images.
+        w = np.concatenate([v[:,:zloc], v[:,zloc+1:zloc+2],
+                            v[:,zloc+nsec+1:]], axis=1)
+        if k in aug.imgs:
+            w[:,zloc] = value
+        ref[k] = w
+    return ref
+
+
+@pytest.mark.parametrize('flip_rotate', [False, True])
+@pytest.mark.parametrize('missing', [False, True])
+@pytest.mark.parametrize('seed', range(4))
+def test_lost_section(seed, missing, flip_rotate):
+    if missing:
+        aug = augmentor.LostPlusMissing(value=0.5)
+    else:
+        aug = augmentor.LostSection(2)
+    if flip_rotate:
+        aug.flip_rotate = augmentor.FlipRotate()
+    np.random.seed(seed)
+    spec = aug.prepare(SPEC, imgs=['img'])
+    inputs = sample(spec, seed)
+    ref = lost_reference(aug, inputs, 0.5 if missing else None)
+    if flip_rotate:
+        ref = aug.flip_rotate(ref)
+    out = aug(dict(inputs))
+    for k in ref:
+        # Written straight into the final orientation.
+        assert out[k].flags.c_contiguous
+        assert np.array_equal(out[k], ref[k])
+
+
+@pytest.mark.parametrize('aug', [
+    augmentor.MisalignPlusMissing((1, 5), random=True),
+    augmentor.LostPlusMissing(random=True),
+])
+def test_missing_uint8(aug):
+    spec = {'img': (8, 20, 20)}
+    fills = set()
+    for seed in range(6):
+        np.random.seed(seed)
+        spec_ = aug.prepare(spec, imgs=['img'])
+        img = np.full(spec_['img'], 128, dtype=np.uint8)
+        out = aug({'img': img})['img']
+        values = set(np.unique(out)) - {128}
+        assert len(values) == 1
+        fills |= values
+    # Random gray levels, scaled to [0,255].
+    assert len(fills) > 1
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+import augmentor
+
+
+SPEC = {'img': (8, 64, 64)}
+
+
+def noisy(aug, img, seed=0):
+    np.random.seed(seed)
+    aug.prepare(SPEC, imgs=['img'])
+    return aug({'img': img})['img']
+
+
+def test_additive_noise():
+    aug = augmentor.AdditiveGaussianNoise(sigma=0.05)
+    img = np.full((1,) + SPEC['img'], 0.5, dtype=np.float32)
+    out = noisy(aug, img.copy())
+    assert out.dtype == np.float32
+    assert abs(out.mean() - 0.5) < 1e-2
+    assert abs(out.std() - 0.05) < 5e-3
+
+
+def test_additive_noise_clipped():
+    aug = augmentor.AdditiveGaussianNoise(sigma=0.5)
+    out = noisy(aug, np.zeros((1,) + SPEC['img'], dtype=np.float64))
+    assert out.min() == 0 and out.max() <= 1
+
+
+def test_additive_noise_seeded():
+    aug = augmentor.AdditiveGaussianNoise()
+    img = np.random.rand(1, *SPEC['img']).astype(np.float32)
+    assert np.array_equal(noisy(aug, img.copy(), 1), noisy(aug, img.copy(), 1))
+    assert not np.array_equal(noisy(aug, img.copy(), 1),
+                              noisy(aug, img.copy(), 2))
+
+
+@pytest.mark.parametrize('per_channel', [False, True])
+@pytest.mark.parametrize('per_section', [False, True])
+def test_additive_noise_sigma(per_channel, per_section):
+    aug = augmentor.AdditiveGaussianNoise(sigma=(0.01, 0.2),
+                                          per_channel=per_channel,
+                                          per_section=per_section)
+    img = np.full((2,) + SPEC['img'], 0.5)
+    noise = noisy(aug, img.copy()) - 0.5
+    std = noise.std(axis=(2,3))
+    assert np.array_equal(noise[0], noise[1]) != per_channel
+    spread = std.max(axis=1) / std.min(axis=1)
+    assert np.all(spread > 1.5) if per_section else np.all(spread < 1.2)
+
+
+def test_additive_noise_uint8():
+    # Noise scaled to [0,255], with saturating math.
+    aug = augmentor.AdditiveGaussianNoise(sigma=0.1)
+    img = np.full((1,) + SPEC['img'], 128, dtype=np.uint8)
+    out = noisy(aug, img.copy())
+    assert out.dtype == np.uint8
+    assert abs(out.astype(np.float64).std() - 25.5) < 1
+    out = noisy(aug, np.full_like(img, 250))
+    assert out.max() == 255 and out.min() < 250
+
+
+
+def test_additive_noise_uint8_saturates():
+    # Large noise saturates at both ends instead of wrapping around.
+    aug = augmentor.AdditiveGaussianNoise(sigma=(2, 4), per_channel=True)
+    img = np.zeros((2,) + SPEC['img'], dtype=np.uint8)
+    img[1] = 255
+    out = noisy(aug, img)
+    assert out.dtype == np.uint8
+    for k in range(2):
+        assert out[k].min() == 0 and out[k].max() == 255
+        assert 0.4 < np.mean(out[k] == 255 * k) < 0.6
@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+from scipy.ndimage import gaussian_filter
+
+from augmentor.perturbing import perturbing
+
+
+def random_boxes(n, y, x, rng):
+    y0 = rng.randint(0, y // 2, n)
+    x0 = rng.randint(0, x // 2, n)
+    y1 = rng.randint(y // 2 + 1, y + 1, n)
+    x1 = rng.randint(x // 2 + 1, x + 1, n)
+    return np.stack([y0, y1, x0, x1], axis=-1)
+
+
+def grayscale_reference(img, contrast, brightness, gamma):
+    img = img * contrast + brightness
+    return np.clip(img, 0, 1) ** gamma
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_grayscale(dtype):
+    rng = np.random.RandomState(3)
+    img = rng.rand(2, 5, 16, 16).astype(dtype)
+    zlocs = [0, 3, 4]
+    params = rng.rand(3, 3) + 0.5
+    boxes = random_boxes(3, 16, 16, rng)
+    out = perturbing.grayscale(img.copy(), *params.T, zlocs=zlocs,
+                               boxes=boxes)
+    ref = img.copy()
+    for z, (c, b, g), (y0, y1, x0, x1) in zip(zlocs, params, boxes):
+        box = ref[:,z,y0:y1,x0:x1]
+        box[...] = grayscale_reference(box, c, b, g)
+    assert np.allclose(out, ref, rtol=1e-5, atol=1e-6)
+
+
+def test_grayscale_uint8_lut():
+    img = np.arange(256, dtype=np.uint8).reshape(1, 1, 16, 16)
+    out = perturbing.grayscale(img.copy(), 1.2, -0.1, 0.7)
+    ref = grayscale_reference(img / 255.0, 1.2, -0.1, 0.7) * 255
+    assert np.array_equal(out, np.rint(ref).astype(np.uint8))
+    lut = perturbing.grayscale_lut(1.2, -0.1, 0.7)
+    assert np.array_equal(lut[0], out.reshape(-1))
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+@pytest.mark.parametrize('sigma', [(0,0,3,3), (0,0,5,5), (0,0,8,8),
+                                   (0,2,4,4)])
+def test_gaussian_matches_scipy(dtype, sigma):
+    rng = np.random.RandomState(0)
+    img = rng.rand(2, 6, 64, 48).astype(dtype)
+    out = perturbing.gaussian(img.copy(), sigma)
+    ref = gaussian_filter(img.astype(np.float64), sigma)
+    assert out.dtype == dtype
+    # Recursive approximation, 'reflect' borders included.
+    assert np.abs(out - ref).max() < 1e-2
+
+
+def test_gaussian_ramp_borders():
+    ramp = np.linspace(0, 1, 200)[np.newaxis,np.newaxis,np.newaxis,:]
+    img = np.repeat(ramp, 4, axis=2)
+    out = perturbing.gaussian(img.copy(), (0,0,0,6))
+    assert np.abs(out - gaussian_filter(img, (0,0,0,6))).max() < 5e-3
+
+
+def test_gaussian_strided():
+    img = np.random.rand(1, 4, 40, 40).astype(np.float32)
+    view = img.transpose(0,1,3,2)[...,::-1]
+    ref = perturbing.gaussian(np.ascontiguousarray(view), 4)
+    out = perturbing.gaussian(view, 4)
+    assert np.allclose(out, ref, atol=1e-6)
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_blur_sections_fir_matches_scipy(dtype):
+    rng = np.random.RandomState(1)
+    img = rng.rand(1, 8, 40, 36).astype(dtype)
+    zlocs = [1, 4, 6]
+    sigma = [0.8, 1.5, 2.5]
+    boxes = random_boxes(3, 40, 36, rng)
+    out = perturbing.blur_sections(img.copy(), zlocs, sigma, boxes=boxes)
+    ref = img.copy()
+    for z, s, (y0, y1, x0, x1) in zip(zlocs, sigma, boxes):
+        box = ref[0,z,y0:y1,x0:x1]
+        box[...] = gaussian_filter(box, s)
+    # Same truncated kernel as scipy, below iir_sigma.
+    assert np.allclose(out, ref, rtol=0, atol=1e-6 if dtype == np.float32
+                       else 1e-12)
+
+
+def test_blur_sections_iir():
+    img = np.random.rand(2, 5, 48, 48).astype(np.float32)
+    out = perturbing.blur_sections(img.copy(), [0, 3], [4.0, 6.0])
+    ref = img.copy()
+    for z, s in zip([0, 3], [4.0, 6.0]):
+        for c in range(2):
+            ref[c,z] = gaussian_filter(img[c,z].astype(np.float64), s)
+    assert np.abs(out - ref).max() < 1e-2
+    untouched = [1, 2, 4]
+    assert np.array_equal(out[:,untouched], img[:,untouched])
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64, np.uint8])
+def test_fill(dtype):
+    rng = np.random.RandomState(2)
+    img = rng.randint(0, 255, (2, 6, 20, 30)).astype(dtype)
+    zlocs = [0, 2, 2, 5]
+    values = [1, 7, 9, 200]
+    boxes = random_boxes(4, 20, 30, rng)
+    out = perturbing.fill(img.copy(), zlocs, values, boxes=boxes)
+    ref = img.copy()
+    for z, v, (y0, y1, x0, x1) in zip(zlocs, values, boxes):
+        ref[:,z,y0:y1,x0:x1] = v
+    assert np.array_equal(out, ref)
@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+from scipy.ndimage import gaussian_filter
+
+import augmentor
+from augmentor.perturb import Perturb
+from augmentor.section import Section, PartialSection, MixedSection
+
+
+SPEC = {'img': (10, 32, 28)}
+KINDS = [Section, PartialSection, MixedSection]
+
+
+def prepared(aug, seed):
+    np.random.seed(seed)
+    aug.prepare(SPEC, imgs=['img'])
+    return aug
+
+
+def boxes(aug, img):
+    """Entries of a prepared section augment, in pixels."""
+    return aug.locate(img.shape[-2:])
+
+
+def grayscale_reference(img, aug):
+    ref = img.astype(np.float64)
+    zlocs, bx, values = boxes(aug, img)
+    for i, (z, (y0, y1, x0, x1)) in enumerate(zip(zlocs, bx)):
+        box = ref[:,z,y0:y1,x0:x1]
+        box *= values['contrast'][i]
+        box += values['brightness'][i]
+        np.clip(box, 0, 1, out=box)
+        box **= 2.0**values['gamma'][i]
+    return ref
+
+
+@pytest.mark.parametrize('kind', KINDS)
+@pytest.mark.parametrize('double', [False, True])
+@pytest.mark.parametrize('individual', [False, True])
+def test_grayscale(kind, double, individual):
+    aug = prepared(kind(augmentor.perturb.Grayscale, maxsec=3, double=double,
+                        individual=individual), 0)
+    img = np.random.rand(1, *SPEC['img'])
+    ref = grayscale_reference(img, aug)
+    out = aug({'img': img.copy()})['img']
+    assert np.allclose(out, ref, rtol=1e-12, atol=1e-12)
+    if double:
+        zlocs = aug.locate(img.shape[-2:])[0]
+        assert set(zlocs) == set(aug.zlocs) | set(z + 1 for z in aug.zlocs)
+
+
+def test_grayscale_uint8():
+    aug = prepared(augmentor.MixedGrayscale2D(maxsec=3), 1)
+    img = (np.random.rand(1, *SPEC['img']) * 255).astype(np.uint8)
+    ref = grayscale_reference(img / 255.0, aug) * 255
+    out = aug({'img': img.copy()})['img']
+    assert out.dtype == np.uint8
+    assert np.abs(out - ref).max() <= 0.5 + 1e-6
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.uint8])
+def test_fill(dtype):
+    aug = prepared(augmentor.PartialMissingSection(maxsec=4, random=True), 2)
+    img = np.full((1,) + SPEC['img'], 0.5 if dtype != np.uint8 else 128,
+                  dtype=dtype)
+    ref = img.copy()
+    zlocs, bx, values = boxes(aug, img)
+    for z, (y0, y1, x0, x1), v in zip(zlocs, bx, values['value']):
+        ref[:,z,y0:y1,x0:x1] = augmentor.utils.from_float(v, dtype)
+    out = aug({'img': img.copy()})['img']
+    assert np.array_equal(out, ref)
+
+
+@pytest.mark.parametrize('sigma', [2.0, 5.0])
+def test_blur(sigma):
+    aug = prepared(augmentor.MixedBlurrySection(maxsec=3, sigma=sigma), 3)
+    img = np.random.rand(1, *SPEC['img'])
+    ref = img.copy()
+    zlocs, bx, values = boxes(aug, img)
+    for z, (y0, y1, x0, x1), s in zip(zlocs, bx, values['sigma']):
+        box = ref[0,z,y0:y1,x0:x1]
+        box[...] = gaussian_filter(box, s)
+    out = aug({'img': img.copy()})['img']
+    # Truncated kernel below IIR_SIGMA, recursive approximation above.
+    tol = 1e-12 if sigma < augmentor.perturb.IIR_SIGMA else 1e-2
+    assert np.abs(out - ref).max() < tol
+
+
+class Record(Perturb):
+    """Unbatched perturbation recording what it is called on."""
+    calls = []
+
+    def __init__(self):
+        self.value = np.random.rand()
+
+    def __call__(self, img):
+        Record.calls.append((img.shape, self.value))
+        img[...] = self.value
+
+
+@pytest.mark.parametrize('individual', [False, True])
+def test_unbatched_double_sections(individual):
+    Record.calls = []
+    aug = prepared(Section(Record, maxsec=3, double=True,
+                           individual=individual), 4)
+    img = np.zeros((1,) + SPEC['img'])
+    out = aug({'img': img})['img']
+
+    # Called once per double section, on both sections at once.
+    assert len(Record.calls) == len(aug.zlocs)
+    assert all(shape[-3] == 2 for shape, _ in Record.calls)
+    values = set(v for _, v in Record.calls)
+    assert len(values) == (len(aug.zlocs) if individual else 1)
+    covered = set(aug.zlocs) | set(z + 1 for z in aug.zlocs)
+    assert set(np.where(np.all(out > 0, axis=(0,2,3)))[0]) == covered
+    assert set(np.where(np.any(out > 0, axis=(0,2,3)))[0]) == covered
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+import augmentor
+
+
+SPEC = {'img': (6, 64, 256), 'aff': (4, 48, 256)}
+
+
+def track(seed, spec=SPEC, dtype=np.float32, value=0.2):
+    aug = augmentor.Track(bank=8)
+    aug.flip_rotate = None
+    np.random.seed(seed)
+    aug.prepare(spec, imgs=list(spec))
+    top = 255 if dtype == np.uint8 else 1
+    sample = {k: np.full((1,) + v, value * top, dtype=dtype)
+              for k, v in spec.items()}
+    return aug, aug(sample)
+
+
+def test_track():
+    aug, out = track(0)
+    for k, v in out.items():
+        assert v.shape == (1,) + SPEC[k] and v.dtype == np.float32
+        assert v.min() >= 0.2 - 1e-6 and v.max() <= 1 + 1e-6
+        # Marks stay within the track columns.
+        cols = np.where(np.any(v != 0.2, axis=(0,1,2)))[0]
+        assert len(cols) > 0 and cols.max() - cols.min() < aug.width
+
+
+def test_track_shared_stencils():
+    # Both images get the same stencils, centered on each.
+    _, out = track(1)
+    img, aff = out['img'][0], out['aff'][0]
+    assert np.allclose(img[1:5,8:56], aff[:,:,:])
+
+
+def test_track_bank():
+    aug, _ = track(2)
+    bank = aug.bank
+    assert bank.shape == (8, 2 * 64, aug.width)
+    assert bank.min() >= 0 and bank.max() <= 1
+    # Reused for samples no taller than the bank.
+    np.random.seed(3)
+    aug.prepare(SPEC, imgs=list(SPEC))
+    aug({k: np.zeros((1,) + v, dtype=np.float32) for k, v in SPEC.items()})
+    assert aug.bank is bank
+
+
+def test_track_uint8():
+    _, ref = track(4)
+    _, out = track(4, dtype=np.uint8)
+    for k in ref:
+        assert out[k].dtype == np.uint8
+        assert np.abs(out[k] - ref[k] * 255).max() <= 1
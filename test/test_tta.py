@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+import augmentor
+
+
+@pytest.mark.parametrize('isotropic', [False, True])
+def test_forward_inverse(isotropic):
+    tta = augmentor.TTA(isotropic=isotropic)
+    assert len(tta) == (48 if isotropic else 16)
+    img = np.random.rand(2, 6, 6, 6).astype(np.float32)
+    variants = set()
+    for i in range(len(tta)):
+        v = tta.forward(img, i)
+        assert np.array_equal(tta.inverse(v, i), img)
+        variants.add(np.ascontiguousarray(v).tobytes())
+    assert len(variants) == len(tta)
+
+
+def test_variants_match_flips():
+    # Variant 0 is the identity, and every variant is a composition of the
+    # Flip and Transpose augments.
+    tta = augmentor.TTA()
+    img = np.random.rand(1, 4, 8, 8).astype(np.float32)
+    assert np.array_equal(tta.forward(img, 0), img)
+    for i, augs in enumerate(tta.variants):
+        ref = {'img': img}
+        for aug in augs:
+            ref = aug(ref)
+        assert np.array_equal(tta.forward(img, i), ref['img'])
+
+
+@pytest.mark.parametrize('batch_size', [1, 3, 16])
+def test_equivariant_model(batch_size):
+    tta = augmentor.TTA()
+    img = np.random.rand(1, 4, 8, 8).astype(np.float32)
+    calls = []
+
+    def model(batch):
+        calls.append(len(batch))
+        return np.concatenate([batch, 2 * batch], axis=1)
+
+    out = tta(model, img, batch_size=batch_size)
+    assert out.shape == (2, 4, 8, 8)
+    assert np.allclose(out[0], img[0]) and np.allclose(out[1], 2 * img[0])
+    assert sum(calls) == len(tta) and max(calls) <= batch_size
+
+
+def test_reused_output():
+    tta = augmentor.TTA()
+    img = np.random.rand(1, 4, 8, 8).astype(np.float32)
+    model = lambda batch: batch + 1
+    out = np.full(img.shape, 7, dtype=np.float32)
+    for _ in range(2):
+        res = tta(model, img, batch_size=4, out=out)
+        assert res is out
+        assert np.allclose(out, img + 1)
+    with pytest.raises(AssertionError):
+        tta(model, img, out=np.zeros((1, 4, 8, 9), dtype=np.float32))
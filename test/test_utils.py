@@ -0,0 +1,19 @@
+import numpy as np
+
+import augmentor
+from augmentor import utils
+
+
+def test_float_casts():
+    img = np.arange(256, dtype=np.uint8)
+    f = utils.to_float(img)
+    assert f.dtype == np.float32 and f[0] == 0 and f[-1] == 1
+    assert np.array_equal(utils.from_float(f, np.uint8), img)
+    assert utils.from_float(1.2, np.uint8) == 255
+    x = np.random.rand(4).astype(np.float32)
+    assert utils.to_float(x) is x
+
+    aug = augmentor.ToFloat()
+    aug.prepare({'img': (1, 16, 16)}, imgs=['img'])
+    out = aug({'img': img.reshape(1, 1, 16, 16)})['img']
+    assert out.dtype == np.float32 and np.array_equal(out.reshape(-1), f)
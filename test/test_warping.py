@@ -0,0 +1,319 @@
+import numpy as np
+import pytest
+
+import augmentor
+from augmentor.warping import warping
+
+
+PATCH = (6, 24, 20)
+LABEL = (4, 16, 12)
+
+
+def random_params(seed):
+    np.random.seed(seed)
+    size, rot, shear, scale, stretch, twist = warping.getWarpParams(PATCH)
+    size = tuple(int(x) for x in size)
+    return size, (rot, shear, scale, stretch, twist)
+
+
+def reference(img, patch_size, params):
+    """Nearest-neighbour warp of a (c,z,y,x) image, in numpy.
+
+    Follows the float32 arithmetic of the original ELEKTRONN kernel
+    (fastwarp3d_opt_zxy) step by step, so that the rounding to source
+    pixels is the same.
+    """
+    f = np.float32
+    rot, shear, scale, stretch, twist = params
+    rot, shear, twist = (f(a * np.pi / 180) for a in (rot, shear, twist))
+    scale = f(1) / np.array(scale, dtype=f)
+    stretch = np.array(stretch, dtype=f)
+    sh = img.shape[-3:]
+    zc, xc, yc = (f(s / 2.0 - 0.5) for s in sh)
+    sx, sy, sxz, syz = stretch / np.array([xc, yc, zc, zc], dtype=f)
+    twist = twist / zc
+
+    # Centered destination coordinates, as in the kernel's loops.
+    z, x, y = (np.arange(p, dtype=f) + f(-c + (s - p) // 2)
+               for c, s, p in zip((zc, xc, yc), sh, patch_size))
+    z, x, y = np.meshgrid(z, x, y, indexing='ij')
+    angle = lambda a: (rot + a) + z * twist
+    trig = lambda fn, a: fn(angle(a).astype(np.float64)).astype(f)
+    sin_plus, cos_plus = trig(np.sin, shear), trig(np.cos, shear)
+    sin_minu, cos_minu = trig(np.sin, -shear), trig(np.cos, -shear)
+
+    w = z * scale[2] + zc
+    xt = x * ((scale[0] + sx * y) + sxz * z)
+    yt = y * ((scale[1] + sy * x) + syz * z)
+    u = (xt * cos_minu - yt * sin_plus) + xc
+    v = (yt * cos_plus + xt * sin_minu) + yc
+
+    idx = [np.trunc(a.astype(np.float64) + 0.5).astype(int) for a in (w, u, v)]
+    valid = np.all([(i >= 0) & (i < s) for i, s in zip(idx, sh)], axis=0)
+    out = np.zeros(img.shape[:-3] + tuple(patch_size), dtype=img.dtype)
+    out[..., valid] = img[(Ellipsis,) + tuple(i[valid] for i in idx)]
+    return out
+
+
+def reference_label(lab, patch_size, size, params):
+    """Reference warp of a label centered in an image of spatial size."""
+    off = [(s - l) // 2 for s, l in zip(size, lab.shape[-3:])]
+    padded = np.zeros(lab.shape[:-3] + tuple(size), dtype=lab.dtype)
+    box = tuple(slice(o, o + l) for o, l in zip(off, lab.shape[-3:]))
+    padded[(Ellipsis,) + box] = lab
+    return reference(padded, patch_size, params)
+
+
+def warp3d(img, patch_size, params, **kwargs):
+    """warp3dFast of a (c,z,y,x) image, through the (z,c,y,x) kernel."""
+    out = warping.warp3dFast(np.transpose(img, (1,0,2,3)), patch_size,
+                             *params, **kwargs)
+    return np.transpose(out, (1,0,2,3))
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_warp3dFast(seed):
+    size, params = random_params(seed)
+    img = np.random.rand(2, *size).astype(np.float32)
+    assert np.array_equal(warp3d(img, PATCH, params),
+                          reference(img, PATCH, params))
+
+
+def test_threads():
+    size, params = random_params(0)
+    img = np.random.rand(3, *size).astype(np.float32)
+    out1 = warp3d(img, PATCH, params, threads=1)
+    out2 = warp3d(img, PATCH, params, threads=2)
+    assert np.array_equal(out1, out2)
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16, np.float32])
+def test_native_dtype(dtype):
+    size, params = random_params(1)
+    img = np.random.randint(0, 200, (2,) + size).astype(dtype)
+    out = warp3d(img, PATCH, params)
+    assert out.dtype == dtype
+    assert np.array_equal(out, reference(img, PATCH, params))
+
+
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('dtype', [np.uint32, np.uint64])
+def test_label(seed, dtype):
+    size, params = random_params(seed)
+    lsize = tuple(s - p + l for s, p, l in zip(size, PATCH, LABEL))
+    lab = np.random.randint(0, 2**31, (1,) + lsize).astype(dtype)
+    out = warping.warp3dLab(np.transpose(lab, (1,0,2,3)), LABEL, size,
+                            *params)
+    assert out.dtype == dtype
+    ref = reference_label(lab, LABEL, size, params)
+    assert np.array_equal(np.transpose(out, (1,0,2,3)), ref)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_map_gather(seed):
+    size, params = random_params(seed)
+    lsize = tuple(s - p + l for s, p, l in zip(size, PATCH, LABEL))
+    img = np.random.rand(2, *size).astype(np.float32)
+    lab = np.random.randint(0, 1000, (1,) + lsize).astype(np.uint32)
+    # One map for every key of the sample.
+    warp_map = warping.warp3dMap(size, PATCH, *params)
+    out = warping.warp3dGather(img, warp_map, PATCH, size)
+    assert np.array_equal(out, reference(img, PATCH, params))
+    out = warping.warp3dGather(lab, warp_map, LABEL, size)
+    assert np.array_equal(out, reference_label(lab, LABEL, size, params))
+
+
+def test_map_threads():
+    size, params = random_params(0)
+    img = np.random.rand(3, *size).astype(np.float32)
+    m1 = warping.warp3dMap(size, PATCH, *params, threads=1)
+    m2 = warping.warp3dMap(size, PATCH, *params, threads=2)
+    assert all(np.array_equal(a, b) for a, b in zip(m1, m2))
+    out1 = warping.warp3dGather(img, m1, PATCH, size, threads=1)
+    out2 = warping.warp3dGather(img, m1, PATCH, size, threads=2)
+    assert np.array_equal(out1, out2)
+
+
+def test_exact_coordinates():
+    # Coordinates computed once per pixel for all channels must still round
+    # to the same source pixels as the original per-pixel formula, over many
+    # warps (a per-row linear approximation misses a few of them).
+    for seed in range(200):
+        size, params = random_params(seed)
+        img = np.random.rand(3, *size).astype(np.float32)
+        warp_map = warping.warp3dMap(size, PATCH, *params)
+        ref = reference(img, PATCH, params)
+        assert np.array_equal(warp3d(img, PATCH, params), ref)
+        assert np.array_equal(warping.warp3dGather(img, warp_map, PATCH, size),
+                              ref)
+
+
+def test_strided():
+    # Views are read and written in place, in the (c,z,y,x) layout.
+    size, params = random_params(2)
+    base = np.random.rand(2, size[0], size[2], size[1]).astype(np.float32)
+    img = base[:,::-1,:,::-1].transpose(0,1,3,2)
+    warp_map = warping.warp3dMap(size, PATCH, *params)
+    out = np.zeros((2, PATCH[0], PATCH[2], PATCH[1]), dtype=np.float32)
+    view = out.transpose(0,1,3,2)[:,::-1]
+    res = warping.warp3dGather(img, warp_map, PATCH, size, out=view)
+    assert np.shares_memory(res, out)
+    ref = reference(np.ascontiguousarray(img), PATCH, params)
+    assert np.array_equal(view, ref)
+
+
+@pytest.mark.parametrize('memmap', [False, True])
+def test_apply_from_volume(memmap, tmp_path):
+    volume = np.random.rand(1, 20, 80, 80).astype(np.float32)
+    if memmap:
+        path = str(tmp_path / 'volume.npy')
+        np.save(path, volume)
+        volume = np.load(path, mmap_mode='r')
+    center = (10, 40, 40)
+    np.random.seed(0)
+    aug = augmentor.Warp()
+    out = aug.apply_from_volume(volume, center, PATCH)
+
+    # Same transformation on the cut-out input patch.
+    np.random.seed(0)
+    spec = aug.prepare({'img': PATCH}, imgs=['img'])
+    box = [slice(c - s // 2, c - s // 2 + s)
+           for c, s in zip(center, spec['img'][-3:])]
+    ref = aug({'img': np.array(volume[(slice(None),) + tuple(box)])})['img']
+    assert np.array_equal(out, ref)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_joint(seed):
+    size, params = random_params(seed)
+    lsize = tuple(s - p + l for s, p, l in zip(size, PATCH, LABEL))
+    img = np.random.rand(2, *size).astype(np.float32)
+    lab = np.random.randint(0, 1000, (1,) + lsize).astype(np.uint32)
+    out_img, out_lab = warping.warp3dJointFast([img, lab], [PATCH, LABEL],
+                                               size, *params)
+    assert np.array_equal(out_img, reference(img, PATCH, params))
+    assert out_lab.dtype == np.uint32
+    assert np.array_equal(out_lab, reference_label(lab, LABEL, size, params))
+
+
+def warp_sample(aug, seed, **kwargs):
+    spec = {'img': PATCH, 'lab': LABEL}
+    np.random.seed(seed)
+    spec = aug.prepare(spec, imgs=['img'], **kwargs)
+    rng = np.random.RandomState(seed)
+    sample = {'img': rng.rand(*spec['img']).astype(np.float32),
+              'lab': rng.randint(0, 1000, spec['lab']).astype(np.uint32)}
+    return aug(sample)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_warp_joint(seed):
+    a = warp_sample(augmentor.Warp(), seed)
+    b = warp_sample(augmentor.Warp(joint=True), seed)
+    for k in a:
+        assert np.array_equal(a[k], b[k])
+
+
+def test_warp_quantize_cache():
+    spec = {'img': PATCH}
+    aug = augmentor.Warp(quantize={'rot': 5, 'twist': 5, 'shear': 0,
+                                   'scale': 0, 'stretch': 0})
+    np.random.seed(0)
+    kwargs = dict(rot_max=10, shear_max=0, stretch_max=0, scale_max=1.0)
+    for _ in range(20):
+        aug.prepare(spec, imgs=['img'], **kwargs)
+        fresh = warping.warp3dMap(aug.size, PATCH, aug.rot, aug.shear,
+                                  aug.scale, aug.stretch, aug.twist)
+        assert all(np.array_equal(a, b) for a, b in zip(fresh, aug.warp_map))
+    assert 0 < len(aug.cache) < 20
+
+
+@pytest.mark.parametrize('kwargs', [{}, dict(rot_max=5, shear_max=1,
+                                             scale_max=1.2, stretch_max=0.05)])
+def test_warp_quantize_varies(kwargs):
+    # Every parameter keeps varying over its range, on a grid of
+    # QUANTIZE_LEVELS steps per range.
+    aug = augmentor.Warp(quantize=True)
+    np.random.seed(0)
+    values = dict((k, set()) for k in aug.QUANTIZE_PARAMS)
+    for _ in range(100):
+        aug.prepare({'img': PATCH}, imgs=['img'], **kwargs)
+        params = dict(rot=aug.rot, shear=aug.shear, twist=aug.twist,
+                      scale=aug.scale[0], stretch=aug.stretch)
+        for k, v in params.items():
+            values[k].update(np.ravel(v))
+    ranges = warping.getWarpRanges(**kwargs)
+    spans = dict(rot=ranges['rot_max'], shear=2*ranges['shear_max'],
+                 twist=2*ranges['rot_max'], scale=ranges['scale_max']-1,
+                 stretch=2*ranges['stretch_max'])
+    for k, v in values.items():
+        step = spans[k] / aug.QUANTIZE_LEVELS
+        assert len(v) >= 3
+        assert np.allclose(np.round(np.array(list(v)) / step) * step, list(v))
+
+
+def test_warp_cache_bytes():
+    nbytes = sum(a.nbytes for a in warping.warp3dMap(PATCH, PATCH))
+    aug = augmentor.Warp(quantize=True, cache_bytes=3 * nbytes)
+    np.random.seed(0)
+    for _ in range(30):
+        aug.prepare({'img': PATCH}, imgs=['img'], stretch_max=0,
+                    shear_max=0)
+        assert aug.cache_nbytes <= aug.cache_bytes
+        assert aug.cache_nbytes == sum(sum(a.nbytes for a in m)
+                                       for m in aug.cache.values())
+    assert 0 < len(aug.cache) <= 3
+
+
+def test_elastic_warp_without_displacement():
+    a = warp_sample(augmentor.Warp(), 3)
+    b = warp_sample(augmentor.ElasticWarp(sigma=0), 3)
+    for k in a:
+        assert np.array_equal(a[k], b[k])
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_elastic_warp(seed):
+    aug = augmentor.ElasticWarp(sigma=3)
+    out = warp_sample(aug, seed)
+    assert out['img'].shape == (1,) + PATCH
+    assert out['lab'].shape == (1,) + LABEL
+    assert out['lab'].dtype == np.uint32
+
+    # The linear part is the same warp as Warp's, on the same frame, and the
+    # displacements move it by at most the margin.
+    linear = augmentor.Warp()
+    warp_sample(linear, seed)
+    assert aug.size == linear.size
+    linear = linear.warp_map
+    m = aug.margin
+    assert m > 0
+    assert np.array_equal(aug.warp_map[0], linear[0])
+    for a, b in zip(aug.warp_map[1:], linear[1:]):
+        assert 0 < np.abs(a - b).max() <= m
+
+
+def test_elastic_warp_input_size():
+    aug = augmentor.ElasticWarp(sigma=3)
+    np.random.seed(0)
+    spec = aug.prepare({'img': PATCH, 'lab': LABEL}, imgs=['img'])
+    m = aug.margin
+    assert spec['img'] == aug.size[:1] + tuple(x + 2*m for x in aug.size[1:])
+    assert all(s - l == i - p for s, l, i, p in
+               zip(spec['lab'], LABEL, spec['img'], PATCH))
+
+
+@pytest.mark.parametrize('kwargs', [dict(joint=True), dict(quantize=True)])
+def test_elastic_warp_args(kwargs):
+    with pytest.raises(TypeError):
+        augmentor.ElasticWarp(**kwargs)
+
+
+def test_section_warp():
+    aug = augmentor.SectionWarp(maxsec=2)
+    np.random.seed(0)
+    aug.prepare({'img': (8, 32, 32)}, imgs=['img'])
+    img = np.random.rand(1, 8, 32, 32).astype(np.float32)
+    out = aug({'img': img.copy()})['img']
+    changed = np.any(out != img, axis=(0,2,3))
+    assert set(np.where(changed)[0]) <= set(aug.zlocs)